@@ -0,0 +1,58 @@
+"""
+批量分析: 对一个目录或清单文件中的年报 PDF 运行完整分析流水线。
+
+    python batch_analyze.py ./reports --workers 4
+    python batch_analyze.py manifest.txt --stages ingest,financial,valuation --output batch_output
+
+中断后用相同命令重新运行，已完成的文档/阶段会从 output/checkpoint.json 中恢复，不再重复调用 LLM。
+"""
+import argparse
+import json
+import logging
+import sys
+from src.core.patch import apply_monkey_patches
+
+# Same start-up order as src/main.py
+apply_monkey_patches()
+
+from src.knowledge.storage import configure_vector_backend
+configure_vector_backend()
+
+from src.agents.base_agent import crew_registry
+from src.services.batch_runner import BATCH_STAGES, run_batch
+from src.services.session_service import create_db_and_tables
+from src.services.stage_cache import STAGE_AGENT_DIRS
+from src.services.stage_control import install_crew_hooks, sweep_stale_stages
+from src.core.tracing import install_tracing_hooks
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the analysis pipeline over many annual reports.")
+    parser.add_argument("source", help="Directory of PDFs, or a manifest file with one PDF path per line")
+    parser.add_argument("--stages", default=",".join(BATCH_STAGES),
+                        help=f"Comma-separated stages (default: {','.join(BATCH_STAGES)})")
+    parser.add_argument("--workers", type=int, default=2, help="Documents processed in parallel")
+    parser.add_argument("--output", default="batch_output", help="Directory for checkpoint.json and summary.json")
+    parser.add_argument("--force", action="store_true", help="Ignore checkpoints and cached stage results")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    create_db_and_tables()
+    sweep_stale_stages(startup=True)
+    install_crew_hooks()
+    install_tracing_hooks()
+    for agent_dir in STAGE_AGENT_DIRS.values():
+        crew_registry.get(agent_dir)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    try:
+        summary = run_batch(args.source, stages=stages, workers=args.workers, output_dir=args.output, force=args.force)
+    except KeyboardInterrupt:
+        print("Interrupted. Re-run the same command to resume from the checkpoint.", file=sys.stderr)
+        return 130
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0 if summary["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
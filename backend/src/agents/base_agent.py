@@ -1,6 +1,16 @@
+import copy
+import hashlib
+import logging
+import threading
 import yaml
+from dataclasses import dataclass
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+REQUIRED_AGENT_KEYS = ("role", "goal", "backstory")
+REQUIRED_TASK_KEYS = ("description", "expected_output")
+
 class AgentConfigLoader:
     @staticmethod
     def load_yaml(file_path: Path | str) -> dict:
@@ -10,9 +20,91 @@ class AgentConfigLoader:
     @staticmethod
     def load_configs(agent_dir: Path | str):
         """
-        从指定目录加载 agents.yaml 和 tasks.yaml。
+        从指定目录加载 agents.yaml 和 tasks.yaml（经由 crew_registry 缓存，返回可自由修改的副本）。
         """
-        path = Path(agent_dir)
-        agents_config = AgentConfigLoader.load_yaml(path / "agents.yaml")
-        tasks_config = AgentConfigLoader.load_yaml(path / "tasks.yaml")
-        return agents_config, tasks_config
+        definition = crew_registry.get(agent_dir)
+        return copy.deepcopy(definition.agents_config), copy.deepcopy(definition.tasks_config)
+
+@dataclass(frozen=True)
+class CrewDefinition:
+    """
+    一个 Crew 目录解析、校验后的配置。实例不可变，由 crew_registry 在多次运行之间共享。
+    """
+    directory: Path
+    agents_config: dict
+    tasks_config: dict
+    config_hash: str
+    mtimes: tuple[int, int]
+
+    def agent_config(self, name: str) -> dict:
+        # config 中嵌套的 dict 会被 crewai 直接挂到 Agent/Task 上，每次运行给一份副本
+        return copy.deepcopy(self.agents_config[name])
+
+    def task_config(self, name: str) -> dict:
+        return copy.deepcopy(self.tasks_config[name])
+
+class CrewRegistry:
+    """
+    Crew 配置注册表: 每个目录的 YAML 只解析、校验一次；文件修改时间变化时自动重新加载。
+    """
+
+    def __init__(self):
+        self._definitions: dict[Path, CrewDefinition] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mtimes(directory: Path) -> tuple[int, int]:
+        return (
+            (directory / "agents.yaml").stat().st_mtime_ns,
+            (directory / "tasks.yaml").stat().st_mtime_ns,
+        )
+
+    def get(self, agent_dir: Path | str) -> CrewDefinition:
+        directory = Path(agent_dir).resolve()
+        mtimes = self._mtimes(directory)
+        definition = self._definitions.get(directory)
+        if definition is not None and definition.mtimes == mtimes:
+            return definition
+        with self._lock:
+            definition = self._definitions.get(directory)
+            if definition is None or definition.mtimes != mtimes:
+                definition = self._load(directory, mtimes)
+                self._definitions[directory] = definition
+            return definition
+
+    @staticmethod
+    def _load(directory: Path, mtimes: tuple[int, int]) -> CrewDefinition:
+        raw = b""
+        configs = []
+        for name in ("agents.yaml", "tasks.yaml"):
+            content = (directory / name).read_bytes()
+            raw += content
+            configs.append(yaml.safe_load(content) or {})
+        agents_config, tasks_config = configs
+
+        for name, config in agents_config.items():
+            missing = [key for key in REQUIRED_AGENT_KEYS if not (config or {}).get(key)]
+            if missing:
+                raise ValueError(f"{directory / 'agents.yaml'}: agent '{name}' 缺少字段 {missing}")
+        for name, config in tasks_config.items():
+            missing = [key for key in REQUIRED_TASK_KEYS if not (config or {}).get(key)]
+            if missing:
+                raise ValueError(f"{directory / 'tasks.yaml'}: task '{name}' 缺少字段 {missing}")
+            agent = config.get("agent")
+            if agent and agent not in agents_config:
+                raise ValueError(f"{directory / 'tasks.yaml'}: task '{name}' 引用了未定义的 agent '{agent}'")
+
+        logger.info(f"Loaded crew config from {directory}")
+        return CrewDefinition(
+            directory=directory,
+            agents_config=agents_config,
+            tasks_config=tasks_config,
+            config_hash=hashlib.sha256(raw).hexdigest(),
+            mtimes=mtimes,
+        )
+
+    def clear(self):
+        with self._lock:
+            self._definitions.clear()
+
+crew_registry = CrewRegistry()
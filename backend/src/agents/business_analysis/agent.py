@@ -1,11 +1,13 @@
 from crewai import Agent, Crew, Process, Task
-from crewai.knowledge.source.pdf_knowledge_source import PDFKnowledgeSource
+from src.knowledge.pdf_source import PageAwarePDFKnowledgeSource
 from pathlib import Path
 import os
 import logging
 from src.core.llm_factory import llm_factory
-from src.agents.base_agent import AgentConfigLoader
-from src.core.config import get_settingsfrom crewai.knowledge.knowledge_config import KnowledgeConfig
+from src.agents.base_agent import crew_registry
+from src.knowledge.citations import citation_guardrail
+from src.core.config import get_settings
+from crewai.knowledge.knowledge_config import KnowledgeConfig
 
 knowledge_config = KnowledgeConfig(results_limit=10, score_threshold=0.5)
 
@@ -15,11 +17,13 @@ knowledge_config = KnowledgeConfig(results_limit=10, score_threshold=0.5)
 
 logger = logging.getLogger(__name__)
 
+GUARDRAIL = "每一句话都必须有原文依据，严禁产生幻觉或臆想。报告必须全中文。引用格式必须为 [[Page X]]。"
+
 class BusinessAnalysisCrew:
     def __init__(self, file_paths: list[str]):
         self.file_paths = file_paths
-        self.agents_config, self.tasks_config = AgentConfigLoader.load_configs(Path(__file__).parent)
-        self.llm = llm_factory.get_llm()
+        self.definition = crew_registry.get(Path(__file__).parent)
+        self.llm = llm_factory.get_crew_llm()
 
     def run(self) -> str:
         settings = get_settings()
@@ -62,21 +66,14 @@ class BusinessAnalysisCrew:
         if not valid_paths:
             raise ValueError(f"No valid files to process. Inputs: {self.file_paths}")
 
-        embedder_config = {
-            "provider": "openai",
-            "config": {
-                "model": settings.EMBEDDING_MODEL,
-                "api_key": embedding_api_key,
-                "api_base": embedding_api_base
-            }
-        }
+        embedder_config = llm_factory.get_embedder_config()
         logger.info(f"Using Embedder Config: {embedder_config}")
 
-        knowledge_source = PDFKnowledgeSource(file_paths=valid_paths)
+        knowledge_source = PageAwarePDFKnowledgeSource(file_paths=valid_paths)
         
         # 3. 创建 Agent
         business_analyst = Agent(
-            config=self.agents_config['business_analyst'],
+            config=self.definition.agent_config('business_analyst'),
             llm=self.llm,
             knowledge_sources=[knowledge_source],
             verbose=True,
@@ -86,13 +83,14 @@ class BusinessAnalysisCrew:
 
         # 4. 创建任务
         analysis_task = Task(
-            config=self.tasks_config['analyze_business_model'],
+            config=self.definition.task_config('analyze_business_model'),
             agent=business_analyst,
-            guardrail="每一句话都必须有原文依据，严禁产生幻觉或臆想。报告必须全中文。引用格式必须为 [[Page X]]。"
+            guardrail=citation_guardrail(valid_paths, GUARDRAIL)
         )
 
         # 5. 创建 Crew
         crew = Crew(
+            name=type(self).__name__,
             agents=[business_analyst],
             tasks=[analysis_task],
             process=Process.sequential,
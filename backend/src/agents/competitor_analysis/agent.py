@@ -1,39 +1,59 @@
 from crewai import Agent, Crew, Process, Task
-from crewai.knowledge.source.pdf_knowledge_source import PDFKnowledgeSource
+from src.knowledge.pdf_source import PageAwarePDFKnowledgeSource
 from pathlib import Path
 import os
 from src.core.llm_factory import llm_factory
-from src.agents.base_agent import AgentConfigLoader
+from src.agents.base_agent import crew_registry
+from src.knowledge.citations import citation_guardrail
+from src.services.peer_store import get_peer_store
+from src.tools.peer_search_tool import PeerSearchTool
+
+GUARDRAIL = "每一句话都必须有原文依据，严禁产生幻觉或臆想。报告必须全中文。引用格式必须为 [[Page X]]。"
+# 来自同业数据库 / 程序计算比率的句子注明来源即可，不按年报页码核对，改为与比率表和同业检索结果核对
+EXTERNAL_SOURCES = ("同业数据库", "程序计算")
 
 class CompetitorCrew:
-    def __init__(self, file_paths: list[str]):
+    def __init__(self, file_paths: list[str], ratio_panel: str = "", peer_metrics: dict | None = None):
         self.file_paths = file_paths
-        self.agents_config, self.tasks_config = AgentConfigLoader.load_configs(Path(__file__).parent)
-        self.llm = llm_factory.get_llm()
+        # 由 financial_ratios 预先计算的比率表 (Markdown) 和最新一年的比率 (同业检索的默认基准)
+        self.ratio_panel = ratio_panel
+        self.peer_metrics = peer_metrics or {}
+        self.definition = crew_registry.get(Path(__file__).parent)
+        self.llm = llm_factory.get_crew_llm()
 
     def run(self) -> str:
         # Re-use the same knowledge source logic
-        knowledge_source = PDFKnowledgeSource(file_paths=self.file_paths)
+        knowledge_source = PageAwarePDFKnowledgeSource(file_paths=self.file_paths)
+
+        # 配置了本地同业库时，Agent 可以直接检索可比公司
+        tools = [PeerSearchTool(default_metrics=self.peer_metrics)] if get_peer_store() is not None else []
 
         competitor_analyst = Agent(
-            config=self.agents_config['competitor_analyst'],
+            config=self.definition.agent_config('competitor_analyst'),
             llm=self.llm,
+            tools=tools,
             knowledge_sources=[knowledge_source],
+            embedder=llm_factory.get_embedder_config(),
             verbose=True
         )
 
         analysis_task = Task(
-            config=self.tasks_config['compare_competitors'],
+            config=self.definition.task_config('compare_competitors'),
             agent=competitor_analyst,
-            guardrail="每一句话都必须有原文依据，严禁产生幻觉或臆想。报告必须全中文。引用格式必须为 [[Page X]]。"
+            guardrail=citation_guardrail(
+                self.file_paths, GUARDRAIL,
+                exempt_markers=EXTERNAL_SOURCES,
+                external_texts=lambda: [self.ratio_panel, *(result for tool in tools for result in tool.results)],
+            )
         )
 
         crew = Crew(
+            name=type(self).__name__,
             agents=[competitor_analyst],
             tasks=[analysis_task],
             process=Process.sequential,
             verbose=True
         )
 
-        result = crew.kickoff()
+        result = crew.kickoff(inputs={'ratio_panel': self.ratio_panel or "暂无"})
         return result
@@ -1,10 +1,11 @@
 from crewai import Agent, Crew, Process, Task
-from crewai.knowledge.source.pdf_knowledge_source import PDFKnowledgeSource
+from src.knowledge.pdf_source import PageAwarePDFKnowledgeSource
 from pathlib import Path
 import os
 from src.core.llm_factory import llm_factory
-from src.agents.base_agent import AgentConfigLoader
-from src.tools.financial_table_tool import FinancialTableTool
+from src.agents.base_agent import crew_registry
+from src.knowledge.citations import citation_guardrail
+from src.tools.financial_table_tool import FinancialTableTool, FinancialTablesBatchTool
 
 from src.core.config import get_settings
 
@@ -12,11 +13,13 @@ from src.core.config import get_settings
 # Monkey Patching moved to src/core/patch.py
 # ==============================================================================
 
+GUARDRAIL = "每一个数字都必须有原文依据，严禁产生幻觉或臆想。报告必须全中文。引用格式必须为 [[Page X]]。"
+
 class FinancialAnalysisCrew:
     def __init__(self, file_path: str):
         self.file_path = file_path
-        self.agents_config, self.tasks_config = AgentConfigLoader.load_configs(Path(__file__).parent)
-        self.llm = llm_factory.get_llm()
+        self.definition = crew_registry.get(Path(__file__).parent)
+        self.llm = llm_factory.get_crew_llm()
 
     def run(self) -> str:
         settings = get_settings()
@@ -44,49 +47,50 @@ class FinancialAnalysisCrew:
 
         # 1. "定位表格" 的知识源 (语义搜索)
         # Use full path
-        knowledge_source = PDFKnowledgeSource(file_paths=[self.file_path])
+        # 会话索引中有多份报告（多年模式），检索只限定在本报告的 chunk 内
+        knowledge_source = PageAwarePDFKnowledgeSource(
+            file_paths=[self.file_path], retrieval_filter={"source": Path(self.file_path).name}
+        )
         
         # 2. "提取表格" 的工具
         table_tool = FinancialTableTool()
+        batch_table_tool = FinancialTablesBatchTool()
 
         # 3. 创建 Agent
         financial_analyst = Agent(
-            config=self.agents_config['financial_analyst'],
+            config=self.definition.agent_config('financial_analyst'),
             llm=self.llm,
             knowledge_sources=[knowledge_source],
-            tools=[table_tool],
+            tools=[batch_table_tool, table_tool],
             verbose=True,
-            embedder={
-                "provider": "openai",
-                "config": {
-                    "model": settings.EMBEDDING_MODEL,
-                    "api_key": embedding_api_key,
-                    "api_base": embedding_api_base
-                }
-            }
+            embedder=llm_factory.get_embedder_config()
         )
 
         # 4. 创建任务
         locate_task = Task(
-            config=self.tasks_config['locate_financial_tables'],
+            config=self.definition.task_config('locate_financial_tables'),
             agent=financial_analyst
         )
         
         extract_task = Task(
-            config=self.tasks_config['extract_financial_data'],
+            config=self.definition.task_config('extract_financial_data'),
             agent=financial_analyst,
             context=[locate_task], # 传递定位任务的结果
-            guardrail="每一个数字都必须有原文依据，严禁产生幻觉或臆想。报告必须全中文。引用格式必须为 [[Page X]]。"
+            # 提取结果是 JSON: 不要求引用标记和中文，只核对每个数字在报告中有出处
+            guardrail=citation_guardrail(
+                [self.file_path], GUARDRAIL, require_citations=False, require_chinese=False
+            )
         )
 
         format_task = Task(
-            config=self.tasks_config['format_valuation_report'],
+            config=self.definition.task_config('format_valuation_report'),
             agent=financial_analyst,
             context=[extract_task]
         )
 
         # 5. 创建 Crew
         crew = Crew(
+            name=type(self).__name__,
             agents=[financial_analyst],
             tasks=[locate_task, extract_task, format_task],
             process=Process.sequential,
@@ -1,19 +1,24 @@
 from crewai import Agent, Crew, Process, Task
-from crewai.knowledge.source.pdf_knowledge_source import PDFKnowledgeSource
+from src.knowledge.pdf_source import PageAwarePDFKnowledgeSource
 from pathlib import Path
 import os
 from src.core.config import get_settings
 from src.core.llm_factory import llm_factory
-from src.agents.base_agent import AgentConfigLoader
+from src.agents.base_agent import crew_registry
+from src.knowledge.citations import citation_guardrail
 from src.tools.dcf_calculator_tool import DCFCalculatorTool
 
+GUARDRAIL = "每一句话都必须有原文依据，严禁产生幻觉或臆想。报告必须全中文。引用格式必须为 [[Page X]]。"
+
 class ValuationCrew:
-    def __init__(self, financial_data: dict, moat_rating: str, file_paths: list[str] = None):
+    def __init__(self, financial_data: dict, moat_rating: str, file_paths: list[str] = None, ratio_panel: str = ""):
         self.financial_data = financial_data
         self.moat_rating = moat_rating
         self.file_paths = file_paths or []
-        self.agents_config, self.tasks_config = AgentConfigLoader.load_configs(Path(__file__).parent)
-        self.llm = llm_factory.get_llm()
+        # 由 financial_ratios 预先计算的比率表 (Markdown)
+        self.ratio_panel = ratio_panel
+        self.definition = crew_registry.get(Path(__file__).parent)
+        self.llm = llm_factory.get_crew_llm()
 
     def run(self) -> str:
         # 0. Tool & Knowledge
@@ -21,6 +26,7 @@ class ValuationCrew:
         
         # Configure Knowledge Source
         knowledge_sources = []
+        valid_paths = []
         if self.file_paths:
             settings = get_settings()
             # Ensure embedding config is set (similar to BusinessAnalysisCrew)
@@ -34,17 +40,9 @@ class ValuationCrew:
             if embedding_model: os.environ["EMBEDDING_MODEL"] = embedding_model
             os.environ["OPENAI_EMBEDDING_MODEL"] = embedding_model or "text-embedding-ada-002"
 
-            embedder_config = {
-                "provider": "openai",
-                "config": {
-                    "model": embedding_model,
-                    "api_key": embedding_api_key,
-                    "api_base": embedding_api_base
-                }
-            }
+            embedder_config = llm_factory.get_embedder_config()
             
             # Verify paths
-            valid_paths = []
             knowledge_root = Path("knowledge")
             for p in self.file_paths:
                 full_path = knowledge_root / p
@@ -52,11 +50,11 @@ class ValuationCrew:
                     valid_paths.append(p)
             
             if valid_paths:
-                knowledge_sources = [PDFKnowledgeSource(file_paths=valid_paths)]
+                knowledge_sources = [PageAwarePDFKnowledgeSource(file_paths=valid_paths)]
         
         # 2. Agent
         valuation_expert = Agent(
-            config=self.agents_config['valuation_expert'],
+            config=self.definition.agent_config('valuation_expert'),
             llm=self.llm,
             tools=[dcf_tool],
             knowledge_sources=knowledge_sources,
@@ -66,13 +64,14 @@ class ValuationCrew:
 
         # 3. Task
         valuation_task = Task(
-            config=self.tasks_config['calculate_intrinsic_value'],
+            config=self.definition.task_config('calculate_intrinsic_value'),
             agent=valuation_expert,
-            guardrail="每一句话都必须有原文依据，严禁产生幻觉或臆想。报告必须全中文。引用格式必须为 [[Page X]]。"
+            guardrail=citation_guardrail(valid_paths, GUARDRAIL, check_numbers=False)
         )
 
         # 4. Crew
         crew = Crew(
+            name=type(self).__name__,
             agents=[valuation_expert],
             tasks=[valuation_task],
             process=Process.sequential,
@@ -82,6 +81,7 @@ class ValuationCrew:
         # 5. Kickoff
         result = crew.kickoff(inputs={
             'financial_data': self.financial_data,
-            'moat_rating': self.moat_rating
+            'moat_rating': self.moat_rating,
+            'ratio_panel': self.ratio_panel or "暂无",
         })
         return result
@@ -1,11 +1,23 @@
 from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException
-from src.services.session_service import create_session, get_session, update_session, list_sessions
-from src.services.title_generator import generate_session_title
+from src.services.session_service import (
+    acreate_session, aget_session, alist_sessions, aupdate_session, delete_session, get_session, update_session,
+    update_session_fields,
+)
+from src.services.title_generator import schedule_title_generation
+from src.services.ingestion_service import ingest_file, list_files, remove_file, remove_session_files
+from src.services.financial_series import extract_series, invalidate_extraction, merge_series, render_series_markdown
+from src.services.financial_store import build_dcf_inputs, save_extraction
+from src.services.financial_ratios import latest_metrics, ratio_context
+from src.services.dcf_batch import MAX_BATCH_ROWS, DCFBatchRequest, value_batch
+from src.services.stage_cache import STAGE_FIELDS, get_stage_result, invalidate_stage_result, store_stage_result
+from src.services.stage_control import StageCancelled, request_cancel, stage_run
+from src.core.memory import memory_profiler
+from src.core.tracing import chrome_trace, collapsed_stacks, summarize, tracer
 from src.agents.business_analysis.agent import BusinessAnalysisCrew
-from src.agents.financial_analysis.agent import FinancialAnalysisCrew
 from src.agents.valuation.agent import ValuationCrew
 from src.agents.mda_analysis.agent import MDACrew
 from src.agents.competitor_analysis.agent import CompetitorCrew
+import asyncio
 import shutil
 import os
 import json
@@ -16,13 +28,13 @@ os.makedirs(UPLOAD_ROOT, exist_ok=True)
 
 @router.get("/sessions")
 async def get_all_sessions():
-    return list_sessions()
+    return await alist_sessions()
 
 @router.post("/upload")
 async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     # 1. Create Session First to get ID
     # Use placeholder path initially
-    session = create_session(file_path="", file_name=file.filename)
+    session = await acreate_session(file_path="", file_name=file.filename)
     
     # 2. Create Session Directory
     session_dir = os.path.join(UPLOAD_ROOT, session.id)
@@ -39,16 +51,18 @@ async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File
     # Update the single path field used by create_session (which sets file_paths_json)
     # Since create_session is already done, we update via property
     session.file_paths = [abs_path]
-    update_session(session)
+    await aupdate_session(session)
     
-    # Trigger Title Generation
-    background_tasks.add_task(generate_session_title, session.id, abs_path)
+    # Trigger Title Generation (asyncio task: waiting on the LLM costs no worker thread)
+    schedule_title_generation(session.id, abs_path)
+    # Parse & embed this file ahead of the first analysis run
+    background_tasks.add_task(ingest_file, session.id, abs_path)
     
     return {"session_id": session.id, "message": "文件上传成功", "file_path": f"/static/{session.id}/{file.filename}"}
 
 @router.post("/session/{session_id}/upload")
-async def add_file_to_session(session_id: str, file: UploadFile = File(...)):
-    session = get_session(session_id)
+async def add_file_to_session(session_id: str, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    session = await aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话未找到")
         
@@ -66,13 +80,16 @@ async def add_file_to_session(session_id: str, file: UploadFile = File(...)):
     if abs_path not in current_paths:
         current_paths.append(abs_path)
         session.file_paths = current_paths
-        update_session(session)
+        await aupdate_session(session)
+    
+    # Only the new (or overwritten) file is parsed and embedded
+    background_tasks.add_task(ingest_file, session_id, abs_path)
         
     return {"message": "文件添加成功", "file_paths": session.file_paths}
 
 @router.delete("/session/{session_id}/file")
 async def delete_file_from_session(session_id: str, filename: str):
-    session = get_session(session_id)
+    session = await aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话未找到")
     
@@ -93,7 +110,10 @@ async def delete_file_from_session(session_id: str, filename: str):
         raise HTTPException(status_code=404, detail="文件在会话中未找到")
         
     session.file_paths = new_paths
-    update_session(session)
+    await aupdate_session(session)
+    
+    # Drop only this file's vectors and cached pages
+    await asyncio.to_thread(remove_file, session_id, target_path)
     
     # Optionally delete from disk
     if target_path and os.path.exists(target_path):
@@ -104,6 +124,13 @@ async def delete_file_from_session(session_id: str, filename: str):
     
     return {"message": "文件删除成功", "file_paths": session.file_paths}
 
+@router.get("/session/{session_id}/files")
+async def get_session_files(session_id: str):
+    session = await aget_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="会话未找到")
+    return await asyncio.to_thread(list_files, session_id)
+
 # Helper to convert absolute paths to knowledge-relative paths
 def _to_knowledge_relative(file_paths: list[str]) -> list[str]:
     # We want "session_id/filename.pdf" or just "filename.pdf" depending on structure
@@ -139,6 +166,40 @@ def _to_knowledge_relative_single(file_path: str) -> str:
     res = _to_knowledge_relative([file_path])
     return res[0] if res else file_path
 
+def _restore_cached_stage(session, stage: str, inputs: dict | None = None) -> bool:
+    """
+    输入文件、提示词配置、模型和阶段输入都未变化时，直接用缓存的结果完成该阶段。
+    会对文件做哈希并写数据库，路由中通过 asyncio.to_thread 调用。
+    """
+    cached = get_stage_result(stage, session.file_paths, inputs)
+    if not cached:
+        return False
+    with tracer.span(stage, "stage", trace_id=session.id, cache_hit=True):
+        pass
+    result_field, status_field = STAGE_FIELDS[stage]
+    setattr(session, result_field, cached["result"])
+    for field, value in cached.get("extra", {}).items():
+        setattr(session, field, value)
+    setattr(session, status_field, "COMPLETED")
+    update_session(session)
+    return True
+
+def _valuation_inputs(session) -> dict | None:
+    # Inputs come from the line items stored by the financial stage (no LLM call)
+    financial_data = build_dcf_inputs(session.file_paths)
+    if financial_data is None:
+        return None
+    return {"financial_data": financial_data, "moat_rating": session.moat_rating or "Narrow"}
+
+def _competitor_inputs(ratio_panel: str) -> dict:
+    # 比率表随财务阶段提取的科目变化；文件不变但重新提取后，竞争分析也要重新运行
+    return {"ratio_panel": ratio_panel}
+
+def _record_cancelled(session_id: str, stage: str, e: StageCancelled):
+    # 取消 / 超时 / 超出预算不是错误: 状态记为 CANCELLED / TIMEOUT / BUDGET_EXCEEDED，结果栏只写原因
+    result_field, status_field = STAGE_FIELDS[stage]
+    update_session_fields(session_id, **{status_field: e.status, result_field: e.reason})
+
 # Helper Tasks
 # ...
 def _run_business_analysis_task(session_id: str, file_paths: list[str]):
@@ -148,34 +209,31 @@ def _run_business_analysis_task(session_id: str, file_paths: list[str]):
         if not session:
             return
             
-        session.business_status = "RUNNING"
-        update_session(session)
+        with stage_run(session_id, "business"):
+            update_session_fields(session_id, business_status="RUNNING")
         
-        # Convert to relative paths for CrewAI
-        rel_paths = _to_knowledge_relative(file_paths)
-        print(f"DEBUG: Running Business Analysis with paths: {rel_paths}")
+            # Convert to relative paths for CrewAI
+            rel_paths = _to_knowledge_relative(file_paths)
+            print(f"DEBUG: Running Business Analysis with paths: {rel_paths}")
         
-        crew = BusinessAnalysisCrew(file_paths=rel_paths)
-        result = crew.run()
+            crew = BusinessAnalysisCrew(file_paths=rel_paths)
+            result = crew.run()
         
-        session.business_analysis_result = str(result)
-        session.business_status = "COMPLETED"
-        update_session(session)
+            update_session_fields(session_id, business_analysis_result=str(result), business_status="COMPLETED")
+            store_stage_result("business", file_paths, str(result))
         
+    except StageCancelled as e:
+        _record_cancelled(session_id, "business", e)
     except Exception as e:
         print(f"Error in business analysis task: {e}")
         import traceback
         traceback.print_exc()
-        session = get_session(session_id)
-        if session:
-            session.business_status = "FAILED"
-            # Optional: Store error message in result or separate field
-            session.business_analysis_result = f"Error: {str(e)}"
-            update_session(session)
+        # Optional: Store error message in result or separate field
+        update_session_fields(session_id, business_status="FAILED", business_analysis_result=f"Error: {str(e)}")
 
 @router.post("/analyze/{session_id}/business")
-async def run_business_analysis(session_id: str, background_tasks: BackgroundTasks):
-    session = get_session(session_id)
+async def run_business_analysis(session_id: str, background_tasks: BackgroundTasks, force: bool = False):
+    session = await aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话未找到")
     
@@ -183,37 +241,55 @@ async def run_business_analysis(session_id: str, background_tasks: BackgroundTas
     if session.business_status == "RUNNING":
          return {"status": "RUNNING", "message": "分析正在进行中"}
 
+    if not force and await asyncio.to_thread(_restore_cached_stage, session, "business"):
+        return {"status": "COMPLETED", "message": "商业模式分析已完成（缓存）", "cached": True}
+
     background_tasks.add_task(_run_business_analysis_task, session_id, session.file_paths)
     
     return {"status": "PENDING", "message": "商业模式分析已启动"}
 
-def _run_financial_analysis_task(session_id: str, file_path: str):
+def _run_financial_analysis_task(session_id: str, file_paths: list[str], force: bool = False):
     try:
         session = get_session(session_id)
         if not session: return
-        session.financial_status = "RUNNING"
-        update_session(session)
+        with stage_run(session_id, "financial"):
+            update_session_fields(session_id, financial_status="RUNNING")
         
-        # Relative path
-        rel_path = _to_knowledge_relative_single(file_path)
+            # One worker per report; each report's extraction is cached by document hash
+            files = list(zip(file_paths, _to_knowledge_relative(file_paths)))
+            entries = extract_series(files, force=force)
+            series = merge_series(entries)
+            for entry in entries:
+                save_extraction(entry, overwrite=force)
         
-        crew = FinancialAnalysisCrew(file_path=rel_path)
-        result = crew.run()
+            if len(entries) == 1:
+                result = entries[0]["report"]
+            else:
+                # Multi-year mode: aligned time series followed by each year's report
+                entries = sorted(entries, key=lambda e: e["fiscal_year"] or 0)
+                sections = [render_series_markdown(series)]
+                for entry in entries:
+                    sections.append(f"## {entry['fiscal_year'] or entry['file']}\n\n{entry['report']}")
+                result = "\n\n".join(sections)
         
-        session.financial_analysis_result = str(result)
-        session.financial_status = "COMPLETED"
-        update_session(session)
+            extracted_financial_data = json.dumps(series, ensure_ascii=False)
+            update_session_fields(
+                session_id,
+                financial_analysis_result=result,
+                extracted_financial_data=extracted_financial_data,
+                financial_status="COMPLETED",
+            )
+            store_stage_result("financial", file_paths, result,
+                               extra={"extracted_financial_data": extracted_financial_data})
+    except StageCancelled as e:
+        _record_cancelled(session_id, "financial", e)
     except Exception as e:
         print(f"Error in financial task: {e}")
-        session = get_session(session_id)
-        if session:
-            session.financial_status = "FAILED"
-            session.financial_analysis_result = f"Error: {e}"
-            update_session(session)
+        update_session_fields(session_id, financial_status="FAILED", financial_analysis_result=f"Error: {e}")
 
 @router.post("/analyze/{session_id}/financial")
-async def run_financial_analysis(session_id: str, background_tasks: BackgroundTasks):
-    session = get_session(session_id)
+async def run_financial_analysis(session_id: str, background_tasks: BackgroundTasks, force: bool = False):
+    session = await aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话未找到")
     
@@ -223,41 +299,44 @@ async def run_financial_analysis(session_id: str, background_tasks: BackgroundTa
     if session.financial_status == "RUNNING":
          return {"status": "RUNNING", "message": "分析正在进行中"}
 
-    background_tasks.add_task(_run_financial_analysis_task, session_id, session.file_paths[0])
+    if not force and await asyncio.to_thread(_restore_cached_stage, session, "financial"):
+        return {"status": "COMPLETED", "message": "财务分析已完成（缓存）", "cached": True}
+
+    background_tasks.add_task(_run_financial_analysis_task, session_id, session.file_paths, force)
     return {"status": "PENDING", "message": "财务分析已启动"}
 
 def _run_mda_analysis_task(session_id: str, file_paths: list[str]):
     try:
         session = get_session(session_id)
         if not session: return
-        session.mda_status = "RUNNING"
-        update_session(session)
+        with stage_run(session_id, "mda"):
+            update_session_fields(session_id, mda_status="RUNNING")
         
-        rel_paths = _to_knowledge_relative(file_paths)
+            rel_paths = _to_knowledge_relative(file_paths)
         
-        crew = MDACrew(file_paths=rel_paths)
-        result = crew.run()
+            crew = MDACrew(file_paths=rel_paths)
+            result = crew.run()
         
-        session.mda_analysis_result = str(result)
-        session.mda_status = "COMPLETED"
-        update_session(session)
+            update_session_fields(session_id, mda_analysis_result=str(result), mda_status="COMPLETED")
+            store_stage_result("mda", file_paths, str(result))
+    except StageCancelled as e:
+        _record_cancelled(session_id, "mda", e)
     except Exception as e:
         print(f"Error in MDA task: {e}")
-        session = get_session(session_id)
-        if session:
-            session.mda_status = "FAILED"
-            session.mda_analysis_result = f"Error: {e}"
-            update_session(session)
+        update_session_fields(session_id, mda_status="FAILED", mda_analysis_result=f"Error: {e}")
 
 @router.post("/analyze/{session_id}/mda")
-async def run_mda_analysis(session_id: str, background_tasks: BackgroundTasks):
-    session = get_session(session_id)
+async def run_mda_analysis(session_id: str, background_tasks: BackgroundTasks, force: bool = False):
+    session = await aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
         
     if session.mda_status == "RUNNING":
          return {"status": "RUNNING", "message": "分析正在进行中"}
 
+    if not force and await asyncio.to_thread(_restore_cached_stage, session, "mda"):
+        return {"status": "COMPLETED", "message": "MD&A 分析已完成（缓存）", "cached": True}
+
     background_tasks.add_task(_run_mda_analysis_task, session_id, session.file_paths)
     return {"status": "PENDING", "message": "MD&A 分析已启动"}
 
@@ -265,33 +344,38 @@ def _run_competitor_analysis_task(session_id: str, file_paths: list[str]):
     try:
         session = get_session(session_id)
         if not session: return
-        session.competitor_status = "RUNNING"
-        update_session(session)
+        with stage_run(session_id, "competitor"):
+            update_session_fields(session_id, competitor_status="RUNNING")
         
-        rel_paths = _to_knowledge_relative(file_paths)
+            rel_paths = _to_knowledge_relative(file_paths)
         
-        crew = CompetitorCrew(file_paths=rel_paths)
-        result = crew.run()
+            # 比率由已提取的科目直接计算，不让 LLM 做算术
+            ratio_panel = ratio_context(file_paths)
+            crew = CompetitorCrew(
+                file_paths=rel_paths, ratio_panel=ratio_panel, peer_metrics=latest_metrics(file_paths),
+            )
+            result = crew.run()
         
-        session.competitor_analysis_result = str(result)
-        session.competitor_status = "COMPLETED"
-        update_session(session)
+            update_session_fields(session_id, competitor_analysis_result=str(result), competitor_status="COMPLETED")
+            store_stage_result("competitor", file_paths, str(result), inputs=_competitor_inputs(ratio_panel))
+    except StageCancelled as e:
+        _record_cancelled(session_id, "competitor", e)
     except Exception as e:
         print(f"Error in competitor task: {e}")
-        session = get_session(session_id)
-        if session:
-            session.competitor_status = "FAILED"
-            session.competitor_analysis_result = f"Error: {e}"
-            update_session(session)
+        update_session_fields(session_id, competitor_status="FAILED", competitor_analysis_result=f"Error: {e}")
 
 @router.post("/analyze/{session_id}/competitor")
-async def run_competitor_analysis(session_id: str, background_tasks: BackgroundTasks):
-    session = get_session(session_id)
+async def run_competitor_analysis(session_id: str, background_tasks: BackgroundTasks, force: bool = False):
+    session = await aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
         
     if session.competitor_status == "RUNNING":
          return {"status": "RUNNING", "message": "分析正在进行中"}
+
+    inputs = _competitor_inputs(await asyncio.to_thread(ratio_context, session.file_paths))
+    if not force and await asyncio.to_thread(_restore_cached_stage, session, "competitor", inputs):
+        return {"status": "COMPLETED", "message": "竞争对手分析已完成（缓存）", "cached": True}
          
     background_tasks.add_task(_run_competitor_analysis_task, session_id, session.file_paths)
     return {"status": "PENDING", "message": "竞争对手分析已启动"}
@@ -300,61 +384,166 @@ def _run_valuation_task(session_id: str, financial_data: dict, moat_rating: str,
     try:
         session = get_session(session_id)
         if not session: return
-        session.valuation_status = "RUNNING"
-        update_session(session)
+        with stage_run(session_id, "valuation"):
+            update_session_fields(session_id, valuation_status="RUNNING")
         
-        # Convert paths
-        rel_paths = _to_knowledge_relative(file_paths)
+            # Convert paths
+            rel_paths = _to_knowledge_relative(file_paths)
         
-        crew = ValuationCrew(financial_data=financial_data, moat_rating=moat_rating, file_paths=rel_paths)
-        result = crew.run()
+            crew = ValuationCrew(
+                financial_data=financial_data, moat_rating=moat_rating, file_paths=rel_paths,
+                ratio_panel=ratio_context(file_paths),
+            )
+            result = crew.run()
         
-        session.valuation_result = str(result)
-        session.valuation_status = "COMPLETED"
-        update_session(session)
+            update_session_fields(session_id, valuation_result=str(result), valuation_status="COMPLETED")
+            store_stage_result("valuation", file_paths, str(result),
+                               inputs={"financial_data": financial_data, "moat_rating": moat_rating})
+    except StageCancelled as e:
+        _record_cancelled(session_id, "valuation", e)
     except Exception as e:
         print(f"Error in valuation task: {e}")
-        session = get_session(session_id)
-        if session:
-            session.valuation_status = "FAILED"
-            session.valuation_result = f"Error: {e}"
-            update_session(session)
+        update_session_fields(session_id, valuation_status="FAILED", valuation_result=f"Error: {e}")
 
 @router.post("/analyze/{session_id}/valuation")
-async def run_valuation(session_id: str, background_tasks: BackgroundTasks):
-    session = get_session(session_id)
+async def run_valuation(session_id: str, background_tasks: BackgroundTasks, force: bool = False):
+    session = await aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话未找到")
         
     if session.valuation_status == "RUNNING":
          return {"status": "RUNNING", "message": "分析正在进行中"}
     
-    # 模拟数据流
-    financial_data = {
-        "net_income": 1000000, 
-        "depreciation_amortization": 200000, 
-        "capex": 150000,
-        "growth_rate": 0.05,
-        "discount_rate": 0.10,
-        "terminal_growth_rate": 0.02,
-        "years": 10
-    }
-    moat_rating = "Narrow"
+    inputs = await asyncio.to_thread(_valuation_inputs, session)
+    if inputs is None:
+        raise HTTPException(status_code=400, detail="缺少财务数据，请先完成财务分析")
+
+    if not force and await asyncio.to_thread(_restore_cached_stage, session, "valuation", inputs):
+        return {"status": "COMPLETED", "message": "估值分析已完成（缓存）", "cached": True}
     
-    background_tasks.add_task(_run_valuation_task, session_id, financial_data, moat_rating, session.file_paths)
+    background_tasks.add_task(_run_valuation_task, session_id, inputs["financial_data"], inputs["moat_rating"], session.file_paths)
     return {"status": "PENDING", "message": "估值分析已启动"}
 
+@router.post("/valuation/batch")
+async def run_valuation_batch(request: DCFBatchRequest):
+    """
+    批量所有者收益 DCF（不调用 LLM）: 每行是 DCFCalculatorTool 的输入，一次向量化计算，
+    按输入顺序返回所有者收益、预测期现值、终值及其现值和内在价值。
+    """
+    if len(request.rows) > MAX_BATCH_ROWS:
+        raise HTTPException(status_code=413, detail=f"单次最多 {MAX_BATCH_ROWS} 行")
+    results = await asyncio.to_thread(value_batch, request.rows)
+    return {
+        "count": len(results),
+        "errors": sum(1 for r in results if r["error"]),
+        "results": results,
+    }
+
+@router.post("/analyze/{session_id}/{stage}/cancel")
+async def cancel_stage(session_id: str, stage: str):
+    session = await aget_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="会话未找到")
+    if stage not in STAGE_FIELDS:
+        raise HTTPException(status_code=400, detail=f"未知的分析阶段: {stage}")
+
+    _, status_field = STAGE_FIELDS[stage]
+    if getattr(session, status_field) != "RUNNING":
+        return {"status": getattr(session, status_field), "message": "该阶段未在运行"}
+
+    request_cancel(session_id, stage)
+    return {"status": "CANCELLING", "message": "已请求取消，当前步骤结束后停止"}
+
+@router.delete("/session/{session_id}/cache")
+async def invalidate_session_cache(session_id: str, stage: str | None = None):
+    """
+    清除会话当前输入对应的阶段缓存（不传 stage 时清除全部阶段）。
+    清除财务阶段时同时清除各报告的提取缓存。
+    """
+    session = await aget_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="会话未找到")
+    if stage is not None and stage not in STAGE_FIELDS:
+        raise HTTPException(status_code=400, detail=f"未知的分析阶段: {stage}")
+
+    invalidated = await asyncio.to_thread(_invalidate_stages, session, [stage] if stage else list(STAGE_FIELDS))
+    return {"message": "缓存已清除", "invalidated": invalidated}
+
+def _invalidate_stages(session, stages: list[str]) -> list[str]:
+    # 计算缓存 key 需要对文件做哈希、读取财务数据，在线程中执行
+    invalidated = []
+    for name in stages:
+        inputs = None
+        if name == "valuation":
+            inputs = _valuation_inputs(session)
+            if inputs is None:
+                continue
+        elif name == "competitor":
+            inputs = _competitor_inputs(ratio_context(session.file_paths))
+        if invalidate_stage_result(name, session.file_paths, inputs):
+            invalidated.append(name)
+        if name == "financial":
+            for path in session.file_paths:
+                if os.path.exists(path):
+                    invalidate_extraction(path)
+    return invalidated
+
+@router.delete("/session/{session_id}")
+async def delete_session_route(session_id: str):
+    """
+    删除会话: 上传的文件、向量索引（共享 chunk 按引用计数回收）、页面缓存和数据库记录。
+    按文件哈希保存的阶段缓存和财务数据可被其他会话复用，不在此删除。
+    """
+    session = await aget_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="会话未找到")
+    running = [stage for stage, (_, status_field) in STAGE_FIELDS.items() if getattr(session, status_field) == "RUNNING"]
+    if running:
+        raise HTTPException(status_code=409, detail=f"以下分析阶段仍在运行，请先取消: {', '.join(running)}")
+
+    await asyncio.to_thread(remove_session_files, session_id)
+    shutil.rmtree(os.path.join(UPLOAD_ROOT, session_id), ignore_errors=True)
+    await asyncio.to_thread(delete_session, session_id)
+    return {"message": "会话已删除", "session_id": session_id}
+
 @router.get("/session/{session_id}")
 async def get_session_status(session_id: str):
-    session = get_session(session_id)
+    session = await aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话未找到")
     return session
 
+@router.get("/admin/memory")
+async def get_memory_profile(session_id: str | None = None):
+    """
+    分阶段内存剖析结果 (需开启 MEMORY_PROFILING): 当前 / 峰值 RSS，按阶段和会话的汇总，以及最近的运行记录。
+    """
+    return memory_profiler.report(session_id)
+
+@router.get("/session/{session_id}/trace")
+async def get_session_trace(session_id: str, format: str = "summary"):
+    """
+    会话的 span 追踪 (需开启 TRACING)。format: summary（按类型汇总）| spans（原始记录）|
+    collapsed（火焰图 collapsed stack，可直接交给 flamegraph.pl / speedscope）| chrome（chrome://tracing / Perfetto）。
+    """
+    if format not in ("summary", "spans", "collapsed", "chrome"):
+        raise HTTPException(status_code=400, detail="format 必须是 summary / spans / collapsed / chrome 之一")
+    spans = await asyncio.to_thread(tracer.load, session_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="该会话没有追踪记录")
+    if format == "collapsed":
+        from fastapi.responses import PlainTextResponse
+        return PlainTextResponse(collapsed_stacks(spans))
+    if format == "chrome":
+        return chrome_trace(spans)
+    if format == "spans":
+        return spans
+    return summarize(spans)
+
 # Export/Import logic
 @router.get("/export/{session_id}")
 async def export_session(session_id: str):
-    session = get_session(session_id)
+    session = await aget_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话未找到")
     
@@ -398,14 +587,13 @@ async def export_session(session_id: str):
     )
 
 @router.post("/import")
-async def import_session(file: UploadFile = File(...)):
+async def import_session(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     import zipfile
     import io
     import json
     import shutil
     import os
     from src.models.session import AnalysisSession
-    from src.services.session_service import update_session # Reuse update/save
     
     try:
         content = await file.read()
@@ -451,13 +639,11 @@ async def import_session(file: UploadFile = File(...)):
                 session_obj.file_paths = restored_paths
             
             # Upsert
-            existing = get_session(session_obj.id)
-            if existing:
-                update_session(session_obj)
-            else:
-                # Add new session explicitly
-                # Our service 'update_session' uses session.add/commit which works for new entities with set IDs too
-                update_session(session_obj)
+            # Our service 'update_session' merges new (not yet loaded) objects, which upserts by ID
+            await aupdate_session(session_obj)
+            
+            for restored_path in restored_paths:
+                background_tasks.add_task(ingest_file, session_obj.id, restored_path)
                 
             return {"session_id": session_obj.id, "message": "导入成功"}
             
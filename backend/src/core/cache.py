@@ -0,0 +1,43 @@
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from .config import get_settings
+
+settings = get_settings()
+
+class JsonFileCache:
+    """
+    简单的磁盘 JSON 缓存：每个 key 一个文件，原子写入，多进程可共享。
+    """
+
+    def __init__(self, namespace: str):
+        self.directory = Path(settings.CACHE_DIR) / namespace
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> dict | None:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set(self, key: str, value: dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.directory / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+
+    def delete(self, key: str) -> bool:
+        try:
+            self._path(key).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
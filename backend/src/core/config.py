@@ -7,15 +7,96 @@ class Settings(BaseSettings):
     
     # 数据库
     DATABASE_URL: str = "sqlite:///./value_analyst.db"
+    DB_ECHO: bool = False
+    # 连接池 (后台任务线程与请求共享)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    # SQLite 写锁冲突时的等待时间
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    # 路由使用异步会话 (需要 aiosqlite / asyncpg，未安装时在线程中执行同步查询)
+    DB_ASYNC: bool = True
     
     # ChromaDB (向量数据库)
     CHROMA_SERVER_HOST: str = "localhost"
     CHROMA_SERVER_HTTP_PORT: int = 8000
+
+    # Knowledge 向量后端: "chroma" (CrewAI 默认) 或 "mmap" (进程内内存映射索引)
+    VECTOR_BACKEND: str = "chroma"
+    VECTOR_INDEX_DIR: str = "./vector_index"
+    # mmap 索引的向量存储精度: "none" (float32) / "float16" / "int8"；重排系数 > 1 时保留 float32 副本重排候选
+    VECTOR_QUANTIZATION: str = "none"
+    VECTOR_RERANK_FACTOR: int = 4
+    # 跨会话共享 chunk 库 (仅 mmap 后端): 正文相同的 chunk 只 embedding、存储一次，会话索引只保存引用；默认放在 VECTOR_INDEX_DIR/_shared
+    SHARED_CHUNK_STORE: bool = True
+    SHARED_CHUNK_DIR: str | None = None
+    # 解析后的 PDF 页面缓存 (按文件内容哈希)
+    PAGE_CACHE_DIR: str = "./page_cache"
+    # 逐页解析 PDF 时的进程内存上限 (MB)，0 表示不限制
+    PDF_MEMORY_LIMIT_MB: int = 0
+    # 分析结果缓存 (按文档哈希等)
+    CACHE_DIR: str = "./cache"
+
+    # 检索后处理 (仅 mmap 后端): 近似去重阈值、相邻 chunk 合并、按 token 预算打包 (0 表示不限制)
+    RETRIEVAL_POSTPROCESS: bool = True
+    RETRIEVAL_DEDUP_THRESHOLD: float = 0.95
+    RETRIEVAL_TOKEN_BUDGET: int = 4000
+    RETRIEVAL_OVERFETCH: int = 2
+    # 查询 embedding 的 LRU 缓存条数 (0 表示关闭)，mmap 和 chroma 两种向量后端都生效；
+    # 开启持久化时保存在 CACHE_DIR/query_embeddings，跨进程 / 重启共享
+    QUERY_EMBEDDING_CACHE_SIZE: int = 2048
+    QUERY_EMBEDDING_CACHE_PERSIST: bool = False
+
+    # 引用校验: 用本地的 [[Page X]] 引用核对代替 LLM guardrail；无依据句子占比超过阈值时重试
+    CITATION_VERIFIER: bool = True
+    CITATION_MAX_UNSUPPORTED_RATIO: float = 0.2
+    CITATION_MAX_RETRIES: int = 1
+
+    # 多年报告并行提取的最大并发数
+    FINANCIAL_MAX_WORKERS: int = 4
+    # 批量表格提取时并发的 LLM 调用数
+    FINANCIAL_TABLE_MAX_WORKERS: int = 4
+
+    # 本地同业公司库: 目录中的 parquet / feather / csv 文件 (列: code, name, industry[, industry_name, fiscal_year] + 指标列)
+    PEER_DATA_DIR: str | None = None
+
+    # 分阶段内存剖析: 每次运行记录 RSS；按抽样率开启 tracemalloc 记录新增内存最多的代码行 (抽样越低开销越小)
+    MEMORY_PROFILING: bool = False
+    MEMORY_PROFILE_SAMPLE_RATE: float = 0.1
+    MEMORY_PROFILE_TOP_N: int = 10
+    MEMORY_PROFILE_TRACE_FRAMES: int = 1
+    MEMORY_PROFILE_HISTORY: int = 500
+    MEMORY_PROFILE_LOG: str | None = "./logs/memory_profile.jsonl"
+
+    # 层级 span 追踪 (阶段 -> Crew -> Task -> Agent step -> 工具 / LLM / embedding)，每个会话一个 JSONL 文件
+    TRACING: bool = False
+    TRACE_DIR: str = "./logs/traces"
+
+    # 会话标题: 封面页规则识别的置信度达到阈值时不调用 LLM；可选的本地公司名称字典 (CSV: 证券代码,公司简称)
+    TITLE_HEURISTIC_MIN_CONFIDENCE: float = 0.75
+    COMPANY_NAMES_FILE: str | None = None
+
+    # 分析阶段的运行上限 (0 表示不限制)，可按阶段覆盖: STAGE_TIMEOUTS='{"financial": 3600}'
+    STAGE_TIMEOUT_SECONDS: int = 1800
+    STAGE_TOKEN_BUDGET: int = 0
+    STAGE_TIMEOUTS: dict[str, int] = {}
+    STAGE_TOKEN_BUDGETS: dict[str, int] = {}
+    # 心跳间隔；超过 STAGE_STALE_AFTER 秒没有心跳的 RUNNING 阶段视为已中断
+    STAGE_HEARTBEAT_INTERVAL: float = 10.0
+    STAGE_STALE_AFTER: float = 120.0
+    STAGE_SWEEP_INTERVAL: float = 60.0
     
     # LLM Configuration (OpenAI Compatible)
     LLM_API_KEY: str | None = None
     LLM_API_BASE: str = "https://api.openai.com/v1"
     LLM_MODEL: str = "gpt-4"
+
+    # LLM HTTP 连接池 (所有 LLM 客户端共享)
+    LLM_HTTP_MAX_CONNECTIONS: int = 50
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    LLM_HTTP_TIMEOUT: float = 120.0
     
     # Embedding Configuration
     EMBEDDING_API_KEY: str | None = None
@@ -0,0 +1,28 @@
+import hashlib
+import os
+import threading
+
+_file_hash_cache: dict[tuple[str, int, int], str] = {}
+_file_hash_lock = threading.Lock()
+
+
+def file_sha256(path: str | os.PathLike) -> str:
+    """
+    计算文件内容的 SHA-256。按 (路径, 大小, mtime) 缓存，同一文件未修改时不重复读盘。
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _file_hash_lock:
+        cached = _file_hash_cache.get(key)
+    if cached:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    result = digest.hexdigest()
+    with _file_hash_lock:
+        _file_hash_cache[key] = result
+    return result
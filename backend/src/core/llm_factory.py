@@ -1,34 +1,141 @@
-import os
+import threading
+import httpx
+from crewai import LLM
 from langchain_openai import ChatOpenAI
+from openai import AsyncOpenAI, OpenAI
 from .config import get_settings
+from .tracing import langchain_callbacks
 
 settings = get_settings()
 
 class LLMFactory:
+    """
+    进程级 LLM 客户端注册表。
+
+    按 (model, api_base, temperature) 缓存客户端实例，所有实例共享同一组带连接池的
+    httpx 客户端，从而在线程和异步任务之间复用 HTTP keep-alive / TLS 会话。
+    配置全部显式传入，不再写入 os.environ。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chat_models: dict[tuple, ChatOpenAI] = {}
+        self._crew_llms: dict[tuple, LLM] = {}
+        self._http_client: httpx.Client | None = None
+        self._async_http_client: httpx.AsyncClient | None = None
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+        )
+
+    def get_http_client(self) -> httpx.Client:
+        """共享的同步 HTTP 连接池。阶段内发出的请求受阶段截止时间约束（见 stage_control）。"""
+        from src.services.stage_control import stage_deadline_hook
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    limits=self._limits(), timeout=settings.LLM_HTTP_TIMEOUT,
+                    event_hooks={"request": [stage_deadline_hook]},
+                )
+            return self._http_client
+
+    def get_async_http_client(self) -> httpx.AsyncClient:
+        """共享的异步 HTTP 连接池。"""
+        from src.services.stage_control import astage_deadline_hook
+        with self._lock:
+            if self._async_http_client is None:
+                self._async_http_client = httpx.AsyncClient(
+                    limits=self._limits(), timeout=settings.LLM_HTTP_TIMEOUT,
+                    event_hooks={"request": [astage_deadline_hook]},
+                )
+            return self._async_http_client
+
     @staticmethod
-    def get_llm():
+    def _resolve(model: str | None, api_base: str | None) -> tuple[str, str]:
+        if not settings.LLM_API_KEY:
+            raise ValueError("LLM_API_KEY 未设置")
+        return model or settings.LLM_MODEL, api_base or settings.LLM_API_BASE
+
+    def get_llm(self, model: str | None = None, api_base: str | None = None,
+                temperature: float = 0.1) -> ChatOpenAI:
         """
-        返回兼容 CrewAI 的 LangChain Chat 对象。
+        返回共享的 LangChain Chat 对象（供工具、标题生成等直接调用使用）。
         使用通用的 OpenAI 兼容配置（适用于 OpenAI, 阿里云等）。
         """
-        if not settings.LLM_API_KEY:
-            raise ValueError("LLM_API_KEY 未设置")
+        model, api_base = self._resolve(model, api_base)
+        key = (model, api_base, temperature)
+        chat_model = self._chat_models.get(key)
+        if chat_model is not None:
+            return chat_model
 
-        # 设置环境变量，以便其他可能隐式使用这些变量的库（如 CrewAI 的某些组件）能正常工作
-        # NOTE: Explicitly map LLM_ vars to OPENAI_ vars for the LLM context.
-        os.environ["OPENAI_API_KEY"] = settings.LLM_API_KEY
-        if settings.LLM_API_BASE:
-            os.environ["OPENAI_API_BASE"] = settings.LLM_API_BASE
-            os.environ["OPENAI_BASE_URL"] = settings.LLM_API_BASE
-        
-        # NOTE: Do NOT set Embedding variables here to avoid pollution.
-        # os.environ["OPENAI_EMBEDDING_MODEL"] = settings.EMBEDDING_MODEL
-
-        return ChatOpenAI(
-            openai_api_key=settings.LLM_API_KEY,
-            openai_api_base=settings.LLM_API_BASE,
-            model_name=settings.LLM_MODEL,
-            temperature=0.1
-        )
+        http_client = self.get_http_client()
+        async_http_client = self.get_async_http_client()
+        with self._lock:
+            chat_model = self._chat_models.get(key)
+            if chat_model is None:
+                chat_model = ChatOpenAI(
+                    openai_api_key=settings.LLM_API_KEY,
+                    openai_api_base=api_base,
+                    model_name=model,
+                    temperature=temperature,
+                    http_client=http_client,
+                    http_async_client=async_http_client,
+                    callbacks=langchain_callbacks(),
+                )
+                self._chat_models[key] = chat_model
+            return chat_model
+
+    def get_crew_llm(self, model: str | None = None, api_base: str | None = None,
+                     temperature: float = 0.1) -> LLM:
+        """
+        返回共享的 CrewAI LLM 对象（供 Agent 使用）。
+
+        CrewAI 会把传入的 LangChain 对象重新包装成自己的 LLM，并从环境变量读取
+        OPENAI_API_KEY / OPENAI_API_BASE；这里直接显式构造，避免依赖进程级环境变量。
+        """
+        model, api_base = self._resolve(model, api_base)
+        key = (model, api_base, temperature)
+        crew_llm = self._crew_llms.get(key)
+        if crew_llm is not None:
+            return crew_llm
+
+        http_client = self.get_http_client()
+        async_http_client = self.get_async_http_client()
+        with self._lock:
+            crew_llm = self._crew_llms.get(key)
+            if crew_llm is None:
+                crew_llm = LLM(
+                    model=model,
+                    api_key=settings.LLM_API_KEY,
+                    base_url=api_base,
+                    temperature=temperature,
+                    timeout=settings.LLM_HTTP_TIMEOUT,
+                )
+                # NOTE: 原生 OpenAI provider 会自建 SDK 客户端（各自一个连接池）；用 provider 自己的
+                # 客户端参数（重试次数、默认请求头等）重建同步 / 异步客户端，只把连接池换成共享的。
+                # litellm 路由的模型、配置了 interceptor 的 provider 没有 / 需要自己的客户端，保持原样。
+                if hasattr(crew_llm, "_get_client_params") and not getattr(crew_llm, "interceptor", None):
+                    client_params = crew_llm._get_client_params()
+                    crew_llm._client = OpenAI(**{**client_params, "http_client": http_client})
+                    crew_llm._async_client = AsyncOpenAI(**{**client_params, "http_client": async_http_client})
+                self._crew_llms[key] = crew_llm
+            return crew_llm
+
+    @staticmethod
+    def get_embedder_config() -> dict:
+        """
+        返回 CrewAI knowledge 使用的 embedder 配置（显式传参，不依赖 OPENAI_* 环境变量）。
+        """
+        return {
+            "provider": "openai",
+            "config": {
+                "model": settings.EMBEDDING_MODEL,
+                "api_key": settings.EMBEDDING_API_KEY or settings.LLM_API_KEY,
+                "api_base": settings.EMBEDDING_API_BASE or settings.LLM_API_BASE,
+            }
+        }
 
 llm_factory = LLMFactory()
@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def current_rss_bytes() -> int:
+    """
+    当前进程的常驻内存 (RSS)。Linux 下读取 /proc/self/statm，其他平台退化为峰值 RSS。
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS 以字节为单位，Linux 以 KB 为单位
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# ---- 分阶段内存剖析 (MEMORY_PROFILING) ----
+
+# 运行期间轮询 RSS 的间隔 (ru_maxrss 是整个进程生命周期的峰值，无法按阶段区分)
+RSS_POLL_SECONDS = 0.2
+
+class MemoryProfiler:
+    """
+    按阶段记录内存: 每次运行都记录开始 / 结束 / 峰值 RSS（开销可忽略）；
+    按 MEMORY_PROFILE_SAMPLE_RATE 抽样的运行额外开启 tracemalloc，记录 Python 堆峰值和新增内存最多的代码行。
+
+    tracemalloc 是进程级的: 多个阶段并发时，抽样结果包含同时运行的其他阶段（记录中 concurrent=True）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tracing = 0
+        # tracemalloc 是否由本 profiler 开启；外部（如 PYTHONTRACEMALLOC）开启的追踪不由我们关闭
+        self._owns_tracing = False
+        self._active = 0
+        self.records: deque[dict] = deque(maxlen=settings.MEMORY_PROFILE_HISTORY)
+
+    @property
+    def enabled(self) -> bool:
+        return settings.MEMORY_PROFILING
+
+    def _start_tracing(self):
+        with self._lock:
+            if self._tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(settings.MEMORY_PROFILE_TRACE_FRAMES)
+                self._owns_tracing = True
+            self._tracing += 1
+            tracemalloc.reset_peak()
+
+    def _stop_tracing(self):
+        with self._lock:
+            self._tracing -= 1
+            if self._tracing == 0 and self._owns_tracing:
+                tracemalloc.stop()
+                self._owns_tracing = False
+
+    @staticmethod
+    def _poll_peak(stop: threading.Event, peak: list[int]):
+        while not stop.wait(RSS_POLL_SECONDS):
+            peak[0] = max(peak[0], current_rss_bytes())
+
+    @contextmanager
+    def profile(self, session_id: str, stage: str):
+        if not self.enabled:
+            yield
+            return
+        sampled = random.random() < settings.MEMORY_PROFILE_SAMPLE_RATE
+        with self._lock:
+            self._active += 1
+            concurrent = self._active > 1
+        rss_before = current_rss_bytes()
+        peak = [rss_before]
+        stop = threading.Event()
+        poller = threading.Thread(target=self._poll_peak, args=(stop, peak), daemon=True)
+        poller.start()
+        snapshot_before = None
+        if sampled:
+            self._start_tracing()
+            snapshot_before = tracemalloc.take_snapshot()
+        started_at = datetime.utcnow().isoformat()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            stop.set()
+            poller.join()
+            rss_after = current_rss_bytes()
+            record = {
+                "session_id": session_id,
+                "stage": stage,
+                "error": error,
+                "started_at": started_at,
+                "seconds": round(time.perf_counter() - started, 3),
+                "rss_before_mb": round(rss_before / 1024 / 1024, 1),
+                "rss_after_mb": round(rss_after / 1024 / 1024, 1),
+                "rss_peak_mb": round(max(peak[0], rss_after) / 1024 / 1024, 1),
+                "rss_delta_mb": round((rss_after - rss_before) / 1024 / 1024, 1),
+                "sampled": sampled,
+                "concurrent": concurrent,
+            }
+            if sampled:
+                try:
+                    record.update(self._allocation_report(snapshot_before))
+                finally:
+                    self._stop_tracing()
+            with self._lock:
+                self._active -= 1
+                self.records.append(record)
+            self._write(record)
+
+    @staticmethod
+    def _allocation_report(snapshot_before) -> dict:
+        _, traced_peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, __file__),
+        ))
+        # 阶段结束时仍保留的新增分配（按增量排序），用于定位常驻内存的来源；瞬时峰值见 traced_peak_mb
+        stats = [stat for stat in snapshot.compare_to(snapshot_before, "lineno") if stat.size_diff > 0]
+        stats = stats[:settings.MEMORY_PROFILE_TOP_N]
+        return {
+            "traced_peak_mb": round(traced_peak / 1024 / 1024, 1),
+            "top_allocations": [
+                {
+                    "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "size_kb": round(stat.size / 1024, 1),
+                    "count_diff": stat.count_diff,
+                }
+                for stat in stats
+            ],
+        }
+
+    @staticmethod
+    def _write(record: dict):
+        logger.info(
+            f"Memory [{record['session_id']}/{record['stage']}]: rss {record['rss_before_mb']} -> "
+            f"{record['rss_after_mb']} MB (peak {record['rss_peak_mb']} MB) in {record['seconds']}s"
+        )
+        if not settings.MEMORY_PROFILE_LOG:
+            return
+        try:
+            path = Path(settings.MEMORY_PROFILE_LOG)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write memory profile log: {e}")
+
+    def report(self, session_id: str | None = None) -> dict:
+        """按阶段、按会话汇总最近的记录（最多 MEMORY_PROFILE_HISTORY 条）。"""
+        with self._lock:
+            records = [r for r in self.records if session_id is None or r["session_id"] == session_id]
+
+        def summarize(group: list[dict]) -> dict:
+            return {
+                "runs": len(group),
+                "sampled": sum(1 for r in group if r["sampled"]),
+                "max_rss_peak_mb": max(r["rss_peak_mb"] for r in group),
+                "total_rss_delta_mb": round(sum(r["rss_delta_mb"] for r in group), 1),
+                "mean_rss_delta_mb": round(sum(r["rss_delta_mb"] for r in group) / len(group), 1),
+            }
+
+        by_stage: dict[str, list[dict]] = {}
+        by_session: dict[str, list[dict]] = {}
+        for record in records:
+            by_stage.setdefault(record["stage"], []).append(record)
+            by_session.setdefault(record["session_id"], []).append(record)
+        return {
+            "enabled": self.enabled,
+            "sample_rate": settings.MEMORY_PROFILE_SAMPLE_RATE,
+            "current_rss_mb": round(current_rss_bytes() / 1024 / 1024, 1),
+            "peak_rss_mb": round(peak_rss_bytes() / 1024 / 1024, 1),
+            "stages": {stage: summarize(group) for stage, group in by_stage.items()},
+            "sessions": {sid: summarize(group) for sid, group in by_session.items()},
+            "records": records,
+        }
+
+memory_profiler = MemoryProfiler()
@@ -0,0 +1,419 @@
+import argparse
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from pathlib import Path
+from typing import Any
+from langchain_core.callbacks import BaseCallbackHandler
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# 层级: stage -> crew -> task -> agent -> step -> tool / llm；embedding 可出现在任意层级下（入库、知识检索）
+SPAN_KINDS = ("stage", "ingest", "crew", "task", "agent", "step", "tool", "llm", "retrieval", "embedding")
+TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens", "cached_prompt_tokens")
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    trace_id: str
+    name: str
+    kind: str
+    parent_id: str | None = None
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    start: float = field(default_factory=time.time)
+    thread: int = field(default_factory=threading.get_ident)
+    attributes: dict[str, Any] = field(default_factory=dict)
+    # 本 span 及其全部子 span 的 token 用量，子 span 结束时累加到父 span
+    tokens: dict[str, int] = field(default_factory=dict)
+    error: str | None = None
+    _started: float = field(default_factory=time.perf_counter, repr=False)
+    _parent: "Span | None" = field(default=None, repr=False)
+    # agent span 上当前打开的 step（不放入 contextvars: AgentExecutor 的各个 flow 方法不共享上下文修改）
+    _step: "Span | None" = field(default=None, repr=False)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_tokens(self, **usage: int):
+        for key, value in usage.items():
+            if value:
+                self.tokens[key] = self.tokens.get(key, 0) + int(value)
+
+    def to_dict(self, duration_ms: float) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": round(self.start, 6),
+            "duration_ms": round(duration_ms, 3),
+            "thread": self.thread,
+            "tokens": self.tokens,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def _trace_file_name(trace_id: str) -> str:
+    return re.sub(r"[^\w.-]", "_", trace_id) + ".jsonl"
+
+
+class Tracer:
+    """
+    层级 span 追踪: 每个会话一个 JSONL 追踪文件 (TRACE_DIR/<session_id>.jsonl)，span 结束时追加一行。
+
+    父子关系通过 contextvars 传递，因此在复制了上下文的线程（contextvars.copy_context）中同样成立。
+    没有父 span 且未指定 trace_id 的调用（如阶段之外的标题生成）不记录。
+    """
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.TRACING
+
+    def trace_path(self, trace_id: str) -> Path:
+        return Path(settings.TRACE_DIR) / _trace_file_name(trace_id)
+
+    def start_span(self, name: str, kind: str, trace_id: str | None = None,
+                   **attributes) -> tuple[Span | None, contextvars.Token | None]:
+        if not self.enabled:
+            return None, None
+        parent = _current_span.get()
+        if parent is not None and parent.kind == "agent":
+            # Agent 每一轮 (一次 LLM 推理 + 随后的工具调用) 记为一个 step，下一次 LLM 调用时开始新的 step
+            if kind == "llm":
+                self._next_step(parent)
+            parent = parent._step or parent
+        if trace_id is None:
+            if parent is None:
+                return None, None
+            trace_id = parent.trace_id
+        span = Span(
+            trace_id=trace_id,
+            name=name,
+            kind=kind,
+            parent_id=parent.span_id if parent is not None and parent.trace_id == trace_id else None,
+            attributes=attributes,
+        )
+        span._parent = parent if span.parent_id else None
+        return span, _current_span.set(span)
+
+    def _next_step(self, agent: Span):
+        with self._write_lock:
+            previous, number = agent._step, agent.attributes.get("steps", 0) + 1
+            agent.attributes["steps"] = number
+            agent._step = Span(trace_id=agent.trace_id, name=f"step {number}", kind="step", parent_id=agent.span_id)
+            agent._step._parent = agent
+        if previous is not None:
+            self.end_span(previous, None)
+
+    def end_span(self, span: Span | None, token: contextvars.Token | None, error: BaseException | None = None):
+        if span is None:
+            return
+        if span._step is not None:
+            self.end_span(span._step, None)
+            span._step = None
+        duration_ms = (time.perf_counter() - span._started) * 1000
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        if token is not None:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # 在其他上下文中结束（极少见），退回到父 span
+                _current_span.set(span._parent)
+        if span._parent is not None:
+            span._parent.add_tokens(**span.tokens)
+        self._write(span.to_dict(duration_ms))
+
+    @contextmanager
+    def span(self, name: str, kind: str, trace_id: str | None = None, **attributes):
+        span, token = self.start_span(name, kind, trace_id, **attributes)
+        if span is None:
+            yield None
+            return
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, token, e)
+            raise
+        self.end_span(span, token)
+
+    def annotate(self, **attributes):
+        """给当前 span 追加属性（如 cache_hit）；未开启追踪或不在 span 中时忽略。"""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    def _write(self, record: dict):
+        path = self.trace_path(record["trace_id"])
+        try:
+            line = json.dumps(record, ensure_ascii=False, default=str)
+            with self._write_lock:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write trace span: {e}")
+
+    def load(self, trace_id: str) -> list[dict]:
+        return load_spans(self.trace_path(trace_id))
+
+
+tracer = Tracer()
+
+
+def load_spans(path: str | Path) -> list[dict]:
+    spans = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    spans.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return sorted(spans, key=lambda s: s["start"])
+
+
+# ---- 导出 ----
+
+def _frame(span: dict) -> str:
+    # collapsed stack 格式中 ";" 分隔栈帧、换行分隔样本
+    return re.sub(r"[;\n\r]", " ", f"{span['kind']}:{span['name']}")
+
+
+def collapsed_stacks(spans: list[dict]) -> str:
+    """
+    导出为 collapsed stack 格式 (flamegraph.pl / speedscope / inferno 通用): 每行 "根;...;叶 自身耗时(微秒)"。
+    自身耗时 = span 耗时 - 子 span 耗时之和；并发的子 span 可能超过父 span，此时计为 0。
+    """
+    by_id = {s["span_id"]: s for s in spans}
+    children_ms: dict[str, float] = {}
+    for s in spans:
+        if s["parent_id"] in by_id:
+            children_ms[s["parent_id"]] = children_ms.get(s["parent_id"], 0.0) + s["duration_ms"]
+
+    totals: dict[str, int] = {}
+    for s in spans:
+        frames, node = [], s
+        while node is not None:
+            frames.append(_frame(node))
+            node = by_id.get(node["parent_id"])
+        self_us = int(max(s["duration_ms"] - children_ms.get(s["span_id"], 0.0), 0.0) * 1000)
+        if self_us:
+            stack = ";".join(reversed(frames))
+            totals[stack] = totals.get(stack, 0) + self_us
+    return "\n".join(f"{stack} {value}" for stack, value in sorted(totals.items()))
+
+
+def chrome_trace(spans: list[dict]) -> dict:
+    """导出为 Chrome Trace Event 格式，可在 chrome://tracing 或 Perfetto 中按线程查看时间线。"""
+    return {
+        "traceEvents": [
+            {
+                "name": s["name"],
+                "cat": s["kind"],
+                "ph": "X",
+                "ts": int(s["start"] * 1_000_000),
+                "dur": int(s["duration_ms"] * 1000),
+                "pid": 1,
+                "tid": s["thread"],
+                "args": {**s["attributes"], **s["tokens"], **({"error": s["error"]} if s["error"] else {})},
+            }
+            for s in spans
+        ],
+        "displayTimeUnit": "ms",
+    }
+
+
+def summarize(spans: list[dict]) -> dict:
+    """按 span 类型汇总次数、耗时、token 和缓存命中数。"""
+    by_kind: dict[str, dict] = {}
+    for s in spans:
+        entry = by_kind.setdefault(s["kind"], {"count": 0, "total_ms": 0.0, "cache_hits": 0, "errors": 0})
+        entry["count"] += 1
+        entry["total_ms"] = round(entry["total_ms"] + s["duration_ms"], 3)
+        entry["cache_hits"] += 1 if s["attributes"].get("cache_hit") else 0
+        entry["errors"] += 1 if s["error"] else 0
+    # token 只在 llm span 上计数，避免与父 span 的累加值重复
+    tokens: dict[str, int] = {}
+    for s in spans:
+        if s["kind"] == "llm":
+            for key, value in s["tokens"].items():
+                tokens[key] = tokens.get(key, 0) + value
+    return {"spans": len(spans), "kinds": by_kind, "tokens": tokens}
+
+
+# ---- CrewAI / LangChain 埋点 ----
+
+def _traced(original, kind: str, name_of):
+    @wraps(original)
+    def wrapper(self, *args, **kwargs):
+        name = name_of(self)
+        parent = _current_span.get()
+        # 子类方法经 super() 调到同名父类方法时不重复记录
+        if parent is not None and parent.kind == kind and parent.name == name:
+            return original(self, *args, **kwargs)
+        with tracer.span(name, kind):
+            return original(self, *args, **kwargs)
+    wrapper._traced = True
+    return wrapper
+
+
+def _patch(cls, method: str, kind: str, name_of):
+    original = cls.__dict__.get(method)
+    if original is None or getattr(original, "_traced", False):
+        return
+    setattr(cls, method, _traced(original, kind, name_of))
+
+
+def _on_token_usage(self, usage_data):
+    span = _current_span.get()
+    if span is None or span.kind != "llm" or not usage_data:
+        return
+    from crewai.types.usage_metrics import UsageMetrics
+    metrics = UsageMetrics.from_provider_dict(usage_data)
+    if metrics is None:
+        return
+    span.add_tokens(**{key: getattr(metrics, key) for key in TOKEN_FIELDS})
+    if metrics.cached_prompt_tokens:
+        span.set(cache_hit=True)
+
+
+def _tool_name(tool) -> str:
+    return getattr(tool, "name", None) or type(tool).__name__
+
+
+def install_tracing_hooks():
+    """
+    给 Crew / Task / Agent / 工具 / LLM 调用挂上 span（TRACING 开启时）。工具按类打补丁，
+    因此 Agent 经 CrewStructuredTool、原生 function calling 或 BaseTool.run 调用时都会记录。
+    """
+    if not tracer.enabled:
+        return
+    from crewai import Agent, Crew, LLM, Task
+    from crewai.agents.cache.cache_handler import CacheHandler
+    from crewai.llms.base_llm import BaseLLM
+    from src.tools.dcf_calculator_tool import DCFCalculatorTool
+    from src.tools.financial_table_tool import FinancialTablesBatchTool, FinancialTableTool
+    from src.tools.peer_search_tool import PeerSearchTool
+
+    if getattr(Crew, "_tracing_hooks_installed", False):
+        return
+
+    _patch(Crew, "kickoff", "crew", lambda crew: crew.name or type(crew).__name__)
+    _patch(Task, "execute_sync", "task", lambda task: task.name or (task.description or "")[:60])
+    _patch(Agent, "execute_task", "agent", lambda agent: agent.role)
+    for tool_cls in (FinancialTableTool, FinancialTablesBatchTool, DCFCalculatorTool, PeerSearchTool):
+        _patch(tool_cls, "_run", "tool", _tool_name)
+    llm_classes = [LLM]
+    try:
+        from crewai.llms.providers.openai.completion import OpenAICompletion
+        llm_classes.append(OpenAICompletion)
+    except ImportError:
+        pass
+    for llm_cls in llm_classes:
+        _patch(llm_cls, "call", "llm", lambda llm: llm.model)
+
+    original_track = BaseLLM._track_token_usage_internal
+
+    def track_token_usage(self, usage_data):
+        _on_token_usage(self, usage_data)
+        return original_track(self, usage_data)
+
+    BaseLLM._track_token_usage_internal = track_token_usage
+
+    original_cache_read = CacheHandler.read
+
+    def cache_read(self, tool, input):
+        result = original_cache_read(self, tool, input)
+        if result is not None:
+            # 工具缓存命中时不会执行工具，补一个零耗时的 tool span
+            with tracer.span(tool, "tool", cache_hit=True):
+                pass
+        return result
+
+    CacheHandler.read = cache_read
+    Crew._tracing_hooks_installed = True
+
+
+def langchain_callbacks() -> list:
+    """LangChain Chat 模型（工具、标题生成中直接调用）的 span 回调；未开启追踪时为空。"""
+    if not tracer.enabled:
+        return []
+    return [LangChainTracingHandler()]
+
+
+class LangChainTracingHandler(BaseCallbackHandler):
+    # 在调用方线程内同步执行，span 才能挂到调用方的父 span 下
+    run_inline = True
+
+    def __init__(self):
+        self._spans: dict[Any, tuple[Span, contextvars.Token]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        model = (kwargs.get("invocation_params") or {}).get("model_name") or (serialized or {}).get("name", "chat")
+        span, token = tracer.start_span(str(model), "llm")
+        if span is not None:
+            self._spans[run_id] = (span, token)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        entry = self._spans.pop(run_id, None)
+        if entry is None:
+            return
+        span, token = entry
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        details = usage.get("prompt_tokens_details") or {}
+        span.add_tokens(
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            total_tokens=usage.get("total_tokens", 0),
+            cached_prompt_tokens=details.get("cached_tokens", 0),
+        )
+        if details.get("cached_tokens"):
+            span.set(cache_hit=True)
+        tracer.end_span(span, token)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        entry = self._spans.pop(run_id, None)
+        if entry is not None:
+            tracer.end_span(*entry, error=error)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Export a session trace (TRACE_DIR/<session_id>.jsonl).")
+    parser.add_argument("trace_file")
+    parser.add_argument("--format", choices=("collapsed", "chrome", "summary"), default="collapsed")
+    args = parser.parse_args(argv)
+
+    spans = load_spans(args.trace_file)
+    if args.format == "collapsed":
+        print(collapsed_stacks(spans))
+    elif args.format == "chrome":
+        print(json.dumps(chrome_trace(spans), ensure_ascii=False))
+    else:
+        print(json.dumps(summarize(spans), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
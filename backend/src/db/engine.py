@@ -0,0 +1,87 @@
+import logging
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlmodel import create_engine
+from src.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+def _engine_options(url: str) -> dict:
+    options = {"echo": settings.DB_ECHO, "pool_pre_ping": True}
+    if _is_sqlite(url):
+        # 后台任务线程与请求共用连接；busy_timeout 之外再给驱动层一个等待时间
+        options["connect_args"] = {"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+        if make_url(url).database in (None, "", ":memory:"):
+            return options
+    options.update(
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+    )
+    return options
+
+def _configure_sqlite(sync_engine: Engine):
+    """
+    WAL: 读不阻塞写、写不阻塞读；busy_timeout: 写锁冲突时等待而不是立即报 "database is locked"。
+    """
+    @event.listens_for(sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+def build_engine(url: str | None = None) -> Engine:
+    url = url or settings.DATABASE_URL
+    new_engine = create_engine(url, **_engine_options(url))
+    if _is_sqlite(url):
+        _configure_sqlite(new_engine)
+    return new_engine
+
+engine = build_engine()
+
+# 异步驱动: sqlite -> aiosqlite, postgresql -> asyncpg
+ASYNC_DRIVERS = {"sqlite": ("sqlite+aiosqlite", "aiosqlite"), "postgresql": ("postgresql+asyncpg", "asyncpg")}
+
+_async_engine = None
+_async_engine_checked = False
+
+def get_async_engine():
+    """
+    按需创建异步引擎。未开启 DB_ASYNC 或未安装对应的异步驱动时返回 None，调用方退化为在线程中执行同步查询。
+    """
+    global _async_engine, _async_engine_checked
+    if _async_engine_checked:
+        return _async_engine
+    _async_engine_checked = True
+    if not settings.DB_ASYNC:
+        return None
+
+    url = make_url(settings.DATABASE_URL)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        return None
+    drivername, module = driver
+    try:
+        __import__(module)
+    except ImportError:
+        logger.info(f"Async database driver '{module}' not installed, async session API runs in threads")
+        return None
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+    async_url = url.set(drivername=drivername).render_as_string(hide_password=False)
+    options = _engine_options(async_url)
+    options.pop("connect_args", None)
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000}
+    _async_engine = create_async_engine(async_url, **options)
+    if url.get_backend_name() == "sqlite":
+        _configure_sqlite(_async_engine.sync_engine)
+    return _async_engine
@@ -0,0 +1,251 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+import numpy as np
+from src.knowledge.vector_index import MmapVectorIndex
+
+logger = logging.getLogger(__name__)
+
+REFCOUNTS_FILE = "refcounts.json"
+VIEW_FILE = "chunks.json"
+LOCK_FILE = ".lock"
+
+# chunk 开头的引用标记行: "[[年报.pdf | Page 12]] 第三节 ... (表格)"，不同文件 / 页码的同一段文字共享 embedding
+CHUNK_HEADER_RE = re.compile(r"^\[\[[^\]]*\]\][^\n]*\n")
+
+
+def chunk_body(content: str) -> str:
+    """去掉 chunk 开头的文件名 / 页码 / 章节标记，只留正文。"""
+    return CHUNK_HEADER_RE.sub("", content, count=1)
+
+
+def chunk_key(content: str) -> str:
+    """共享 chunk 库的键: 正文经全角转半角、合并空白后的 SHA-256。"""
+    text = unicodedata.normalize("NFKC", chunk_body(content))
+    text = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _file_lock(directory: Path):
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / LOCK_FILE, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_json(path: Path, data: dict):
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class SharedChunkStore:
+    """
+    跨会话共享的 chunk 库: 按正文的归一化哈希保存每个唯一 chunk 的 embedding，只 embedding 一次。
+
+    同一发行人的历年年报、同一交易所的不同公司，会计政策、公司治理、免责声明等段落大量逐字重复；
+    会话索引（SessionChunkView）只记录引用的键，不再各自保存向量。
+    refcounts.json 记录每个键被多少个会话 chunk 引用，降到 0 时从共享库中删除。
+    """
+
+    def __init__(self, directory: Path | str, quantization: str = "none", rerank_factor: int = 0):
+        self.directory = Path(directory)
+        self.index = MmapVectorIndex(self.directory / "index", quantization=quantization, rerank_factor=rerank_factor)
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, _file_lock(self.directory):
+            yield
+
+    def _load_refcounts(self) -> dict[str, int]:
+        try:
+            with open(self.directory / REFCOUNTS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def refcounts(self) -> dict[str, int]:
+        with self._locked():
+            return self._load_refcounts()
+
+    def acquire(self, keys: list[str], texts: dict[str, str], embed: Callable[[list[str]], np.ndarray]) -> int:
+        """
+        为 keys 中的每一项增加一次引用（同一个键出现几次就加几次）；库中还没有的正文先 embedding 再写入。
+        texts 为 键 -> 用于 embedding 的正文。返回新 embedding 的 chunk 数。
+        """
+        if not keys:
+            return 0
+        unique = list(dict.fromkeys(keys))
+        # embedding 在锁外进行，避免阻塞其他会话的入库
+        missing = [key for key, present in zip(unique, self.index.contains(unique)) if not present]
+        vectors = embed([texts[key] for key in missing]) if missing else None
+        with self._locked():
+            embedded = 0
+            if missing:
+                embedded = self.index.add(missing, [texts[key] for key in missing], [{} for _ in missing], vectors)
+            # 锁外检查之后被回收的键（极少见）在锁内补上
+            gone = [key for key, present in zip(unique, self.index.contains(unique)) if not present]
+            if gone:
+                embedded += self.index.add(gone, [texts[key] for key in gone], [{} for _ in gone], embed([texts[key] for key in gone]))
+            refcounts = self._load_refcounts()
+            for key in keys:
+                refcounts[key] = refcounts.get(key, 0) + 1
+            _write_json(self.directory / REFCOUNTS_FILE, refcounts)
+        return embedded
+
+    def release(self, keys: list[str]) -> int:
+        """每个键减少一次引用，引用数归零的 chunk 从共享库中删除。返回删除的 chunk 数。"""
+        if not keys:
+            return 0
+        with self._locked():
+            refcounts = self._load_refcounts()
+            for key in keys:
+                refcounts[key] = refcounts.get(key, 0) - 1
+            orphans = [key for key, count in refcounts.items() if count <= 0]
+            for key in orphans:
+                del refcounts[key]
+            # 先写引用计数：中途失败时最多留下无人引用的向量（gc 可清理），不会删掉仍被引用的
+            _write_json(self.directory / REFCOUNTS_FILE, refcounts)
+            return self.index.remove_ids(orphans) if orphans else 0
+
+    def gc(self, views: list["SessionChunkView"]) -> int:
+        """
+        按全部会话视图重建引用计数并删除无人引用的 chunk（进程崩溃导致计数偏大时使用，应在没有入库任务时运行）。
+        返回删除的 chunk 数。
+        """
+        with self._locked():
+            refcounts: dict[str, int] = {}
+            for view in views:
+                for row in view.rows():
+                    refcounts[row["ref"]] = refcounts.get(row["ref"], 0) + 1
+            _write_json(self.directory / REFCOUNTS_FILE, refcounts)
+            orphans = [row["id"] for row in self.index.rows() if row["id"] not in refcounts]
+            return self.index.remove_ids(orphans) if orphans else 0
+
+
+class SessionChunkView:
+    """
+    会话的向量索引视图: 与 MmapVectorIndex 的读写接口相同，但只保存 chunk 的 id / 正文 / 元数据和共享库的键，
+    检索时在共享库的矩阵中取出本会话引用的行打分。行号按写入顺序，检索后处理可以照常合并相邻 chunk。
+    """
+
+    def __init__(self, directory: Path | str, store: SharedChunkStore):
+        self.directory = Path(directory)
+        self.store = store
+        self._lock = threading.RLock()
+        self._rows: list[dict] = []
+        self._ids: set[str] = set()
+        self._refs: list[str] = []
+        self._loaded_version: tuple[int, int] | None = None
+
+    def _view_version(self) -> tuple[int, int] | None:
+        # 与 MmapVectorIndex._meta_version 相同: mtime 加 inode，同一时钟刻度内的两次写入也能区分
+        try:
+            stat = (self.directory / VIEW_FILE).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino
+
+    def _refresh(self):
+        version = self._view_version()
+        if version == self._loaded_version and version is not None:
+            return
+        if version is None:
+            self._rows = []
+        else:
+            with open(self.directory / VIEW_FILE, "r", encoding="utf-8") as f:
+                self._rows = json.load(f)["rows"]
+        self._ids = {row["id"] for row in self._rows}
+        self._refs = [row["ref"] for row in self._rows]
+        self._loaded_version = version
+
+    def _save(self, rows: list[dict]):
+        _write_json(self.directory / VIEW_FILE, {"rows": rows})
+        self._loaded_version = None
+        self._refresh()
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock, _file_lock(self.directory):
+            self._refresh()
+            yield
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._rows)
+
+    def contains(self, ids: list[str]) -> list[bool]:
+        with self._lock:
+            self._refresh()
+            return [i in self._ids for i in ids]
+
+    def rows(self) -> list[dict]:
+        with self._lock:
+            self._refresh()
+            return list(self._rows)
+
+    def search(self, query_vector: np.ndarray, k: int, score_threshold: float = 0.0,
+               where: dict | None = None) -> list[tuple[dict, float]]:
+        rows, scores, _, _ = self.search_matrix(query_vector, k, score_threshold, where)
+        return list(zip(rows, scores.tolist()))
+
+    def search_matrix(self, query_vector: np.ndarray, k: int, score_threshold: float = 0.0,
+                      where: dict | None = None) -> tuple[list[dict], np.ndarray, np.ndarray, np.ndarray]:
+        with self._lock:
+            self._refresh()
+            rows, refs = self._rows, self._refs
+        return self.store.index.search_ids(refs, rows, query_vector, k, score_threshold, where)
+
+    def add(self, ids: list[str], contents: list[str], metadatas: list[dict],
+            embed: Callable[[list[str]], np.ndarray]) -> tuple[int, int]:
+        """
+        追加 chunk（已存在的 id 跳过），只为共享库中没有的正文调用 embed。返回 (新增行数, 新 embedding 数)。
+        """
+        with self._write_lock():
+            seen = set(self._ids)
+            keep = [i for i, doc_id in enumerate(ids) if not (doc_id in seen or seen.add(doc_id))]
+            if not keep:
+                return 0, 0
+            keys = [chunk_key(contents[i]) for i in keep]
+            texts = {}
+            for key, i in zip(keys, keep):
+                texts.setdefault(key, chunk_body(contents[i]))
+            embedded = self.store.acquire(keys, texts, embed)
+            new_rows = [
+                {"id": ids[i], "content": contents[i], "metadata": metadatas[i], "ref": key}
+                for i, key in zip(keep, keys)
+            ]
+            self._save(self._rows + new_rows)
+            return len(keep), embedded
+
+    def remove(self, where: dict) -> int:
+        """删除元数据匹配 where 的行，并释放它们对共享 chunk 的引用。返回删除的行数。"""
+        with self._write_lock():
+            matches = [all(row["metadata"].get(key) == value for key, value in where.items()) for row in self._rows]
+            matched = [row for row, hit in zip(self._rows, matches) if hit]
+            if not matched:
+                return 0
+            self._save([row for row, hit in zip(self._rows, matches) if not hit])
+            self.store.release([row["ref"] for row in matched])
+            return len(matched)
+
+    def reset(self):
+        with self._write_lock():
+            refs = [row["ref"] for row in self._rows]
+            self._save([])
+            self.store.release(refs)
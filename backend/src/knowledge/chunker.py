@@ -0,0 +1,167 @@
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from itertools import chain, islice
+from typing import Iterable, Iterator
+
+# 年报常见的标题格式: "第三节 管理层讨论与分析", "一、公司简介", "（二）主营业务", "1.2 经营情况"
+HEADING_PATTERNS = [
+    re.compile(r"^第[一二三四五六七八九十百零〇\d]+[节章部分]"),
+    re.compile(r"^[一二三四五六七八九十]+[、.．]"),
+    re.compile(r"^[（(][一二三四五六七八九十]+[）)]"),
+    re.compile(r"^\d+(\.\d+)*[、.．]\s*\D"),
+]
+HEADING_MAX_CHARS = 40
+
+DEFAULT_CHUNK_SIZE = 1500
+DEFAULT_MIN_CHUNK_CHARS = 80
+
+# 只有页码的行: "12", "- 12 -", "第 12 页 共 300 页"
+PAGE_NUMBER_LINE = re.compile(r"^[-—\s]*(第\s*)?\d+(\s*页)?(\s*共\s*\d+\s*页)?[-—\s]*$")
+
+# 用前若干页识别页眉/页脚（流式入库和知识源按相同规则切分，同一份 PDF 得到相同的 chunk）
+BOILERPLATE_SAMPLE_PAGES = 30
+
+
+@dataclass
+class PageContent:
+    page_number: int
+    text: str
+    tables: list[list[list[str | None]]] = field(default_factory=list)
+
+
+@dataclass
+class Chunk:
+    content: str
+    metadata: dict
+
+
+def is_heading(line: str) -> bool:
+    line = line.strip()
+    if not line or len(line) > HEADING_MAX_CHARS or line.endswith(("。", "；", ";", "，", ",")):
+        return False
+    return any(p.match(line) for p in HEADING_PATTERNS)
+
+
+def find_boilerplate_lines(pages: list[PageContent], min_ratio: float = 0.5, edge_lines: int = 2) -> set[str]:
+    """
+    找出在大多数页面的页首/页尾重复出现的行（页眉、页脚等）。
+    """
+    if len(pages) < 3:
+        return set()
+    counts = Counter()
+    for page in pages:
+        lines = [line.strip() for line in page.text.splitlines() if line.strip()]
+        counts.update(set(lines[:edge_lines] + lines[-edge_lines:]))
+    threshold = max(2, int(len(pages) * min_ratio))
+    return {line for line, n in counts.items() if n >= threshold}
+
+
+def render_table(rows: list[list[str | None]]) -> str:
+    """将 pdfplumber 提取的表格渲染为 Markdown 风格的行，保持整表不被拆分。"""
+    lines = []
+    for row in rows:
+        cells = [(cell or "").replace("\n", " ").strip() for cell in row]
+        if any(cells):
+            lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+class PageAwareChunker:
+    """
+    按页、标题和表格边界切分年报文本。
+
+    - 切分点只落在页边界、标题行和行边界上，不会把一行拆开；
+    - 每个表格作为一个完整的 chunk，不论长短；
+    - 过短的片段（页码、孤立标题等）会并入同页的相邻 chunk，而不是单独成块；
+    - 每个 chunk 以 [[文件名 | Page X]] 开头，并附带页码/章节元数据，方便 Agent 给出引用。
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, min_chunk_chars: int = DEFAULT_MIN_CHUNK_CHARS):
+        self.chunk_size = chunk_size
+        self.min_chunk_chars = min_chunk_chars
+
+    def chunk(self, pages: list[PageContent], source: str) -> list[Chunk]:
+        return list(self.iter_chunks(pages, source))
+
+    def iter_chunks(self, pages: Iterable[PageContent], source: str) -> Iterator[Chunk]:
+        """
+        逐页产出 chunk。pages 可以是生成器（如 page_store.iter_pages），只缓存前
+        BOILERPLATE_SAMPLE_PAGES 页用于识别页眉/页脚，之后的页面处理完即可释放。
+        传入列表时也只用前 BOILERPLATE_SAMPLE_PAGES 页识别，保证两种输入的切分结果一致。
+        """
+        pages = iter(pages)
+        sample = list(islice(pages, BOILERPLATE_SAMPLE_PAGES))
+        boilerplate = find_boilerplate_lines(sample)
+        pages = chain(sample, pages)
+
+        section = ""
+        for page in pages:
+            page_chunks, section = self._chunk_page(page, source, section, boilerplate)
+            yield from page_chunks
+
+    def _chunk_page(self, page: PageContent, source: str, section: str, boilerplate: set[str]) -> tuple[list[Chunk], str]:
+        page_chunks: list[Chunk] = []
+        buffer: list[str] = []
+        buffer_section = section
+
+        def flush():
+            nonlocal buffer
+            text = "\n".join(buffer).strip()
+            buffer = []
+            if not text:
+                return
+            if len(text) < self.min_chunk_chars and page_chunks and page_chunks[-1].metadata["kind"] == "text":
+                # 过短的尾巴并入同页上一个文本块
+                previous = page_chunks[-1]
+                previous.content = previous.content + "\n" + text
+                previous.metadata["chars"] += len(text) + 1
+                return
+            page_chunks.append(self._make_chunk(text, source, page.page_number, buffer_section, "text"))
+
+        for raw_line in page.text.splitlines():
+            line = raw_line.strip()
+            if not line or line in boilerplate or PAGE_NUMBER_LINE.match(line):
+                continue
+            if is_heading(line):
+                # 新标题前的短片段留在缓冲区里，和标题一起成块
+                if sum(len(l) for l in buffer) >= self.min_chunk_chars:
+                    flush()
+                section = line
+                if not buffer:
+                    buffer_section = section
+            elif sum(len(l) for l in buffer) + len(line) > self.chunk_size:
+                flush()
+                buffer_section = section
+            buffer.append(line)
+        flush()
+
+        for rows in page.tables:
+            table_text = render_table(rows)
+            if table_text:
+                page_chunks.append(self._make_chunk(table_text, source, page.page_number, section, "table"))
+
+        # 整页只剩下一小段文字时（目录页、封底等），仍然保留，但最短要求减半以过滤纯噪声
+        kept = [
+            c for c in page_chunks
+            if c.metadata["kind"] == "table" or c.metadata["chars"] >= self.min_chunk_chars // 2
+        ]
+        return kept, section
+
+    @staticmethod
+    def _make_chunk(text: str, source: str, page_number: int, section: str, kind: str) -> Chunk:
+        header = f"[[{source} | Page {page_number}]]"
+        if section:
+            header += f" {section}"
+        if kind == "table":
+            header += " (表格)"
+        return Chunk(
+            content=f"{header}\n{text}",
+            metadata={
+                "source": source,
+                "page": page_number,
+                "section": section,
+                "kind": kind,
+                "chars": len(text),
+            },
+        )
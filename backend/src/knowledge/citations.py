@@ -0,0 +1,313 @@
+import json
+import logging
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterable
+import numpy as np
+from src.core.config import get_settings
+from src.knowledge.chunker import PageContent, render_table
+from src.knowledge.page_store import load_pages
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# [[Page 12]] 或 [[年报.pdf | Page 12]]
+CITATION_RE = re.compile(r"\[\[\s*(?:([^\]|]+?)\s*\|\s*)?Page\s*(\d+)\s*\]\]", re.IGNORECASE)
+# 句子 = 一段文字 + 句末标点 + 紧随其后的引用标记
+SENTENCE_RE = re.compile(r"[^。！？!?；;]+[。！？!?；;]?(?:\s*\[\[[^\]]*\]\])*")
+# 数字 (可带百分号或中文单位)；日期、"第 N" 之类在 _claim_numbers 中排除
+NUMBER_RE = re.compile(r"(?<![\d.])(-?\d+(?:\.\d+)?)(%|万亿|亿|百万|万|千)?")
+THOUSANDS_RE = re.compile(r"(?<=\d),(?=\d{3})")
+PAGE_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+# 引号内的中文原文 (英文引号只在内容含中文时算作引用，避免把 JSON 键当成原文)
+QUOTE_RE = re.compile(r"[“\"「『]([^”\"」』\n]{4,80})[”\"」』]")
+CJK_RE = re.compile(r"[一-鿿]")
+LATIN_RE = re.compile(r"[A-Za-z]")
+
+UNIT_MULTIPLIERS = {None: 1.0, "%": 1.0, "千": 1e3, "万": 1e4, "百万": 1e6, "亿": 1e8, "万亿": 1e12}
+# 原文与结论可能使用不同的金额单位 (元 / 千元 / 万元 / 百万元 / 亿元)
+PAGE_SCALES = np.array([1e-8, 1e-6, 1e-4, 1e-3, 1.0, 1e3, 1e4, 1e6, 1e8])
+
+def normalize_text(text: str) -> str:
+    """全角转半角、去掉千分位逗号和空白，用于子串匹配。"""
+    text = unicodedata.normalize("NFKC", text)
+    text = THOUSANDS_RE.sub("", text)
+    return re.sub(r"\s+", "", text)
+
+@dataclass
+class _PageIndex:
+    text: str
+    numbers: set[str]
+    values: np.ndarray
+
+    @classmethod
+    def build(cls, page) -> "_PageIndex":
+        raw = unicodedata.normalize("NFKC", "\n".join([page.text] + [render_table(rows) for rows in page.tables]))
+        # 数字从保留空白的原文中提取: 无框线表格的相邻列只靠空格分隔，去掉空白后会粘成一个数
+        numbers = set(PAGE_NUMBER_RE.findall(THOUSANDS_RE.sub("", raw)))
+        # 引号原文的子串匹配才使用去掉空白的文本
+        text = normalize_text(raw)
+        values = np.array([float(n) for n in numbers], dtype=np.float64)
+        return cls(text=text, numbers=numbers, values=values)
+
+@dataclass
+class SentenceCheck:
+    sentence: str
+    pages: list[int]
+    missing: list[str] = field(default_factory=list)
+    reason: str = ""
+
+@dataclass
+class VerificationReport:
+    checked: int = 0
+    citations: int = 0
+    unsupported: list[SentenceCheck] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+    max_unsupported_ratio: float = 0.0
+
+    @property
+    def unsupported_ratio(self) -> float:
+        return len(self.unsupported) / self.checked if self.checked else 0.0
+
+    @property
+    def passed(self) -> bool:
+        return not self.errors and self.unsupported_ratio <= self.max_unsupported_ratio
+
+    def feedback(self, max_items: int = 10) -> str:
+        lines = ["引用校验未通过，请只修改下列问题，其余内容保持不变:"]
+        lines += [f"- {error}" for error in self.errors]
+        for item in self.unsupported[:max_items]:
+            pages = ", ".join(str(p) for p in item.pages) or "无"
+            detail = f"（未在原文中找到: {', '.join(item.missing)}）" if item.missing else ""
+            lines.append(f"- [{item.reason}] 引用页: {pages}; 句子: {item.sentence[:120]}{detail}")
+        if len(self.unsupported) > max_items:
+            lines.append(f"- ……另有 {len(self.unsupported) - max_items} 处")
+        return "\n".join(lines)
+
+class CitationVerifier:
+    """
+    本地确定性的引用校验，替代由 LLM 执行的文字版 guardrail。
+
+    解析输出中的 [[Page X]] / [[文件 | Page X]] 引用，把每句话中的数字和引号内的原文
+    与被引用页面（页面缓存中的文本和表格）做归一化子串 / 数值匹配，找出没有依据的句子。
+    作为 Task 的 guardrail 使用时，只有校验失败才会触发一次带具体问题列表的重试；
+    重试次数用完后保留最后一次输出并记录警告，不让整个阶段失败。
+    """
+
+    def __init__(
+        self,
+        file_paths: list[str],
+        check_numbers: bool = True,
+        require_citations: bool = True,
+        require_chinese: bool = True,
+        max_unsupported_ratio: float | None = None,
+        max_retries: int | None = None,
+        exempt_markers: tuple[str, ...] = (),
+        external_texts: Callable[[], Iterable[str]] | None = None,
+    ):
+        self.file_paths = [self._resolve(p) for p in file_paths]
+        # 含有这些标记的句子来自年报以外的数据源（如同业数据库），不按年报页码核对，
+        # 改为与 external_texts() 返回的原始数据（比率表、同业检索结果等）核对数字
+        self.exempt_markers = exempt_markers
+        self.external_texts = external_texts
+        self.check_numbers = check_numbers
+        self.require_citations = require_citations
+        self.require_chinese = require_chinese
+        self.max_unsupported_ratio = (
+            settings.CITATION_MAX_UNSUPPORTED_RATIO if max_unsupported_ratio is None else max_unsupported_ratio
+        )
+        self.max_retries = settings.CITATION_MAX_RETRIES if max_retries is None else max_retries
+        self._pages: dict[str, dict[int, _PageIndex]] | None = None
+        self._lock = threading.Lock()
+        self._attempts = 0
+        self.last_report: VerificationReport | None = None
+
+    @staticmethod
+    def _resolve(file_path: str) -> Path:
+        # Crew 拿到的是 knowledge 目录下的相对路径 (session_id/xxx.pdf)
+        path = Path(file_path)
+        if not path.exists() and (Path("knowledge") / path).exists():
+            path = Path("knowledge") / path
+        return path
+
+    @property
+    def pages(self) -> dict[str, dict[int, _PageIndex]]:
+        if self._pages is None:
+            with self._lock:
+                if self._pages is None:
+                    pages = {}
+                    for path in self.file_paths:
+                        try:
+                            pages[path.name] = {p.page_number: _PageIndex.build(p) for p in load_pages(path)}
+                        except Exception as e:
+                            logger.warning(f"Citation verifier could not load pages of {path}: {e}")
+                    self._pages = pages
+        return self._pages
+
+    def _external_pages(self) -> list[_PageIndex]:
+        """年报以外的数据源。每次校验时重新读取，因为同业检索结果是在任务执行过程中产生的。"""
+        if self.external_texts is None:
+            return []
+        return [_PageIndex.build(PageContent(page_number=0, text=text)) for text in self.external_texts() if text]
+
+    def _cited_pages(self, sentence: str, report: VerificationReport) -> list[tuple[str, int]]:
+        cited = []
+        for source, page in CITATION_RE.findall(sentence):
+            page_number = int(page)
+            report.citations += 1
+            if source:
+                name = Path(source.strip()).name
+                candidates = [name] if name in self.pages else []
+            else:
+                candidates = list(self.pages)
+            found = [(name, page_number) for name in candidates if page_number in self.pages[name]]
+            if not found:
+                report.errors.append(f"引用 [[{source + ' | ' if source else ''}Page {page}]] 指向不存在的文件或页码")
+            cited.extend(found)
+        return cited
+
+    @staticmethod
+    def _claim_numbers(sentence: str) -> list[tuple[str, float, int, float]]:
+        """句中需要核对的数字: (原始写法, 数值, 小数位数, 单位倍数)。年份、日期、序号等不核对。"""
+        claims = []
+        for match in NUMBER_RE.finditer(sentence):
+            number, unit = match.group(1), match.group(2)
+            after = sentence[match.end():match.end() + 1]
+            before = sentence[max(0, match.start() - 1):match.start()]
+            decimals = len(number.split(".")[1]) if "." in number else 0
+            value = abs(float(number))
+            if not decimals and not unit and (value < 10 or 1900 <= value <= 2100):
+                continue
+            if after in ("年", "月", "日", "季", "页", "节") or before in ("第", "Q", "H"):
+                continue
+            claims.append((match.group(0), value, decimals, UNIT_MULTIPLIERS[unit]))
+        return claims
+
+    @staticmethod
+    def _number_supported(claim: tuple[str, float, int, float], pages: list[_PageIndex]) -> bool:
+        text, value, decimals, multiplier = claim
+        plain = text.rstrip("%万亿百千").lstrip("-")
+        if any(plain in page.numbers for page in pages):
+            return True
+        # 换算单位后按结论中的精度四舍五入比较
+        target = value * multiplier
+        tolerance = 0.5 * 10 ** -decimals * multiplier + 1e-9 * target
+        for page in pages:
+            if page.values.size and np.any(np.abs(np.outer(page.values, PAGE_SCALES) - target) <= tolerance):
+                return True
+        return False
+
+    @staticmethod
+    def _split_lines(text: str) -> list[str]:
+        """JSON 输出按字段逐项核对，其余按行。"""
+        cleaned = re.sub(r"```(?:json)?", "", text).strip()
+        try:
+            data = json.loads(cleaned)
+        except json.JSONDecodeError:
+            return text.splitlines()
+        lines = []
+
+        def walk(value, key=""):
+            if isinstance(value, dict):
+                for k, v in value.items():
+                    walk(v, f"{key}.{k}" if key else str(k))
+            elif isinstance(value, list):
+                for i, v in enumerate(value):
+                    walk(v, f"{key}[{i}]")
+            elif value is not None and not isinstance(value, bool):
+                # 键名里的年份/数字不参与核对
+                lines.append(f"{key}: {value}" if isinstance(value, str) else f"{value}")
+        walk(data)
+        return lines
+
+    def verify(self, text: str) -> VerificationReport:
+        report = VerificationReport(max_unsupported_ratio=self.max_unsupported_ratio)
+        if not self.pages:
+            report.errors.append("无法读取被引用的原文页面")
+            return report
+
+        normalized_output = unicodedata.normalize("NFKC", text)
+        if self.require_chinese:
+            cjk, latin = len(CJK_RE.findall(normalized_output)), len(LATIN_RE.findall(normalized_output))
+            if cjk < latin:
+                report.errors.append("报告必须使用中文撰写")
+
+        all_pages = [page for pages in self.pages.values() for page in pages.values()]
+        parsed = []
+        for line in self._split_lines(normalized_output):
+            line = line.strip()
+            if not line:
+                continue
+            # Markdown 表格的一行作为一个整体核对
+            sentences = [line] if line.startswith("|") else SENTENCE_RE.findall(line)
+            for sentence in sentences:
+                if sentence.strip():
+                    parsed.append((sentence.strip(), self._cited_pages(sentence, report)))
+
+        cited_anywhere = {key for _, cited in parsed for key in cited}
+        if self.require_citations and not cited_anywhere:
+            report.errors.append("输出中没有任何 [[Page X]] 格式的引用")
+
+        external_pages = None
+        for sentence, cited in parsed:
+            external = any(marker in sentence for marker in self.exempt_markers)
+            claim_text = THOUSANDS_RE.sub("", CITATION_RE.sub("", sentence))
+            numbers = self._claim_numbers(claim_text) if self.check_numbers else []
+            quotes = [q for q in QUOTE_RE.findall(claim_text) if CJK_RE.search(q)]
+            if not numbers and not quotes:
+                continue
+            report.checked += 1
+            if external:
+                # 外部数据源的句子: 与传入任务的比率表 / 同业检索结果（以及句中引用的页面）核对
+                if external_pages is None:
+                    external_pages = self._external_pages()
+                pages = external_pages + [self.pages[name][page] for name, page in cited]
+                reason = "与数据来源不符"
+            elif cited:
+                pages = [self.pages[name][page] for name, page in cited]
+                reason = "与引用页不符"
+            elif self.require_citations:
+                # 没有引用的句子，至少要能在本文其他引用过的页面中找到依据
+                pages = [self.pages[name][page] for name, page in cited_anywhere]
+                reason = "缺少引用"
+            else:
+                pages = all_pages
+                reason = "原文中无依据"
+            missing = [claim[0] for claim in numbers if not self._number_supported(claim, pages)]
+            missing += [q for q in quotes if not any(normalize_text(q) in page.text for page in pages)]
+            if missing or (not cited and not external and self.require_citations):
+                report.unsupported.append(SentenceCheck(
+                    sentence=sentence,
+                    pages=sorted({page for _, page in cited}),
+                    missing=missing,
+                    reason=reason,
+                ))
+        return report
+
+    def __call__(self, output) -> tuple[bool, Any]:
+        text = getattr(output, "raw", output) or ""
+        report = self.verify(str(text))
+        self.last_report = report
+        logger.info(
+            f"Citation check: {report.checked} sentences, {len(report.unsupported)} unsupported, "
+            f"{report.citations} citations, errors={report.errors}"
+        )
+        if report.passed:
+            return True, output
+        self._attempts += 1
+        if self._attempts > self.max_retries:
+            logger.warning(f"Citation check still failing after {self.max_retries} retries, keeping output:\n{report.feedback()}")
+            return True, output
+        return False, report.feedback()
+
+def citation_guardrail(file_paths: list[str], instruction: str, **options):
+    """
+    Task 的 guardrail: 开启 CITATION_VERIFIER 时返回本地校验器，否则沿用交给 LLM 判断的文字要求。
+    """
+    if not settings.CITATION_VERIFIER or not file_paths:
+        return instruction
+    return CitationVerifier(file_paths, **options)
@@ -0,0 +1,126 @@
+import gc
+import json
+import logging
+import os
+import threading
+from dataclasses import asdict
+from pathlib import Path
+from typing import Iterator
+import pdfplumber
+from pdfminer.pdfpage import PDFPage
+from pdfplumber.page import Page
+from src.core.config import get_settings
+from src.core.hashing import file_sha256
+from src.core.memory import current_rss_bytes
+from src.knowledge.chunker import PageContent
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+
+class PageMemoryLimitExceeded(MemoryError):
+    pass
+
+
+def extract_page_content(page) -> PageContent:
+    """
+    提取单页内容: 表格以外的正文 + 每个表格的单元格。
+    表格区域内的字符从正文中剔除，避免同一份数据既出现在正文又出现在表格 chunk 中。
+    """
+    tables = page.find_tables()
+    bboxes = [t.bbox for t in tables]
+
+    def outside_tables(obj) -> bool:
+        if obj.get("object_type") != "char":
+            return True
+        x = (obj["x0"] + obj["x1"]) / 2
+        y = (obj["top"] + obj["bottom"]) / 2
+        return not any(x0 <= x <= x1 and top <= y <= bottom for x0, top, x1, bottom in bboxes)
+
+    text_page = page.filter(outside_tables) if bboxes else page
+    return PageContent(
+        page_number=page.page_number,
+        text=text_page.extract_text() or "",
+        tables=[t.extract() for t in tables],
+    )
+
+
+def _check_memory(pdf, page_number: int):
+    """
+    超过 PDF_MEMORY_LIMIT_MB 时先释放 pdfminer 的对象缓存并触发 GC，仍然超限则中止解析。
+    """
+    limit = settings.PDF_MEMORY_LIMIT_MB * 1024 * 1024
+    if limit <= 0 or current_rss_bytes() <= limit:
+        return
+    cached_objs = getattr(pdf.doc, "_cached_objs", None)
+    if isinstance(cached_objs, dict):
+        cached_objs.clear()
+    gc.collect()
+    rss = current_rss_bytes()
+    if rss > limit:
+        raise PageMemoryLimitExceeded(
+            f"解析到第 {page_number} 页时内存占用 {rss / 1024 / 1024:.0f}MB 超过上限 {settings.PDF_MEMORY_LIMIT_MB}MB"
+        )
+
+
+def iter_pdf_pages(path: str | os.PathLike) -> Iterator[PageContent]:
+    """
+    逐页解析 PDF。pdfplumber 的 pdf.pages 会一次性创建并持有所有页面对象（以及各自的版面缓存），
+    这里直接遍历 pdfminer 的页面，每页处理完立即释放其缓存，内存占用与页数无关。
+    """
+    with pdfplumber.open(path) as pdf:
+        doctop = 0
+        for page_number, pdfminer_page in enumerate(PDFPage.create_pages(pdf.doc), start=1):
+            page = Page(pdf, pdfminer_page, page_number=page_number, initial_doctop=doctop)
+            doctop += page.height
+            try:
+                content = extract_page_content(page)
+            finally:
+                page.close()
+            del page
+            _check_memory(pdf, page_number)
+            yield content
+
+
+def _cache_path(file_hash: str) -> Path:
+    return Path(settings.PAGE_CACHE_DIR) / f"{file_hash}.jsonl"
+
+
+def iter_pages(path: str | os.PathLike) -> Iterator[PageContent]:
+    """
+    逐页读取 PDF 的正文和表格（生成器）。结果按文件内容哈希缓存为 JSON Lines，同一份报告只解析一次；
+    首次解析时边解析边写缓存，完整遍历结束后才生效。
+    """
+    cache_path = _cache_path(file_sha256(path))
+    if cache_path.exists():
+        with open(cache_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield PageContent(**json.loads(line))
+        return
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    completed = False
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for page in iter_pdf_pages(path):
+                f.write(json.dumps(asdict(page), ensure_ascii=False) + "\n")
+                yield page
+        os.replace(tmp_path, cache_path)
+        completed = True
+    finally:
+        if not completed:
+            tmp_path.unlink(missing_ok=True)
+
+
+def load_pages(path: str | os.PathLike) -> list[PageContent]:
+    """
+    读取 PDF 每页的正文和表格。结果按文件内容哈希缓存，同一份报告只解析一次。
+    """
+    return list(iter_pages(path))
+
+
+def drop_pages(file_hash: str):
+    _cache_path(file_hash).unlink(missing_ok=True)
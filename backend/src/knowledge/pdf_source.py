@@ -0,0 +1,71 @@
+import asyncio
+from pathlib import Path
+from pydantic import Field
+from crewai.knowledge.source.pdf_knowledge_source import PDFKnowledgeSource
+from crewai.knowledge.storage.knowledge_storage import KnowledgeStorage
+from src.knowledge.chunker import DEFAULT_CHUNK_SIZE, DEFAULT_MIN_CHUNK_CHARS, PageAwareChunker
+from src.knowledge.page_store import iter_pages
+
+
+class PageAwarePDFKnowledgeSource(PDFKnowledgeSource):
+    """
+    按页 / 标题 / 表格边界切分的 PDF 知识源。
+
+    与 PDFKnowledgeSource 相比，chunk 更少、更密，表格不会被拆行，
+    并且每个 chunk 都带有页码和章节元数据（同时写在正文开头，便于 [[Page X]] 引用）。
+    """
+
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    min_chunk_chars: int = DEFAULT_MIN_CHUNK_CHARS
+    chunk_metadata: list[dict] = Field(default_factory=list)
+    # 向量索引的作用域，默认取文件所在目录名（即 knowledge/{session_id}/ 中的会话 ID）
+    index_scope: str | None = None
+    # 检索时附加的元数据过滤条件，例如 {"source": "2023年报.pdf"} 只检索这一份报告
+    retrieval_filter: dict | None = None
+
+    def load_content(self) -> dict[Path, str]:
+        # 页面在 add() 中逐页读取（与 ingestion_service 相同的流式切分），这里不预先加载全文
+        return {self.convert_to_path(path): "" for path in self.safe_file_paths}
+
+    def add(self) -> None:
+        if self.retrieval_filter and hasattr(self.storage, "bind_filter"):
+            self.storage.bind_filter(self.retrieval_filter)
+        chunker = PageAwareChunker(chunk_size=self.chunk_size, min_chunk_chars=self.min_chunk_chars)
+        for path in self.content:
+            # 已入库的文件直接读取页面缓存，不再重新解析 PDF
+            for chunk in chunker.iter_chunks(iter_pages(path), source=path.name):
+                self.chunks.append(chunk.content)
+                self.chunk_metadata.append(chunk.metadata)
+        self._save_documents()
+
+    async def aadd(self) -> None:
+        await asyncio.to_thread(self.add)
+
+    def _save_documents(self) -> None:
+        if self.storage is None:
+            raise ValueError("No storage found to save documents.")
+        if not self.chunks:
+            return
+        if hasattr(self.storage, "save_chunks"):
+            self.storage.bind_scope(self.index_scope or self.safe_file_paths[0].parent.name)
+            self.storage.save_chunks(self.chunks, self.chunk_metadata)
+            return
+        if not isinstance(self.storage, KnowledgeStorage):
+            self.storage.save(self.chunks)
+            return
+
+        # KnowledgeStorage.save() 只接收纯文本，这里直接写入底层 RAG client 以保留页码/章节元数据
+        client = self.storage._get_client()
+        collection_name = (
+            f"knowledge_{self.storage.collection_name}"
+            if self.storage.collection_name
+            else "knowledge"
+        )
+        client.get_or_create_collection(collection_name=collection_name)
+        client.add_documents(
+            collection_name=collection_name,
+            documents=[
+                {"content": content, "metadata": metadata}
+                for content, metadata in zip(self.chunks, self.chunk_metadata)
+            ],
+        )
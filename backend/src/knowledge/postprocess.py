@@ -0,0 +1,149 @@
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+CITATION_PATTERN = re.compile(r"^\[\[[^\]]*\| Page \d+\]\]\s*")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数: 中文字符约 1 token/字，其余约 4 字符/token。"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@dataclass
+class RetrievalStats:
+    input_chunks: int = 0
+    output_chunks: int = 0
+    duplicates: int = 0
+    merged: int = 0
+    dropped: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def add(self, other: "RetrievalStats"):
+        for name in ("input_chunks", "output_chunks", "duplicates", "merged", "dropped", "tokens_before", "tokens_after"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+@dataclass
+class RetrievalHit:
+    id: str
+    content: str
+    metadata: dict
+    score: float
+    position: int # 在索引中的行号；同一文件的 chunk 按顺序写入，行号相邻即原文相邻
+    tokens: int = field(init=False)
+
+    def __post_init__(self):
+        self.tokens = estimate_tokens(self.content)
+
+
+class RetrievalPostProcessor:
+    """
+    知识检索结果进入 Agent 提示词之前的后处理:
+
+    1. 近似去重: 用检索时已有的 embedding 计算两两余弦相似度（一次矩阵乘法），
+       与更高分结果的相似度超过阈值的 chunk 被丢弃（重复的页眉、摘要与附注中的同一张表等）；
+    2. 合并: 同一页上原文相邻的 chunk 合并为一段，只保留一次引用标记；
+    3. 打包: 按得分依次放入，直到达到 token 预算。
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, token_budget: int = 0):
+        self.similarity_threshold = similarity_threshold
+        self.token_budget = token_budget
+        self.totals = RetrievalStats()
+        self._lock = threading.Lock()
+
+    def process(self, hits: list[RetrievalHit], vectors: np.ndarray, limit: int | None = None) -> tuple[list[RetrievalHit], RetrievalStats]:
+        """
+        hits 需按得分降序排列，vectors 为对应的归一化 embedding (len(hits), dim)。
+        """
+        stats = RetrievalStats(input_chunks=len(hits), tokens_before=sum(h.tokens for h in hits))
+        kept = self._dedupe(hits, vectors, stats)
+        kept = self._merge_adjacent(kept, stats)
+        kept = self._pack(kept, limit, stats)
+        stats.output_chunks = len(kept)
+        stats.tokens_after = sum(h.tokens for h in kept)
+        with self._lock:
+            self.totals.add(stats)
+        if stats.tokens_saved:
+            logger.info(
+                f"Retrieval post-process: {stats.input_chunks} -> {stats.output_chunks} chunks "
+                f"({stats.duplicates} duplicates, {stats.merged} merged, {stats.dropped} over budget), "
+                f"saved ~{stats.tokens_saved} tokens"
+            )
+        return kept, stats
+
+    def _dedupe(self, hits: list[RetrievalHit], vectors: np.ndarray, stats: RetrievalStats) -> list[RetrievalHit]:
+        if len(hits) < 2:
+            return list(hits)
+        similarity = np.asarray(vectors, dtype=np.float32) @ np.asarray(vectors, dtype=np.float32).T
+        keep = np.zeros(len(hits), dtype=bool)
+        for i in range(len(hits)):
+            # 只与已保留的（得分更高的）结果比较
+            if not keep.any() or similarity[i, keep].max() < self.similarity_threshold:
+                keep[i] = True
+        stats.duplicates = int(len(hits) - keep.sum())
+        return [hit for hit, flag in zip(hits, keep) if flag]
+
+    @staticmethod
+    def _merge_adjacent(hits: list[RetrievalHit], stats: RetrievalStats) -> list[RetrievalHit]:
+        by_position = sorted(hits, key=lambda h: h.position)
+        groups: list[list[RetrievalHit]] = []
+        for hit in by_position:
+            previous = groups[-1][-1] if groups else None
+            if (
+                previous is not None
+                and hit.position == previous.position + 1
+                and hit.metadata.get("source") == previous.metadata.get("source")
+                and hit.metadata.get("page") is not None
+                and hit.metadata.get("page") == previous.metadata.get("page")
+            ):
+                groups[-1].append(hit)
+            else:
+                groups.append([hit])
+
+        merged = []
+        for group in groups:
+            head = group[0]
+            if len(group) == 1:
+                merged.append(head)
+                continue
+            parts = [head.content]
+            for hit in group[1:]:
+                # 去掉重复的 [[文件 | Page X]] 引用标记，保留章节/表格标题
+                parts.append(CITATION_PATTERN.sub("", hit.content, count=1))
+            combined = RetrievalHit(
+                id=head.id,
+                content="\n".join(parts),
+                metadata={**head.metadata, "merged_chunks": len(group)},
+                score=max(h.score for h in group),
+                position=head.position,
+            )
+            merged.append(combined)
+            stats.merged += len(group) - 1
+        merged.sort(key=lambda h: h.score, reverse=True)
+        return merged
+
+    def _pack(self, hits: list[RetrievalHit], limit: int | None, stats: RetrievalStats) -> list[RetrievalHit]:
+        packed, used = [], 0
+        for hit in hits:
+            if limit is not None and len(packed) >= limit:
+                stats.dropped += 1
+                continue
+            if self.token_budget > 0 and packed and used + hit.tokens > self.token_budget:
+                stats.dropped += 1
+                continue
+            packed.append(hit)
+            used += hit.tokens
+        return packed
@@ -0,0 +1,129 @@
+import argparse
+import json
+import time
+import numpy as np
+
+# none: float32 原始精度；float16: 2x 压缩；int8: 每行一个缩放系数的对称标量量化，约 4x 压缩
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+# 分块把量化矩阵转换为 float32 参与点积，避免一次性还原整个矩阵
+SCORE_BLOCK_ROWS = 32768
+
+
+def quantize(vectors: np.ndarray, mode: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    量化归一化后的 embedding 矩阵。返回 (量化矩阵, 每行缩放系数)；只有 int8 有缩放系数。
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if mode == "none":
+        return vectors, None
+    if mode == "float16":
+        return vectors.astype(np.float16), None
+    if mode == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales
+    raise ValueError(f"Unknown quantization mode: {mode} (expected one of {QUANTIZATION_MODES})")
+
+
+def dequantize(quantized: np.ndarray, scales: np.ndarray | None) -> np.ndarray:
+    vectors = np.asarray(quantized, dtype=np.float32)
+    if scales is not None:
+        vectors = vectors * np.asarray(scales, dtype=np.float32)[:, None]
+    return vectors
+
+
+def quantized_scores(quantized: np.ndarray, scales: np.ndarray | None, query: np.ndarray) -> np.ndarray:
+    """
+    量化矩阵与（已归一化的）查询向量的点积。int8 先用整数值做点积，再乘以每行的缩放系数。
+    """
+    query = np.asarray(query, dtype=np.float32)
+    if quantized.dtype == np.float32:
+        return quantized @ query
+    scores = np.empty(len(quantized), dtype=np.float32)
+    for start in range(0, len(quantized), SCORE_BLOCK_ROWS):
+        block = np.asarray(quantized[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+        scores[start:start + len(block)] = block @ query
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def evaluate_recall(
+    vectors: np.ndarray,
+    mode: str,
+    k: int = 10,
+    n_queries: int = 200,
+    rerank_factor: int = 0,
+    noise: float = 0.05,
+    seed: int = 0,
+) -> dict:
+    """
+    离线召回率检查: 以 float32 精确检索的 top-k 为基准，衡量量化（及 float32 重排）后的 recall@k 和内存占用。
+    查询向量取索引中的随机行并加少量噪声，模拟与文档相近的真实查询。
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + rng.normal(scale=noise, size=(len(picks), vectors.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    quantized, scales = quantize(vectors, mode)
+    hits = 0
+    started = time.perf_counter()
+    for query in queries:
+        exact = set(_top_k(vectors @ query, k).tolist())
+        scores = quantized_scores(quantized, scales, query)
+        if rerank_factor > 1 and mode != "none":
+            candidates = _top_k(scores, k * rerank_factor)
+            approx = candidates[_top_k(vectors[candidates] @ query, k)]
+        else:
+            approx = _top_k(scores, k)
+        hits += len(exact & set(approx.tolist()))
+    elapsed = time.perf_counter() - started
+
+    quantized_bytes = quantized.nbytes + (scales.nbytes if scales is not None else 0)
+    return {
+        "mode": mode,
+        "rerank_factor": rerank_factor if mode != "none" else 0,
+        "k": k,
+        "queries": len(queries),
+        "rows": len(vectors),
+        "recall": round(hits / (len(queries) * min(k, len(vectors))), 4),
+        "float32_bytes": vectors.nbytes,
+        "scoring_bytes": quantized_bytes,
+        "compression": round(vectors.nbytes / quantized_bytes, 2),
+        "ms_per_query": round(elapsed / len(queries) * 1000, 3),
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Offline recall check for quantized knowledge vectors.")
+    parser.add_argument("index_dir", help="Index directory (VECTOR_INDEX_DIR/<scope>)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    # 按 meta.json 记录的当前一代文件读取; 只保存了量化矩阵的索引以还原后的向量为基准（衡量的是重新量化的损失）
+    from src.knowledge.vector_index import MmapVectorIndex
+    vectors = MmapVectorIndex(args.index_dir).matrix()
+    if vectors is None:
+        parser.error(f"{args.index_dir} 中没有向量")
+    results = [evaluate_recall(vectors, "none", args.k, args.queries)]
+    for mode in ("float16", "int8"):
+        results.append(evaluate_recall(vectors, mode, args.k, args.queries))
+        results.append(evaluate_recall(vectors, mode, args.k, args.queries, rerank_factor=args.rerank_factor))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """查询文本归一化: 全角转半角 (NFKC)、合并空白。"合并 利润表" 与 "合并　利润表 " 视为同一查询。"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    查询 embedding 的 LRU 缓存，键为 (embedding 模型, 归一化后的查询文本)。
+
+    Agent 在不同会话、不同运行中反复检索相同的问题（如 "合并利润表"、"主要风险因素"），
+    命中时检索只剩本地向量搜索，不再有 embedding 网络请求。
+    指定 directory 时同时持久化到磁盘（每个键一个 .npy 文件，原子写入，多进程 / 重启后共享）。
+    """
+
+    def __init__(self, max_entries: int = 2048, directory: Path | str | None = None):
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory else None
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.npy"
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, model: str, text: str) -> np.ndarray | None:
+        if self.max_entries <= 0:
+            return None
+        key = self.key(model, text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+        if self.directory is not None:
+            try:
+                vector = np.load(self._path(key))
+            except (FileNotFoundError, ValueError, OSError):
+                vector = None
+            if vector is not None:
+                self._remember(key, vector)
+                with self._lock:
+                    self.hits += 1
+                return vector
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model: str, text: str, vector: np.ndarray):
+        if self.max_entries <= 0:
+            return
+        key = self.key(model, text)
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        self._remember(key, vector)
+        if self.directory is None:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.directory / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, vector)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not persist query embedding: {e}")
+
+    def get_or_embed(self, model: str, text: str, embed) -> tuple[np.ndarray, bool]:
+        """返回 (向量, 是否命中缓存)。未命中时对归一化后的文本调用 embed([text])。"""
+        vector = self.get(model, text)
+        if vector is not None:
+            return vector, True
+        vector = np.asarray(embed([normalize_query(text)])[0], dtype=np.float32)
+        self.put(model, text, vector)
+        return vector, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "persistent": self.directory is not None,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
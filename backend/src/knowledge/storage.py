@@ -0,0 +1,324 @@
+import asyncio
+import hashlib
+import logging
+import shutil
+import threading
+from pathlib import Path
+from typing import Any
+import numpy as np
+from pydantic import Field, PrivateAttr, model_validator
+from crewai.knowledge.storage.base_knowledge_storage import BaseKnowledgeStorage
+from crewai.knowledge.storage.factory import set_knowledge_storage_factory
+from crewai.knowledge.storage.knowledge_storage import KnowledgeStorage
+from crewai.rag.embeddings.factory import build_embedder
+from src.core.config import get_settings
+from src.core.tracing import tracer
+from src.knowledge.chunk_store import SessionChunkView, SharedChunkStore
+from src.knowledge.postprocess import RetrievalHit, RetrievalPostProcessor
+from src.knowledge.query_cache import QueryEmbeddingCache
+from src.knowledge.vector_index import MmapVectorIndex
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+_indexes: dict[Path, MmapVectorIndex | SessionChunkView] = {}
+_indexes_lock = threading.Lock()
+_shared_store: SharedChunkStore | None = None
+
+retrieval_postprocessor = RetrievalPostProcessor(
+    similarity_threshold=settings.RETRIEVAL_DEDUP_THRESHOLD,
+    token_budget=settings.RETRIEVAL_TOKEN_BUDGET,
+)
+
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=settings.QUERY_EMBEDDING_CACHE_SIZE,
+    directory=Path(settings.CACHE_DIR) / "query_embeddings" if settings.QUERY_EMBEDDING_CACHE_PERSIST else None,
+)
+
+
+def get_shared_store() -> SharedChunkStore:
+    global _shared_store
+    with _indexes_lock:
+        if _shared_store is None:
+            directory = settings.SHARED_CHUNK_DIR or Path(settings.VECTOR_INDEX_DIR) / "_shared"
+            _shared_store = SharedChunkStore(
+                Path(directory).resolve(),
+                quantization=settings.VECTOR_QUANTIZATION, rerank_factor=settings.VECTOR_RERANK_FACTOR,
+            )
+        return _shared_store
+
+
+def get_index(scope: str) -> MmapVectorIndex | SessionChunkView:
+    """
+    同一进程内，同一个 scope 只保留一个索引对象（共享内存映射）。
+    开启 SHARED_CHUNK_STORE 时返回引用共享 chunk 库的会话视图。
+    """
+    directory = Path(settings.VECTOR_INDEX_DIR).resolve() / scope
+    store = get_shared_store() if settings.SHARED_CHUNK_STORE else None
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            if store is not None:
+                index = _indexes[directory] = SessionChunkView(directory, store)
+            else:
+                index = _indexes[directory] = MmapVectorIndex(
+                    directory, quantization=settings.VECTOR_QUANTIZATION, rerank_factor=settings.VECTOR_RERANK_FACTOR
+                )
+        return index
+
+
+def drop_index(scope: str):
+    """
+    删除一个 scope 的索引目录；会话视图先释放对共享 chunk 的引用（引用数归零的 chunk 随之删除）。
+    """
+    index = get_index(scope)
+    if isinstance(index, SessionChunkView):
+        index.reset()
+    with _indexes_lock:
+        _indexes.pop(index.directory, None)
+    shutil.rmtree(index.directory, ignore_errors=True)
+
+
+def collect_shared_chunks() -> int:
+    """按磁盘上全部会话视图重建共享 chunk 的引用计数，清理无人引用的 chunk。返回删除的 chunk 数。"""
+    store = get_shared_store()
+    root = Path(settings.VECTOR_INDEX_DIR).resolve()
+    scopes = [p.name for p in root.iterdir() if p.is_dir() and p != store.directory] if root.exists() else []
+    views = [index for index in map(get_index, scopes) if isinstance(index, SessionChunkView)]
+    return store.gc(views)
+
+
+def embedding_model_name(embedder: Any) -> str:
+    """查询 embedding 缓存键中的模型部分: "provider:model"。"""
+    if not isinstance(embedder, dict):
+        return "embedding"
+    return f"{embedder.get('provider', '')}:{(embedder.get('config') or {}).get('model', '')}"
+
+
+def merge_filters(bound: dict[str, Any] | None, metadata_filter: dict[str, Any] | None) -> dict[str, Any] | None:
+    """知识源绑定的过滤条件与调用方传入的条件合并（调用方优先）。"""
+    merged = {**(bound or {}), **(metadata_filter or {})}
+    return merged or None
+
+
+def chunk_id(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class MmapKnowledgeStorage(BaseKnowledgeStorage):
+    """
+    基于 MmapVectorIndex 的 CrewAI knowledge 存储后端（ChromaDB 的进程内替代方案）。
+
+    默认按 collection_name 建索引；知识源可以通过 bind_scope() 绑定到会话，
+    这样同一会话的所有 Crew 共享一个索引，每个 chunk 只需 embedding 一次。
+    """
+
+    collection_name: str | None = None
+    scope: str | None = None
+    # 知识源绑定的元数据过滤条件，每次检索都会带上（如只检索某一份报告的 chunk）
+    metadata_filter: dict[str, Any] | None = None
+    embedder: Any = Field(default=None, exclude=True)
+    _embedding_function: Any = PrivateAttr(default=None)
+
+    def bind_scope(self, scope: str):
+        self.scope = scope
+
+    def bind_filter(self, metadata_filter: dict[str, Any] | None):
+        self.metadata_filter = metadata_filter
+
+    @property
+    def index(self) -> MmapVectorIndex | SessionChunkView:
+        return get_index(self.scope or self.collection_name or "default")
+
+    @property
+    def _embedding_model(self) -> str:
+        return embedding_model_name(self.embedder)
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        if self._embedding_function is None:
+            if not self.embedder:
+                raise ValueError("MmapKnowledgeStorage 需要 embedder 配置")
+            self._embedding_function = build_embedder(self.embedder)
+        with tracer.span(self._embedding_model, "embedding", texts=len(texts), cache_hit=False):
+            return np.asarray(self._embedding_function(texts), dtype=np.float32)
+
+    def _embed_query(self, query_text: str) -> np.ndarray:
+        """查询向量先查 LRU 缓存（按 embedding 模型 + 归一化文本），未命中才调用 embedding 接口。"""
+        vector, hit = query_embedding_cache.get_or_embed(self._embedding_model, query_text, self._embed)
+        if hit:
+            with tracer.span(self._embedding_model, "embedding", texts=1, cache_hit=True):
+                pass
+        return vector
+
+    def save_chunks(self, documents: list[str], metadatas: list[dict]) -> int:
+        """
+        保存 chunk 及其元数据。已在索引中的 chunk（按内容哈希）不会重复 embedding。
+        """
+        if not documents:
+            return 0
+        ids = [chunk_id(doc) for doc in documents]
+        index = self.index
+        exists = index.contains(ids)
+        missing = [i for i, present in enumerate(exists) if not present]
+        if not missing:
+            return 0
+        if isinstance(index, SessionChunkView):
+            # 只为共享库中还没有的正文调用 embedding
+            added, embedded = index.add(
+                [ids[i] for i in missing],
+                [documents[i] for i in missing],
+                [metadatas[i] for i in missing],
+                self._embed,
+            )
+            logger.info(f"Indexed {added} new chunks into {index.directory} ({embedded} embedded, {added - embedded} shared)")
+            tracer.annotate(chunks_added=added, chunks_embedded=embedded, chunks_shared=added - embedded)
+            return added
+        vectors = self._embed([documents[i] for i in missing])
+        added = self.index.add(
+            [ids[i] for i in missing],
+            [documents[i] for i in missing],
+            [metadatas[i] for i in missing],
+            vectors,
+        )
+        logger.info(f"Indexed {added} new chunks into {self.index.directory}")
+        return added
+
+    def save(self, documents: list[str]) -> None:
+        self.save_chunks(documents, [{} for _ in documents])
+
+    def search(
+        self,
+        query: list[str],
+        limit: int = 5,
+        metadata_filter: dict[str, Any] | None = None,
+        score_threshold: float = 0.6,
+    ) -> list[dict]:
+        with tracer.span("knowledge search", "retrieval", limit=limit):
+            return self._search(query, limit, merge_filters(self.metadata_filter, metadata_filter), score_threshold)
+
+    def _search(
+        self,
+        query: list[str],
+        limit: int,
+        metadata_filter: dict[str, Any] | None,
+        score_threshold: float,
+    ) -> list[dict]:
+        try:
+            if not query:
+                raise ValueError("Query cannot be empty")
+            query_text = " ".join(query) if len(query) > 1 else query[0]
+            query_vector = self._embed_query(query_text)
+            if not settings.RETRIEVAL_POSTPROCESS:
+                hits = self.index.search(query_vector, limit, score_threshold, where=metadata_filter)
+                return [
+                    {"id": row["id"], "content": row["content"], "metadata": row["metadata"], "score": score}
+                    for row, score in hits
+                ]
+
+            # 多取一些候选，去重/合并后再截断到 limit
+            rows, scores, positions, vectors = self.index.search_matrix(
+                query_vector, limit * settings.RETRIEVAL_OVERFETCH, score_threshold, where=metadata_filter
+            )
+            candidates = [
+                RetrievalHit(id=row["id"], content=row["content"], metadata=row["metadata"], score=float(score), position=int(position))
+                for row, score, position in zip(rows, scores, positions)
+            ]
+            hits, _ = retrieval_postprocessor.process(candidates, vectors, limit=limit)
+            return [
+                {"id": hit.id, "content": hit.content, "metadata": hit.metadata, "score": hit.score}
+                for hit in hits
+            ]
+        except Exception as e:
+            logger.error(f"Error during knowledge search: {e}")
+            return []
+
+    def reset(self) -> None:
+        drop_index(self.scope or self.collection_name or "default")
+
+    async def asearch(
+        self,
+        query: list[str],
+        limit: int = 5,
+        metadata_filter: dict[str, Any] | None = None,
+        score_threshold: float = 0.6,
+    ) -> list[dict]:
+        return await asyncio.to_thread(self.search, query, limit, metadata_filter, score_threshold)
+
+    async def asave(self, documents: list[str]) -> None:
+        await asyncio.to_thread(self.save, documents)
+
+    async def areset(self) -> None:
+        await asyncio.to_thread(self.reset)
+
+
+class FilteredKnowledgeStorage(KnowledgeStorage):
+    """
+    CrewAI 默认的 ChromaDB 存储，增加与 MmapKnowledgeStorage 相同的 bind_filter():
+    Knowledge.query() 不传过滤条件，知识源绑定的条件在这里合并进每次检索。
+    查询 embedding 同样经过 query_embedding_cache（Chroma 检索时调用 embedding 函数的 embed_query）。
+    """
+
+    metadata_filter: dict[str, Any] | None = None
+
+    @model_validator(mode="after")
+    def _cache_query_embeddings(self):
+        function = getattr(self._client, "embedding_function", None)
+        if function is None:
+            return self
+        model = embedding_model_name(self.embedder)
+        embed_query = function.embed_query
+
+        def embed(texts: list[str]):
+            with tracer.span(model, "embedding", texts=len(texts), cache_hit=False):
+                return embed_query(input=texts)
+
+        def cached_embed_query(input):
+            vectors = []
+            for text in [input] if isinstance(input, str) else input:
+                vector, hit = query_embedding_cache.get_or_embed(model, text, embed)
+                if hit:
+                    with tracer.span(model, "embedding", texts=1, cache_hit=True):
+                        pass
+                vectors.append(vector)
+            return vectors
+
+        # 只替换查询路径；文档入库仍走 embedding 函数本身
+        function.embed_query = cached_embed_query
+        return self
+
+    def bind_filter(self, metadata_filter: dict[str, Any] | None):
+        self.metadata_filter = metadata_filter
+
+    def search(
+        self,
+        query: list[str],
+        limit: int = 5,
+        metadata_filter: dict[str, Any] | None = None,
+        score_threshold: float = 0.6,
+    ):
+        return super().search(query, limit, merge_filters(self.metadata_filter, metadata_filter), score_threshold)
+
+    async def asearch(
+        self,
+        query: list[str],
+        limit: int = 5,
+        metadata_filter: dict[str, Any] | None = None,
+        score_threshold: float = 0.6,
+    ):
+        return await super().asearch(query, limit, merge_filters(self.metadata_filter, metadata_filter), score_threshold)
+
+
+def _create_knowledge_storage(embedder, collection_name):
+    if settings.VECTOR_BACKEND != "mmap":
+        return FilteredKnowledgeStorage(embedder=embedder, collection_name=collection_name)
+    return MmapKnowledgeStorage(embedder=embedder, collection_name=collection_name)
+
+
+def configure_vector_backend():
+    """
+    根据 VECTOR_BACKEND 配置注册 CrewAI 的 knowledge 存储工厂。
+    "chroma" 使用 CrewAI 默认的 KnowledgeStorage（FilteredKnowledgeStorage）；"mmap" 使用 MmapKnowledgeStorage。
+    """
+    set_knowledge_storage_factory(_create_knowledge_storage)
+    logger.info(f"Knowledge vector backend: {settings.VECTOR_BACKEND}")
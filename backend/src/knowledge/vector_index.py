@@ -0,0 +1,352 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from src.knowledge.quantization import QUANTIZATION_MODES, dequantize, quantize, quantized_scores
+
+# 每次写入生成一代新的矩阵文件（文件名带代号），meta.json 记录当前代的文件名，
+# 替换 meta.json 就是唯一的原子切换点: 读者要么看到完整的旧一代，要么看到完整的新一代
+VECTORS_FILE = "vectors.{generation}.npy"
+# 量化存储: vectors.float16.{generation}.npy / vectors.int8.{generation}.npy (+ int8 的每行缩放系数)
+QUANTIZED_FILE = "vectors.{mode}.{generation}.npy"
+SCALES_FILE = "scales.{generation}.npy"
+# 旧版本的固定文件名（没有 generation 的 meta.json）
+LEGACY_FILES = {"vectors": "vectors.npy", "quantized": "vectors.{mode}.npy", "scales": "scales.npy"}
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+# 读者在写者清理旧一代文件的间隙打开文件失败时，重新读取 meta.json 的次数
+REFRESH_RETRIES = 5
+
+
+class MmapVectorIndex:
+    """
+    单个会话的进程内向量索引。
+
+    所有 embedding 归一化后存放在一个连续的 float32 矩阵中（vectors.npy），以内存映射方式打开，
+    多个 worker 进程通过操作系统页缓存共享同一份数据；检索是一次矩阵-向量点积加 top-k 部分排序。
+    每一行对应的 id / 正文 / 元数据保存在 meta.json 中。
+
+    写入（追加、删除）通过文件锁串行化。每次写入把矩阵写成带代号的新文件，最后以
+    "写临时文件 + os.replace" 原子替换 meta.json 切换到新一代，再删除旧一代的文件；
+    读者在发现 meta.json 变化后自动重新映射，行数与矩阵不一致时重新读取。
+
+    quantization 为 float16 / int8 时，检索在量化矩阵上打分（内存占用约为 1/2、1/4）；
+    rerank_factor > 1 时另外保留 float32 矩阵（仅在磁盘上映射），对 k * rerank_factor 个候选按原始精度重排。
+    """
+
+    def __init__(self, directory: Path | str, quantization: str = "none", rerank_factor: int = 0):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {quantization}")
+        self.directory = Path(directory)
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self._lock = threading.RLock()
+        self._vectors: np.ndarray | None = None
+        self._quantized: np.ndarray | None = None
+        self._scales: np.ndarray | None = None
+        self._rows: list[dict] = []
+        self._ids: dict[str, int] = {}
+        self._generation = 0
+        self._loaded_version: tuple[int, int] | None = None
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    def _meta_version(self) -> tuple[int, int] | None:
+        # mtime 加 inode: os.replace 每次都换新 inode，同一时钟刻度内的两次写入也能区分
+        try:
+            stat = (self.directory / META_FILE).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_ino
+
+    def _refresh(self):
+        version = self._meta_version()
+        loaded = self._vectors is not None or self._quantized is not None
+        if version == self._loaded_version and (loaded or version is None):
+            return
+        for attempt in range(REFRESH_RETRIES):
+            try:
+                self._load(version)
+                return
+            except (FileNotFoundError, IndexError, ValueError) as e:
+                # 写者刚切换到新一代并删除了旧文件，或读到了不一致的数据: 重新读取 meta.json
+                if attempt == REFRESH_RETRIES - 1:
+                    raise RuntimeError(f"向量索引 {self.directory} 读取失败: {e}") from e
+                time.sleep(0.01 * (attempt + 1))
+                version = self._meta_version()
+
+    def _load(self, version: tuple[int, int] | None):
+        self._vectors = self._quantized = self._scales = None
+        self._rows, self._ids = [], {}
+        self._loaded_version = None
+        if version is None:
+            return
+        with open(self.directory / META_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        rows = meta["rows"]
+        vectors = quantized = scales = None
+        if rows:
+            # 按写入时的存储方式读取（配置改变后，下次写入时再转换）
+            mode = meta.get("quantization", "none")
+            files = meta.get("files") or {key: name.format(mode=mode) for key, name in LEGACY_FILES.items()}
+            if meta.get("full_precision", True):
+                vectors = np.load(self.directory / files["vectors"], mmap_mode="r")
+            if mode != "none":
+                quantized = np.load(self.directory / files["quantized"], mmap_mode="r")
+                if mode == "int8":
+                    scales = np.load(self.directory / files["scales"])
+            for matrix in (vectors, quantized, scales):
+                if matrix is not None and matrix.shape[0] != len(rows):
+                    raise IndexError(f"meta.json 有 {len(rows)} 行，矩阵有 {matrix.shape[0]} 行")
+        self._vectors, self._quantized, self._scales = vectors, quantized, scales
+        self._rows = rows
+        self._ids = {row["id"]: i for i, row in enumerate(rows)}
+        self._generation = meta.get("generation", 0)
+        self._loaded_version = version
+
+    def _full_precision(self) -> np.ndarray | None:
+        """全部行的 float32 向量（没有保留原始矩阵时由量化矩阵还原）。"""
+        if self._vectors is not None:
+            return self._vectors
+        if self._quantized is not None:
+            return dequantize(self._quantized, self._scales)
+        return None
+
+    def matrix(self) -> np.ndarray | None:
+        """当前一代的 float32 向量矩阵（只保存了量化矩阵时为还原后的向量）。"""
+        with self._lock:
+            self._refresh()
+            return self._full_precision()
+
+    def scoring_bytes(self) -> int:
+        """检索时参与打分的矩阵大小（字节）。"""
+        with self._lock:
+            self._refresh()
+            if self._quantized is not None:
+                return self._quantized.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+            return self._vectors.nbytes if self._vectors is not None else 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._rows)
+
+    def contains(self, ids: list[str]) -> list[bool]:
+        with self._lock:
+            self._refresh()
+            return [i in self._ids for i in ids]
+
+    def rows(self) -> list[dict]:
+        with self._lock:
+            self._refresh()
+            return list(self._rows)
+
+    def search(self, query_vector: np.ndarray, k: int, score_threshold: float = 0.0,
+               where: dict | None = None) -> list[tuple[dict, float]]:
+        """
+        余弦相似度 top-k 检索。where 为元数据等值过滤条件。
+        """
+        rows, scores, _, _ = self.search_matrix(query_vector, k, score_threshold, where)
+        return list(zip(rows, scores.tolist()))
+
+    def search_matrix(self, query_vector: np.ndarray, k: int, score_threshold: float = 0.0,
+                      where: dict | None = None) -> tuple[list[dict], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        与 search 相同，但额外返回命中行的行号和向量，供检索后处理（去重、合并相邻 chunk）使用。
+        返回 (rows, scores, positions, vectors)，按得分降序。
+        """
+        with self._lock:
+            self._refresh()
+            vectors, quantized, scales, rows = self._vectors, self._quantized, self._scales, self._rows
+        return self._rank(query_vector, k, score_threshold, where, rows, vectors, quantized, scales)
+
+    def search_ids(self, ids: list[str], rows: list[dict], query_vector: np.ndarray, k: int,
+                   score_threshold: float = 0.0, where: dict | None = None) -> tuple[list[dict], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        只在 ids 指定的行中检索（共享 chunk 库的会话视图使用）。rows 与 ids 一一对应，
+        where 按 rows 中的元数据过滤，返回的行号是在 ids 中的位置。索引中已不存在的 id 不会命中。
+        """
+        with self._lock:
+            self._refresh()
+            vectors, quantized, scales = self._vectors, self._quantized, self._scales
+            positions = np.fromiter((self._ids.get(i, -1) for i in ids), dtype=np.int64, count=len(ids))
+        return self._rank(query_vector, k, score_threshold, where, rows, vectors, quantized, scales, positions)
+
+    def _rank(self, query_vector: np.ndarray, k: int, score_threshold: float, where: dict | None, rows: list[dict],
+              vectors: np.ndarray | None, quantized: np.ndarray | None, scales: np.ndarray | None,
+              positions: np.ndarray | None = None) -> tuple[list[dict], np.ndarray, np.ndarray, np.ndarray]:
+        empty = ([], np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32))
+        if (vectors is None and quantized is None) or k <= 0 or not rows:
+            return empty
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return empty
+        query = query / norm
+
+        def take(matrix: np.ndarray | None, local: np.ndarray | slice):
+            # positions 为 None 时 local 就是矩阵行号；否则先映射到矩阵行号再取出
+            if matrix is None:
+                return None
+            return matrix[local] if positions is None else matrix[np.maximum(positions[local], 0)]
+
+        everything = slice(None)
+        if quantized is not None:
+            scores = quantized_scores(take(quantized, everything), take(scales, everything), query)
+        else:
+            scores = np.asarray(take(vectors, everything)) @ query
+
+        mask = None
+        if where:
+            mask = np.fromiter(
+                (all(row["metadata"].get(key) == value for key, value in where.items()) for row in rows),
+                dtype=bool, count=len(rows),
+            )
+        if positions is not None:
+            mask = positions >= 0 if mask is None else mask & (positions >= 0)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+
+        rerank = quantized is not None and vectors is not None and self.rerank_factor > 1
+        candidates = min(k * self.rerank_factor if rerank else k, len(scores))
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        top = top[np.argsort(-scores[top])]
+        if rerank:
+            # 量化分数只用于粗筛，候选按 float32 原始向量重新打分
+            top = top[np.isfinite(scores[top])]
+            exact = np.asarray(take(vectors, top)) @ query
+            order = np.argsort(-exact)[:k]
+            top, top_scores = top[order], exact[order]
+        else:
+            top = top[:k]
+            top_scores = scores[top]
+        keep = top_scores >= score_threshold
+        top, top_scores = top[keep], top_scores[keep]
+        if vectors is not None:
+            top_vectors = np.asarray(take(vectors, top))
+        else:
+            top_vectors = dequantize(take(quantized, top), take(scales, top))
+        return [rows[i] for i in top], top_scores.astype(np.float32), top, top_vectors
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    @contextmanager
+    def _write_lock(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.directory / LOCK_FILE, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_array(self, name: str, array: np.ndarray):
+        tmp_path = self.directory / f"{name}.tmp"
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=array.dtype, shape=array.shape)
+        out[:] = array
+        out.flush()
+        del out
+        os.replace(tmp_path, self.directory / name)
+
+    def _write(self, vectors: np.ndarray | None, rows: list[dict]):
+        # 按当前配置写入: 原始 float32 矩阵只在不量化或需要重排时保留
+        full_precision = self.quantization == "none" or self.rerank_factor > 1
+        generation = self._generation + 1
+        files = {}
+        if rows:
+            if full_precision:
+                files["vectors"] = VECTORS_FILE.format(generation=generation)
+                self._save_array(files["vectors"], np.asarray(vectors, dtype=np.float32))
+            if self.quantization != "none":
+                quantized, scales = quantize(vectors, self.quantization)
+                files["quantized"] = QUANTIZED_FILE.format(mode=self.quantization, generation=generation)
+                self._save_array(files["quantized"], quantized)
+                if scales is not None:
+                    files["scales"] = SCALES_FILE.format(generation=generation)
+                    self._save_array(files["scales"], scales)
+
+        tmp_meta = self.directory / f"{META_FILE}.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "rows": rows, "quantization": self.quantization, "full_precision": full_precision,
+                    "generation": generation, "files": files,
+                },
+                f, ensure_ascii=False,
+            )
+        os.replace(tmp_meta, self.directory / META_FILE)
+        # 旧一代的文件: 已经映射它们的读者不受影响（删除后映射仍然有效）
+        current = set(files.values())
+        for path in [*self.directory.glob("vectors*.npy"), *self.directory.glob("scales*.npy")]:
+            if path.name not in current:
+                path.unlink(missing_ok=True)
+        # 强制下次访问重新映射
+        self._loaded_version = None
+        self._refresh()
+
+    def add(self, ids: list[str], contents: list[str], metadatas: list[dict], vectors: np.ndarray) -> int:
+        """
+        追加向量，已存在的 id 会被跳过。返回实际新增的行数。
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("vectors 的形状必须为 (len(ids), dim)")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        with self._write_lock():
+            keep = [i for i, doc_id in enumerate(ids) if doc_id not in self._ids]
+            # 同一批次内的重复 id 只保留第一个
+            seen = set()
+            keep = [i for i in keep if not (ids[i] in seen or seen.add(ids[i]))]
+            if not keep:
+                return 0
+            existing = self._full_precision()
+            if existing is not None and existing.shape[1] != vectors.shape[1]:
+                raise ValueError(
+                    f"Embedding 维度不匹配: 索引为 {existing.shape[1]}，新向量为 {vectors.shape[1]}"
+                )
+            new_rows = [{"id": ids[i], "content": contents[i], "metadata": metadatas[i]} for i in keep]
+            merged = vectors[keep] if existing is None else np.concatenate([existing, vectors[keep]])
+            self._write(merged, self._rows + new_rows)
+            return len(keep)
+
+    def remove(self, where: dict) -> int:
+        """
+        删除元数据匹配 where 的所有行（例如某个文件的全部 chunk），并压缩矩阵。返回删除的行数。
+        """
+        with self._write_lock():
+            keep = [
+                i for i, row in enumerate(self._rows)
+                if not all(row["metadata"].get(key) == value for key, value in where.items())
+            ]
+            removed = len(self._rows) - len(keep)
+            if removed == 0:
+                return 0
+            vectors = np.asarray(self._full_precision()[keep]) if keep else None
+            self._write(vectors, [self._rows[i] for i in keep])
+            return removed
+
+    def remove_ids(self, ids: list[str]) -> int:
+        """删除指定 id 的行并压缩矩阵。返回删除的行数。"""
+        targets = set(ids)
+        with self._write_lock():
+            keep = [i for i, row in enumerate(self._rows) if row["id"] not in targets]
+            removed = len(self._rows) - len(keep)
+            if removed == 0:
+                return 0
+            vectors = np.asarray(self._full_precision()[keep]) if keep else None
+            self._write(vectors, [self._rows[i] for i in keep])
+            return removed
+
+    def reset(self):
+        with self._write_lock():
+            self._write(None, [])
@@ -3,10 +3,17 @@ from src.core.patch import apply_monkey_patches
 # Apply patches early to ensure all downstream imports use patched versions
 apply_monkey_patches()
 
+from src.knowledge.storage import configure_vector_backend
+configure_vector_backend()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from src.api.routes import router
 from src.services.session_service import create_db_and_tables
+from src.services.stage_control import install_crew_hooks, start_stage_sweeper, sweep_stale_stages
+from src.core.tracing import install_tracing_hooks
+from src.services.stage_cache import STAGE_AGENT_DIRS
+from src.agents.base_agent import crew_registry
 from fastapi.staticfiles import StaticFiles
 import os
 
@@ -28,6 +35,14 @@ app.add_middleware(
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
+    # 进程重启后，之前残留的 RUNNING 阶段不会再有人更新
+    sweep_stale_stages(startup=True)
+    start_stage_sweeper()
+    install_crew_hooks()
+    install_tracing_hooks()
+    # 启动时解析并校验全部 Crew 配置，配置有误时尽早失败
+    for agent_dir in STAGE_AGENT_DIRS.values():
+        crew_registry.get(agent_dir)
 
 app.include_router(router, prefix="/api")
 
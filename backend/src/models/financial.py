@@ -0,0 +1,27 @@
+from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
+from typing import Optional
+from datetime import datetime
+
+class FinancialLineItem(SQLModel, table=True):
+    """
+    从报告中提取的单个财务科目（长表格式: 文档 × 年份 × 科目）。
+    value 为报表原始单位下的数值，value_yuan 统一换算为"元"，供估值、比率等直接读取。
+    """
+    __table_args__ = (
+        Index("ix_line_item_doc_year_item", "document_hash", "fiscal_year", "item"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    document_hash: str = Field(index=True)
+    file_name: str
+    fiscal_year: Optional[int] = Field(default=None, index=True)
+
+    statement: str # income, balance, cash_flow, other
+    item: str = Field(index=True) # 标准科目 key (如 net_income)，无法识别时为原始名称
+    label: str # 报告中的原始名称
+    value: Optional[float] = None
+    unit: str = "元"
+    value_yuan: Optional[float] = None
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,20 @@
+from sqlmodel import SQLModel, Field
+from typing import Optional
+from datetime import datetime
+import uuid
+
+class FileIngestion(SQLModel, table=True):
+    """
+    会话中每个文件的入库状态（解析 + 切分 + embedding）。
+    """
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    session_id: str = Field(index=True)
+    file_path: str
+    file_hash: str = Field(index=True)
+
+    status: str = Field(default="PENDING") # PENDING, RUNNING, INDEXED, FAILED
+    chunk_count: int = 0
+    error: Optional[str] = None
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    indexed_at: Optional[datetime] = None
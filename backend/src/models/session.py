@@ -15,7 +15,7 @@ class AnalysisSession(SQLModel, table=True):
     
     # 将结果作为 JSON 字符串存储
     business_analysis_result: Optional[str] = None
-    business_status: str = Field(default="PENDING") # PENDING, RUNNING, COMPLETED, FAILED
+    business_status: str = Field(default="PENDING") # PENDING, RUNNING, COMPLETED, FAILED, CANCELLED, TIMEOUT, BUDGET_EXCEEDED
     
     mda_analysis_result: Optional[str] = None
     mda_status: str = Field(default="PENDING")
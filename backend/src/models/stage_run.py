@@ -0,0 +1,24 @@
+from sqlmodel import SQLModel, Field
+from typing import Optional
+from datetime import datetime
+import uuid
+
+class StageRun(SQLModel, table=True):
+    """
+    分析阶段的一次运行: 用于取消、心跳和进程退出后的 RUNNING 状态恢复。
+    """
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    session_id: str = Field(index=True)
+    stage: str # business, mda, financial, competitor, valuation
+
+    status: str = Field(default="RUNNING", index=True) # RUNNING, COMPLETED, FAILED, CANCELLED, TIMEOUT, BUDGET_EXCEEDED, ABANDONED
+    cancel_requested: bool = False
+    tokens_used: int = 0
+    error: Optional[str] = None
+
+    host: str
+    pid: int
+
+    started_at: datetime = Field(default_factory=datetime.utcnow)
+    heartbeat_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
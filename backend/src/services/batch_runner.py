@@ -0,0 +1,254 @@
+import json
+import logging
+import os
+import shutil
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from src.api import routes
+from src.core.hashing import file_sha256
+from src.services.financial_ratios import ratio_context
+from src.services.ingestion_service import ingest_file, list_files
+from src.services.session_service import create_session, get_session, update_session
+from src.services.stage_cache import STAGE_FIELDS
+from src.services.title_generator import generate_session_title
+
+logger = logging.getLogger(__name__)
+
+# 批量运行的阶段顺序；valuation 依赖 financial 写入的财务数据
+BATCH_STAGES = ["ingest", "business", "mda", "financial", "valuation"]
+
+class BatchCheckpoint:
+    """
+    批量运行的断点文件: 每份文档（按内容哈希）记录会话 ID 和各阶段的完成情况。
+    每完成一个阶段原子写入一次，中断后用相同命令重新运行即可从断点继续。
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.documents: dict[str, dict] = json.load(f)
+        except FileNotFoundError:
+            self.documents = {}
+
+    def get(self, key: str) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self.documents.get(key, {})))
+
+    def update(self, key: str, **fields):
+        with self._lock:
+            self.documents.setdefault(key, {"stages": {}}).update(fields)
+            self._save()
+
+    def mark_stage(self, key: str, stage: str, **result):
+        with self._lock:
+            document = self.documents.setdefault(key, {"stages": {}})
+            document.setdefault("stages", {})[stage] = result
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.documents, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+def discover_documents(source: str | os.PathLike) -> list[str]:
+    """
+    输入可以是目录（递归查找 PDF）或清单文件（每行一个 PDF 路径，# 开头为注释，相对路径按清单所在目录解析）。
+    """
+    source = Path(source)
+    if source.is_dir():
+        return sorted(str(p.resolve()) for p in source.rglob("*") if p.suffix.lower() == ".pdf")
+    paths = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = Path(line.split(",")[0].strip())
+            if not path.is_absolute():
+                path = source.parent / path
+            paths.append(str(path.resolve()))
+    return paths
+
+def _open_session(pdf_path: str, record: dict):
+    """复用断点中的会话；没有（或已被删除）时按上传接口的方式新建会话并拷贝文件。"""
+    session = get_session(record["session_id"]) if record.get("session_id") else None
+    if session:
+        return session, False
+    file_name = os.path.basename(pdf_path)
+    session = create_session(file_path="", file_name=file_name)
+    session_dir = os.path.join(routes.UPLOAD_ROOT, session.id)
+    os.makedirs(session_dir, exist_ok=True)
+    target = os.path.join(session_dir, file_name)
+    shutil.copyfile(pdf_path, target)
+    session.file_paths = [os.path.abspath(target)]
+    update_session(session)
+    return session, True
+
+def _run_stage(stage: str, session_id: str, force: bool) -> tuple[bool, bool, str | None]:
+    """
+    运行单个阶段，返回 (是否成功, 是否命中缓存, 错误信息)。复用 API 的后台任务，结果同样写入会话和阶段缓存。
+    """
+    session = get_session(session_id)
+    if stage == "ingest":
+        for path in session.file_paths:
+            ingest_file(session_id, path)
+        generate_session_title(session_id, session.file_paths[0])
+        failed = [f for f in list_files(session_id) if f.status != "INDEXED"]
+        return (not failed, False, failed[0].error if failed else None)
+
+    inputs = None
+    if stage == "valuation":
+        inputs = routes._valuation_inputs(session)
+        if inputs is None:
+            return False, False, "缺少财务数据，请先完成财务分析"
+    elif stage == "competitor":
+        inputs = routes._competitor_inputs(ratio_context(session.file_paths))
+
+    if not force and routes._restore_cached_stage(session, stage, inputs):
+        return True, True, None
+
+    if stage == "business":
+        routes._run_business_analysis_task(session_id, session.file_paths)
+    elif stage == "mda":
+        routes._run_mda_analysis_task(session_id, session.file_paths)
+    elif stage == "competitor":
+        routes._run_competitor_analysis_task(session_id, session.file_paths)
+    elif stage == "financial":
+        routes._run_financial_analysis_task(session_id, session.file_paths, force)
+    elif stage == "valuation":
+        routes._run_valuation_task(session_id, inputs["financial_data"], inputs["moat_rating"], session.file_paths)
+
+    session = get_session(session_id)
+    result_field, status_field = STAGE_FIELDS[stage]
+    if getattr(session, status_field) == "COMPLETED":
+        return True, False, None
+    return False, False, str(getattr(session, result_field) or "")[:500]
+
+def run_document(pdf_path: str, stages: list[str], checkpoint: BatchCheckpoint, force: bool = False) -> dict:
+    key = file_sha256(pdf_path)
+    record = checkpoint.get(key)
+    session, created = _open_session(pdf_path, record)
+    if created or record.get("session_id") != session.id:
+        # 新会话里没有之前的阶段结果，断点记录一并作废
+        checkpoint.update(key, file=pdf_path, session_id=session.id, stages={})
+        record = {"stages": {}}
+
+    results = {}
+    for index, stage in enumerate(stages):
+        previous = record.get("stages", {}).get(stage)
+        if previous and previous.get("status") == "COMPLETED" and not force:
+            results[stage] = {**previous, "resumed": True}
+            continue
+        started = time.perf_counter()
+        try:
+            ok, cached, error = _run_stage(stage, session.id, force)
+        except Exception as e:
+            logger.exception(f"Batch stage {stage} failed for {pdf_path}")
+            ok, cached, error = False, False, str(e)
+        result = {
+            "status": "COMPLETED" if ok else "FAILED",
+            "cached": cached,
+            "seconds": round(time.perf_counter() - started, 3),
+            "error": error,
+            "finished_at": datetime.utcnow().isoformat(),
+        }
+        checkpoint.mark_stage(key, stage, **result)
+        results[stage] = result
+        logger.info(f"[{os.path.basename(pdf_path)}] {stage}: {result['status']} in {result['seconds']}s")
+        if not ok:
+            # 后续阶段依赖前面的结果（valuation 依赖 financial），失败后不再继续，剩余阶段记为跳过
+            for skipped in stages[index + 1:]:
+                previous = record.get("stages", {}).get(skipped)
+                if previous and previous.get("status") == "COMPLETED" and not force:
+                    results[skipped] = {**previous, "resumed": True}
+                    continue
+                results[skipped] = {"status": "SKIPPED", "cached": False, "seconds": 0.0, "error": f"{stage} 阶段失败"}
+                checkpoint.mark_stage(key, skipped, **results[skipped])
+            break
+    return {"file": pdf_path, "session_id": session.id, "stages": results}
+
+def summarize(documents: list[dict], stages: list[str], wall_seconds: float, total_bytes: int) -> dict:
+    completed = [d for d in documents if all(s["status"] == "COMPLETED" for s in d["stages"].values())]
+    stage_summary = {}
+    for stage in stages:
+        runs = [d["stages"][stage] for d in documents if stage in d["stages"]]
+        executed = [r for r in runs if not r.get("resumed") and r["status"] != "SKIPPED"]
+        seconds = [r["seconds"] for r in executed]
+        stage_summary[stage] = {
+            "completed": sum(1 for r in runs if r["status"] == "COMPLETED"),
+            "failed": sum(1 for r in runs if r["status"] == "FAILED"),
+            "skipped": sum(1 for r in runs if r["status"] == "SKIPPED"),
+            "resumed": sum(1 for r in runs if r.get("resumed")),
+            "cached": sum(1 for r in executed if r.get("cached")),
+            "total_seconds": round(sum(seconds), 3),
+            "mean_seconds": round(statistics.mean(seconds), 3) if seconds else 0.0,
+            "p50_seconds": round(statistics.median(seconds), 3) if seconds else 0.0,
+            "max_seconds": round(max(seconds), 3) if seconds else 0.0,
+        }
+    hours = wall_seconds / 3600 if wall_seconds else 0
+    return {
+        "documents": len(documents),
+        "completed": len(completed),
+        "failed": len(documents) - len(completed),
+        "wall_seconds": round(wall_seconds, 3),
+        "documents_per_hour": round(len(documents) / hours, 2) if hours else 0.0,
+        "megabytes_per_minute": round(total_bytes / 1024 / 1024 / (wall_seconds / 60), 2) if wall_seconds else 0.0,
+        "stages": stage_summary,
+        "failures": [
+            {"file": d["file"], "session_id": d.get("session_id"), "stage": stage, "error": r.get("error")}
+            for d in documents for stage, r in d["stages"].items() if r["status"] == "FAILED"
+        ],
+    }
+
+def run_batch(
+    source: str,
+    stages: list[str] | None = None,
+    workers: int = 2,
+    output_dir: str = "batch_output",
+    force: bool = False,
+) -> dict:
+    """
+    对目录 / 清单中的全部 PDF 运行分析流水线: 文档之间最多 workers 个并行，单份文档内各阶段顺序执行。
+    断点写入 output_dir/checkpoint.json，吞吐统计写入 output_dir/summary.json。
+    """
+    stages = stages or BATCH_STAGES
+    unknown = [s for s in stages if s not in BATCH_STAGES and s not in STAGE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown stages: {unknown}")
+
+    pdf_paths = discover_documents(source)
+    checkpoint = BatchCheckpoint(Path(output_dir) / "checkpoint.json")
+    logger.info(f"Batch run: {len(pdf_paths)} documents, stages={stages}, workers={workers}")
+
+    documents = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(run_document, path, stages, checkpoint, force): path for path in pdf_paths}
+        try:
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    documents.append(future.result())
+                except Exception as e:
+                    logger.exception(f"Batch document failed: {path}")
+                    documents.append({"file": path, "session_id": None, "stages": {"ingest": {
+                        "status": "FAILED", "cached": False, "seconds": 0.0, "error": str(e)}}})
+        except KeyboardInterrupt:
+            # 已开始的文档会跑完当前阶段；已完成的阶段都在断点文件里
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    summary = summarize(documents, stages, time.perf_counter() - started, sum(os.path.getsize(p) for p in pdf_paths if os.path.exists(p)))
+    summary_path = Path(output_dir) / "summary.json"
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
@@ -0,0 +1,131 @@
+import csv
+import logging
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from src.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# 报告类型，长的优先（"半年度报告" 不能被识别成 "年度报告"）
+REPORT_TYPES = [
+    (re.compile(r"半年度报告|半年报"), "半年度报告"),
+    (re.compile(r"第一季度报告|一季度报告"), "第一季度报告"),
+    (re.compile(r"第三季度报告|三季度报告"), "第三季度报告"),
+    (re.compile(r"中期报告|Interim Report", re.IGNORECASE), "中期报告"),
+    (re.compile(r"可持续发展报告|社会责任报告|ESG\s*报告"), "可持续发展报告"),
+    (re.compile(r"年度报告|年报|Annual Report", re.IGNORECASE), "年度报告"),
+]
+# "2025年4月2日" 这类完整日期通常是披露日期，不是报告期
+FULL_DATE_SUFFIX = r"(?!\s*\d{1,2}\s*月)"
+YEAR_PATTERN = re.compile(r"(20\d{2})\s*年?\s*(?:半?年度|年|第[一三]季度|中期|Annual|Interim)" + FULL_DATE_SUFFIX, re.IGNORECASE)
+CHINESE_YEAR_PATTERN = re.compile(r"(二[〇○零Ｏ0][一二三四五六七八九十〇○零Ｏ0]{2})\s*年\s*(?:半?年度|年|第[一三]季度|中期)")
+FALLBACK_YEAR_PATTERN = re.compile(r"(?<!\d)(20\d{2})(?!\d)(?!\s*年\s*\d{1,2}\s*月)(?![-/.]\d{1,2}[-/.]\d{1,2})")
+CHINESE_DIGITS = {"〇": 0, "○": 0, "零": 0, "Ｏ": 0, "0": 0, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+# A 股 "证券代码：600519"，港股 "股份代号：00700"
+STOCK_CODE_PATTERN = re.compile(r"(?:证券代码|股票代码|股份代号|Stock Code)\s*[:：]?\s*(\d{3,6})", re.IGNORECASE)
+SHORT_NAME_PATTERN = re.compile(r"(?:证券简称|股票简称|公司简称)\s*[:：]?\s*([^\s:：，,]{2,12})")
+COMPANY_PATTERN = re.compile(
+    r"([一-龥（）()A-Za-z0-9]{2,30}?(?:股份有限公司|有限责任公司|有限公司|集团公司|银行))"
+)
+ENGLISH_COMPANY_PATTERN = re.compile(r"([A-Z][A-Za-z&.,'\- ]{2,60}?(?:Limited|Ltd\.?|Inc\.?|Corporation|Co\.,? Ltd\.?))", re.IGNORECASE)
+
+@dataclass
+class CoverTitle:
+    title: str
+    confidence: float
+    company: str | None = None
+    year: int | None = None
+    report_type: str | None = None
+    stock_code: str | None = None
+    method: str = "heuristic" # heuristic, dictionary
+
+@lru_cache(maxsize=1)
+def load_company_names() -> dict[str, str]:
+    """
+    可选的本地公司名称字典 (COMPANY_NAMES_FILE)，CSV 两列: 证券代码,公司简称。
+    """
+    path = settings.COMPANY_NAMES_FILE
+    if not path:
+        return {}
+    names = {}
+    try:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.reader(f):
+                if len(row) >= 2 and row[0].strip() and row[1].strip():
+                    names[row[0].strip()] = row[1].strip()
+    except OSError as e:
+        logger.warning(f"Could not load company names from {path}: {e}")
+    return names
+
+def _match_dictionary(text: str, stock_code: str | None, names: dict[str, str]) -> str | None:
+    if not names:
+        return None
+    if stock_code:
+        # 港股代码常见 "00700" / "0700" 两种写法
+        for code in (stock_code, stock_code.lstrip("0"), stock_code.zfill(5), stock_code.zfill(6)):
+            if code in names:
+                return names[code]
+    compact = re.sub(r"\s+", "", text)
+    matches = [name for name in names.values() if len(name) >= 2 and name in compact]
+    return max(matches, key=len) if matches else None
+
+def _parse_year(compact: str, head: str) -> tuple[int | None, bool]:
+    """按 阿拉伯数字年份 → 中文数字年份 → 任意 20xx 的顺序识别报告年份，返回 (年份, 是否来自兜底匹配)"""
+    match = YEAR_PATTERN.search(compact) or YEAR_PATTERN.search(head)
+    if match:
+        return int(match.group(1)), False
+    match = CHINESE_YEAR_PATTERN.search(compact)
+    if match and all(ch in CHINESE_DIGITS for ch in match.group(1)):
+        return int("".join(str(CHINESE_DIGITS[ch]) for ch in match.group(1))), False
+    match = FALLBACK_YEAR_PATTERN.search(compact)
+    return (int(match.group(1)), True) if match else (None, False)
+
+def extract_cover_title(text: str) -> CoverTitle:
+    """
+    从封面页文本中按规则识别 公司 / 报告类型 / 年份 / 证券代码，组合为 "贵州茅台 2024 年年度报告" 形式的标题。
+    confidence: 公司 0.5、报告类型 0.25、年份 0.25（仅靠兜底匹配得到的年份只计 0.1）。
+    """
+    head = text[:2000]
+    compact = re.sub(r"[ \t　]+", "", head)
+
+    report_type = next((name for pattern, name in REPORT_TYPES if pattern.search(compact) or pattern.search(head)), None)
+
+    year, year_is_fallback = _parse_year(compact, head)
+
+    code_match = STOCK_CODE_PATTERN.search(compact) or STOCK_CODE_PATTERN.search(head)
+    stock_code = code_match.group(1) if code_match else None
+
+    method = "heuristic"
+    company = _match_dictionary(head, stock_code, load_company_names())
+    if company:
+        method = "dictionary"
+    else:
+        # 证券简称后面常紧跟 "公告编号" 等字段，保留原始空格作为分隔
+        short_match = SHORT_NAME_PATTERN.search(head)
+        company_match = COMPANY_PATTERN.search(compact) or ENGLISH_COMPANY_PATTERN.search(head)
+        if short_match:
+            company = short_match.group(1)
+        elif company_match:
+            company = company_match.group(1).strip()
+
+    confidence = (0.5 if company else 0.0) + (0.25 if report_type else 0.0) + (0.0 if not year else 0.1 if year_is_fallback else 0.25)
+
+    parts = [company] if company else []
+    if year and report_type:
+        parts.append(f"{year} 年{report_type}")
+    elif report_type:
+        parts.append(report_type)
+    elif year:
+        parts.append(str(year))
+    return CoverTitle(
+        title=" ".join(parts),
+        confidence=confidence,
+        company=company,
+        year=year,
+        report_type=report_type,
+        stock_code=stock_code,
+        method=method,
+    )
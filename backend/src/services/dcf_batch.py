@@ -0,0 +1,116 @@
+from typing import Iterable
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field
+from src.tools.dcf_calculator_tool import DCFCalculatorInput
+
+# 批量结果的数值列，与 DCFCalculatorTool 的说明文字中的各项一一对应
+RESULT_COLUMNS = ("owner_earnings", "pv_cash_flows", "terminal_value", "pv_terminal_value", "intrinsic_value")
+# 单次请求的行数上限（向量化计算本身很快，上限主要约束请求体的解析和校验）
+MAX_BATCH_ROWS = 100_000
+INPUT_COLUMNS = (
+    "net_income", "depreciation_amortization", "capex", "growth_rate",
+    "terminal_growth_rate", "discount_rate", "years",
+)
+
+
+class DCFBatchRow(DCFCalculatorInput):
+    id: str | None = Field(None, description="调用方的行标识（如证券代码），原样返回。")
+
+
+class DCFBatchRequest(BaseModel):
+    rows: list[DCFBatchRow]
+
+
+def owner_earnings_dcf(
+    net_income: np.ndarray,
+    depreciation_amortization: np.ndarray,
+    capex: np.ndarray,
+    growth_rate: np.ndarray,
+    terminal_growth_rate: np.ndarray,
+    discount_rate: np.ndarray,
+    years: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """
+    与 DCFCalculatorTool 相同的巴菲特所有者收益 DCF，对整列输入一次算完:
+
+    所有者收益 OE = 净利润 + D&A - |Capex|；第 t 年现金流 OE·(1+g)^t，按 (1+r)^t 折现；
+    终值 = 第 n 年现金流·(1+g_T) / (r - g_T)，再折现 n 年。
+    预测期现值是公比 q = (1+g)/(1+r) 的等比数列求和，用闭式计算，不需要按年份展开矩阵。
+    折现率不大于永续增长率、或预测期小于 1 年的行结果为 NaN。
+    """
+    net_income, depreciation_amortization, capex, g, g_t, r, n = (
+        np.asarray(a, dtype=np.float64)
+        for a in (net_income, depreciation_amortization, capex, growth_rate, terminal_growth_rate, discount_rate, years)
+    )
+    owner_earnings = net_income + depreciation_amortization - np.abs(capex)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        q = (1 + g) / (1 + r)
+        geometric = np.where(np.isclose(q, 1.0, rtol=0, atol=1e-12), n, q * (1 - q ** n) / (1 - q))
+        pv_cash_flows = owner_earnings * geometric
+        final_year_cf = owner_earnings * (1 + g) ** n
+        terminal_value = final_year_cf * (1 + g_t) / (r - g_t)
+        pv_terminal_value = terminal_value / (1 + r) ** n
+
+    invalid = (r <= g_t) | (n < 1) | (r <= -1)
+    results = {
+        "owner_earnings": owner_earnings,
+        "pv_cash_flows": pv_cash_flows,
+        "terminal_value": terminal_value,
+        "pv_terminal_value": pv_terminal_value,
+        "intrinsic_value": pv_cash_flows + pv_terminal_value,
+    }
+    for key in RESULT_COLUMNS[1:]:
+        results[key] = np.where(invalid, np.nan, results[key])
+    return results
+
+
+def _row_error(discount_rate: float, terminal_growth_rate: float, years: int, values: dict) -> str | None:
+    if years < 1:
+        return "预测期年数必须至少为 1"
+    if discount_rate <= terminal_growth_rate:
+        return "折现率必须大于永续增长率"
+    if not all(np.isfinite(v) for v in values.values()):
+        return "输入或计算结果不是有限数值（检查输入，或增长率 / 预测期是否过大）"
+    return None
+
+
+def value_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    DataFrame 版本: 输入列与 DCFCalculatorInput 字段相同（terminal_growth_rate / years 可省略，取工具的默认值），
+    返回追加了 RESULT_COLUMNS 的新 DataFrame。
+    """
+    defaults = {name: field.default for name, field in DCFCalculatorInput.model_fields.items() if not field.is_required()}
+    columns = {
+        name: frame[name].to_numpy(dtype=np.float64) if name in frame else np.full(len(frame), defaults[name], dtype=np.float64)
+        for name in INPUT_COLUMNS
+    }
+    results = owner_earnings_dcf(**columns)
+    return frame.assign(**results)
+
+
+def value_batch(rows: Iterable[DCFCalculatorInput | dict]) -> list[dict]:
+    """
+    批量估值（不调用 LLM）: 每行是 DCFCalculatorInput 形状的输入，返回与输入顺序一致的结构化结果。
+    无法计算的行带 error 字段，数值为 None。
+    """
+    rows = [row if isinstance(row, DCFCalculatorInput) else DCFBatchRow.model_validate(row) for row in rows]
+    if not rows:
+        return []
+    columns = {name: np.fromiter((getattr(row, name) for row in rows), dtype=np.float64, count=len(rows)) for name in INPUT_COLUMNS}
+    results = owner_earnings_dcf(**columns)
+
+    output = []
+    for i, row in enumerate(rows):
+        values = {key: float(results[key][i]) for key in RESULT_COLUMNS}
+        error = _row_error(row.discount_rate, row.terminal_growth_rate, row.years, values)
+        output.append({
+            "id": getattr(row, "id", None),
+            **{
+                key: None if error and (key != "owner_earnings" or not np.isfinite(value)) else value
+                for key, value in values.items()
+            },
+            "error": error,
+        })
+    return output
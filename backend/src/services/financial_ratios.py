@@ -0,0 +1,287 @@
+import logging
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from src.core.hashing import file_sha256
+from src.services.financial_store import UNIT_MULTIPLIERS, get_line_items, parse_unit
+
+logger = logging.getLogger(__name__)
+
+# 比率: key -> (中文名称, 展示格式)。pct 按百分比展示，days 按天数，x 按倍数，yuan 按亿元
+RATIOS: dict[str, tuple[str, str]] = {
+    "revenue": ("营业收入(亿元)", "yuan"),
+    "net_income": ("归母净利润(亿元)", "yuan"),
+    "free_cash_flow": ("自由现金流(亿元)", "yuan"),
+    "gross_margin": ("毛利率", "pct"),
+    "operating_margin": ("营业利润率", "pct"),
+    "net_margin": ("净利率", "pct"),
+    "selling_expense_ratio": ("销售费用率", "pct"),
+    "admin_expense_ratio": ("管理费用率", "pct"),
+    "rd_expense_ratio": ("研发费用率", "pct"),
+    "effective_tax_rate": ("实际税率", "pct"),
+    "roe": ("ROE", "pct"),
+    "roic": ("ROIC", "pct"),
+    "cfo_to_net_income": ("经营现金流/净利润", "x"),
+    "fcf_conversion": ("自由现金流/净利润", "x"),
+    "capex_to_revenue": ("资本开支/营业收入", "pct"),
+    "capex_to_da": ("资本开支/折旧摊销", "x"),
+    "receivable_days": ("应收账款周转天数", "days"),
+    "inventory_days": ("存货周转天数", "days"),
+    "current_ratio": ("流动比率", "x"),
+    "debt_to_equity": ("有息负债/净资产", "x"),
+    "liabilities_to_equity": ("总负债/净资产", "x"),
+    "net_cash": ("净现金(亿元)", "yuan"),
+    "revenue_growth": ("营业收入增长率", "pct"),
+    "net_income_growth": ("归母净利润增长率", "pct"),
+    "fcf_growth": ("自由现金流增长率", "pct"),
+}
+
+# 所得税率无法从利润总额 / 净利润推算时使用法定税率
+DEFAULT_TAX_RATE = 0.25
+# 某一年的科目普遍与其他年份相差约 10^3 / 10^4 / 10^6 / 10^8 倍时，视为单位标注错误（元 / 千元 / 万元 / 百万元 / 亿元混用）
+UNIT_SCALE_EXPONENTS = np.log10(sorted(set(UNIT_MULTIPLIERS.values()) - {1.0}))
+UNIT_SCALE_TOLERANCE = 0.3
+
+
+def load_line_items(file_paths: list[str]) -> pd.DataFrame:
+    """
+    读取一组报告的标准化科目，返回宽表: 行为年份（连续补齐，缺失年份为 NaN），列为科目，数值单位为元。
+    同一年份出现在多份报告中时，以较新的报告为准。
+    """
+    hashes = [file_sha256(p) for p in file_paths if os.path.exists(p)]
+    rows = [
+        {
+            "fiscal_year": row.fiscal_year,
+            "item": row.item,
+            # value_yuan 缺失而原值存在时（旧数据），按标注单位补算
+            "value": row.value_yuan if row.value_yuan is not None
+            else (row.value * parse_unit(row.unit)[1] if row.value is not None else None),
+            "created_at": row.created_at,
+        }
+        for row in get_line_items(hashes)
+        if row.fiscal_year is not None
+    ]
+    if not rows:
+        return pd.DataFrame(dtype=float)
+    long = pd.DataFrame(rows).dropna(subset=["value"]).sort_values("created_at")
+    if long.empty:
+        return pd.DataFrame(dtype=float)
+    wide = long.pivot_table(index="fiscal_year", columns="item", values="value", aggfunc="last")
+    years = range(int(wide.index.min()), int(wide.index.max()) + 1)
+    return wide.reindex(years).astype(float)
+
+
+def normalize_units(items: pd.DataFrame, min_years: int = 3, min_agreement: float = 0.6) -> pd.DataFrame:
+    """
+    修正单位标注错误（一份报告整体标错单位）: 对至少有 min_years 个年份的科目，计算每年与其余年份绝对值中位数之比；
+    某一年多数科目（不少于 min_agreement、且至少 2 个）都偏离同一个 10 的整数次幂（1e3 / 1e4 / 1e6 / 1e8）时，
+    该年全部科目按该倍数换算回来。单个科目的大幅波动（如利润骤降）不会被误判。
+    """
+    values = items.to_numpy(dtype=float, copy=True)
+    magnitude = np.abs(values)
+    valid = np.isfinite(magnitude) & (magnitude > 0)
+    valid &= valid.sum(axis=0) >= min_years
+    if not valid.any():
+        return items
+    # 留一中位数 (年份, 其余年份, 科目): 参照值不受被检查年份本身影响
+    masked = np.where(valid, magnitude, np.nan)
+    others = np.where(np.eye(len(values), dtype=bool)[..., None], np.nan, masked[None, :, :])
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        reference = np.nanmedian(others, axis=1)
+        log_ratio = np.where(valid, np.log10(magnitude / reference), np.nan)
+    valid &= np.isfinite(log_ratio)
+    # (年份, 科目, 候选倍数) 三维比较: 带符号的最接近倍数，0 表示没有偏离
+    exponents = np.concatenate([-UNIT_SCALE_EXPONENTS[::-1], UNIT_SCALE_EXPONENTS])
+    distance = np.abs(np.nan_to_num(log_ratio, nan=0.0)[..., None] - exponents)
+    shifted = valid & (distance.min(axis=-1) <= UNIT_SCALE_TOLERANCE)
+    shift = np.where(shifted, exponents[distance.argmin(axis=-1)], 0.0)
+
+    counts = valid.sum(axis=1)
+    for year_pos in np.nonzero(shifted.sum(axis=1) >= 2)[0]:
+        candidates, votes = np.unique(shift[year_pos][shifted[year_pos]], return_counts=True)
+        best = votes.argmax()
+        if votes[best] >= 2 and votes[best] >= min_agreement * counts[year_pos]:
+            factor = 10.0 ** candidates[best]
+            values[year_pos] = values[year_pos] / factor
+            logger.warning(f"Rescaled line items of {items.index[year_pos]} by 1/{factor:g} (unit mislabel suspected)")
+    return pd.DataFrame(values, index=items.index, columns=items.columns)
+
+
+def _col(items: pd.DataFrame, *names: str) -> pd.Series:
+    """按顺序取第一个存在的科目，逐年用后面的科目补缺失值；都没有时为全 NaN。"""
+    result = pd.Series(np.nan, index=items.index)
+    for name in names:
+        if name in items:
+            result = result.fillna(items[name])
+    return result
+
+
+def _sum(items: pd.DataFrame, *names: str) -> pd.Series:
+    """多个科目相加，缺失的科目按 0 计；某一年所有科目都缺失时为 NaN。"""
+    present = [items[name] for name in names if name in items]
+    if not present:
+        return pd.Series(np.nan, index=items.index)
+    frame = pd.concat(present, axis=1)
+    return frame.sum(axis=1, min_count=1)
+
+
+def _div(numerator: pd.Series, denominator: pd.Series, positive: bool = True) -> pd.Series:
+    """安全除法: 分母为 0 / 缺失（positive=True 时还包括负数）的年份为 NaN。"""
+    invalid = denominator.isna() | (denominator <= 0 if positive else denominator == 0)
+    return numerator / denominator.mask(invalid)
+
+
+def _average(series: pd.Series) -> pd.Series:
+    """期初期末平均值；没有上一年数据时取期末值。"""
+    return ((series + series.shift(1)) / 2).fillna(series)
+
+
+def _growth(series: pd.Series) -> pd.Series:
+    """同比增长率；上一年为负数或缺失时无意义，为 NaN。"""
+    previous = series.shift(1)
+    return (series - previous) / previous.mask(previous <= 0)
+
+
+def compute_ratios(items: pd.DataFrame) -> pd.DataFrame:
+    """
+    由多年科目宽表一次性计算全部比率（按列向量化，不逐年循环）。行为年份，列为 RATIOS 中的比率。
+    """
+    if items.empty:
+        return pd.DataFrame(columns=list(RATIOS), dtype=float)
+
+    revenue = _col(items, "revenue")
+    net_income = _col(items, "net_income_parent", "net_income")
+    total_profit = _col(items, "total_profit")
+    operating_income = _col(items, "operating_income")
+    cfo = _col(items, "cfo")
+    capex = _col(items, "capex").abs()
+    equity = _col(items, "total_equity")
+    cash = _col(items, "cash")
+    interest_bearing_debt = _sum(items, "short_term_debt", "long_term_debt", "bonds_payable")
+    total_liabilities = _col(items, "total_liabilities").fillna(
+        _sum(items, "total_current_liabilities", "total_noncurrent_liabilities")
+    )
+    free_cash_flow = cfo - capex
+
+    tax_rate = (1 - _div(_col(items, "net_income"), total_profit)).clip(0, 0.5).fillna(DEFAULT_TAX_RATE)
+    # 投入资本 = 净资产 + 有息负债 - 货币资金；NOPAT 用营业利润近似 EBIT
+    invested_capital = equity + interest_bearing_debt.fillna(0) - cash.fillna(0)
+    nopat = operating_income * (1 - tax_rate)
+
+    ratios = pd.DataFrame({
+        "revenue": revenue,
+        "net_income": net_income,
+        "free_cash_flow": free_cash_flow,
+        "gross_margin": _div(revenue - _col(items, "operating_cost"), revenue),
+        "operating_margin": _div(operating_income, revenue),
+        "net_margin": _div(net_income, revenue),
+        "selling_expense_ratio": _div(_col(items, "selling_expenses"), revenue),
+        "admin_expense_ratio": _div(_col(items, "admin_expenses"), revenue),
+        "rd_expense_ratio": _div(_col(items, "rd_expenses"), revenue),
+        "effective_tax_rate": tax_rate.where(total_profit.notna()),
+        "roe": _div(net_income, _average(equity)),
+        "roic": _div(nopat, _average(invested_capital)),
+        "cfo_to_net_income": _div(cfo, net_income),
+        "fcf_conversion": _div(free_cash_flow, net_income),
+        "capex_to_revenue": _div(capex, revenue),
+        "capex_to_da": _div(capex, _col(items, "depreciation_amortization")),
+        "receivable_days": _div(_col(items, "accounts_receivable"), revenue) * 365,
+        "inventory_days": _div(_col(items, "inventory"), _col(items, "operating_cost")) * 365,
+        "current_ratio": _div(_col(items, "total_current_assets"), _col(items, "total_current_liabilities")),
+        "debt_to_equity": _div(interest_bearing_debt, equity),
+        "liabilities_to_equity": _div(total_liabilities, equity),
+        "net_cash": cash - interest_bearing_debt.fillna(0),
+        "revenue_growth": _growth(revenue),
+        "net_income_growth": _growth(net_income),
+        "fcf_growth": _growth(free_cash_flow),
+    }, index=items.index)
+    return ratios.replace([np.inf, -np.inf], np.nan)
+
+
+def compound_growth(series: pd.Series) -> float | None:
+    """首尾两个有效年份之间的复合增长率；首尾有非正数时返回 None。"""
+    valid = series.dropna()
+    if len(valid) < 2:
+        return None
+    first, last = valid.iloc[0], valid.iloc[-1]
+    span = valid.index[-1] - valid.index[0]
+    if first <= 0 or last <= 0 or span <= 0:
+        return None
+    return float((last / first) ** (1 / span) - 1)
+
+
+def build_ratio_panel(file_paths: list[str]) -> pd.DataFrame:
+    """读取会话报告的科目并计算比率面板；没有任何科目数据时返回空表。"""
+    items = load_line_items(file_paths)
+    if items.empty:
+        return pd.DataFrame(columns=list(RATIOS), dtype=float)
+    ratios = compute_ratios(normalize_units(items))
+    # 只保留有数据的年份（补齐的空年份仅用于计算增长率）
+    return ratios.loc[items.notna().any(axis=1)]
+
+
+def latest_metrics(file_paths: list[str]) -> dict[str, float]:
+    """最新一年的比率（去掉缺失值），用作同业检索的查询向量；没有数据时返回空 dict。"""
+    try:
+        panel = build_ratio_panel(file_paths)
+    except Exception as e:
+        logger.warning(f"Could not build ratio panel: {e}")
+        return {}
+    if panel.empty:
+        return {}
+    latest = panel.iloc[-1]
+    return {key: float(value) for key, value in latest.items() if pd.notna(value)}
+
+
+def format_value(value: float, kind: str) -> str:
+    if value is None or not np.isfinite(value):
+        return "-"
+    if kind == "pct":
+        return f"{value * 100:.1f}%"
+    if kind == "days":
+        return f"{value:.0f}"
+    if kind == "yuan":
+        return f"{value / 1e8:,.2f}"
+    return f"{value:.2f}"
+
+
+def render_ratio_markdown(panel: pd.DataFrame) -> str:
+    """比率面板渲染为 Markdown 表格（附复合增长率），作为预先计算好的上下文交给 Crew。"""
+    if panel.empty:
+        return ""
+    years = list(panel.index)
+    lines = [
+        "## 财务比率（程序根据已提取的报表科目计算）",
+        "",
+        "| 指标 | " + " | ".join(str(y) for y in years) + " |",
+        "|---|" + "---|" * len(years),
+    ]
+    for key, (label, kind) in RATIOS.items():
+        column = panel[key]
+        if column.isna().all():
+            continue
+        lines.append(f"| {label} | " + " | ".join(format_value(v, kind) for v in column) + " |")
+
+    cagr = [
+        f"{RATIOS[key][0].split('(')[0]} {format_value(value, 'pct')}"
+        for key in ("revenue", "net_income", "free_cash_flow")
+        if (value := compound_growth(panel[key])) is not None
+    ]
+    if cagr:
+        lines += ["", f"{years[0]}-{years[-1]} 年复合增长率: " + "，".join(cagr)]
+    lines += ["", "说明: “-” 表示缺少计算所需的科目或分母为非正数；ROIC 以营业利润近似 EBIT。"]
+    return "\n".join(lines)
+
+
+def ratio_context(file_paths: list[str]) -> str:
+    """
+    供估值 / 竞争分析 Crew 使用的比率上下文；读取失败或没有数据时返回提示文字，不影响阶段运行。
+    """
+    try:
+        markdown = render_ratio_markdown(build_ratio_panel(file_paths))
+    except Exception as e:
+        logger.warning(f"Could not build ratio panel: {e}")
+        markdown = ""
+    return markdown or "暂无已提取的财务科目（请先完成财务分析），比率数据不可用。"
@@ -0,0 +1,143 @@
+import contextvars
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from src.agents.financial_analysis.agent import FinancialAnalysisCrew
+from src.core.cache import JsonFileCache
+from src.core.config import get_settings
+from src.core.hashing import file_sha256
+from src.core.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# 每份报告的提取结果按文档内容哈希缓存：追加下一年的年报只需再提取一份
+extraction_cache = JsonFileCache("financial_extraction")
+
+YEAR_PATTERN = re.compile(r"(20\d{2})")
+
+def parse_json_output(text: str) -> dict | None:
+    """
+    从 LLM 输出中解析 JSON 对象（容忍 ```json 包裹和前后的说明文字）。
+    """
+    if not text:
+        return None
+    cleaned = re.sub(r"```(?:json)?", "", text).strip()
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(cleaned[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def detect_fiscal_year(file_path: str, data: dict | None) -> int | None:
+    """报告期年份: 优先取提取结果中的 fiscal_year，其次从文件名中识别。"""
+    if data:
+        match = YEAR_PATTERN.search(str(data.get("fiscal_year") or ""))
+        if match:
+            return int(match.group(1))
+    match = YEAR_PATTERN.search(os.path.basename(file_path))
+    return int(match.group(1)) if match else None
+
+def extract_report(file_path: str, rel_path: str, force: bool = False) -> dict:
+    """
+    对单份报告运行财务分析 Crew，返回结构化的提取结果（命中缓存时不调用 LLM，force=True 时强制重新提取）。
+    """
+    file_hash = file_sha256(file_path)
+    cached = None if force else extraction_cache.get(file_hash)
+    if cached:
+        logger.info(f"Financial extraction cache hit for {file_path}")
+        # 追踪中记为一次命中缓存、未实际运行的 Crew
+        with tracer.span("FinancialAnalysisCrew", "crew", file=os.path.basename(file_path), cache_hit=True):
+            return cached
+
+    crew = FinancialAnalysisCrew(file_path=rel_path)
+    result = crew.run()
+
+    # tasks_output 顺序: locate -> extract -> format
+    tasks_output = getattr(result, "tasks_output", None) or []
+    data = parse_json_output(tasks_output[1].raw) if len(tasks_output) > 1 else None
+    if data is None:
+        # 不缓存: 否则这份报告在强制重跑之前都不会再有科目数据
+        logger.warning(f"Could not parse structured financial data for {file_path}")
+        raise ValueError(f"{os.path.basename(file_path)} 的财务数据提取结果无法解析，请重新运行财务分析")
+
+    entry = {
+        "file": os.path.basename(file_path),
+        "file_hash": file_hash,
+        "fiscal_year": detect_fiscal_year(file_path, data),
+        "data": data,
+        "report": str(result),
+    }
+    extraction_cache.set(file_hash, entry)
+    return entry
+
+def extract_series(files: list[tuple[str, str]], force: bool = False) -> list[dict]:
+    """
+    并行提取多份报告（每份报告一个 worker）。files 为 (绝对路径, knowledge 相对路径) 列表。
+    """
+    max_workers = max(1, min(len(files), settings.FINANCIAL_MAX_WORKERS))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 复制调用方的上下文，使 worker 中的 Crew 仍受当前阶段的取消/超时控制
+        futures = [
+            executor.submit(contextvars.copy_context().run, extract_report, *f, force=force)
+            for f in files
+        ]
+        return [future.result() for future in futures]
+
+def invalidate_extraction(file_path: str) -> bool:
+    return extraction_cache.delete(file_sha256(file_path))
+
+def flatten_items(data: dict) -> dict:
+    """LLM 常按报表分组输出 ({"利润表": {...}, ...})，展开为单层的 {项目: 数值}。"""
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(flatten_items(value))
+        elif key not in ("fiscal_year", "unit"):
+            flat[key] = value
+    return flat
+
+def merge_series(entries: list[dict]) -> dict:
+    """
+    将多年的提取结果对齐为时间序列: {"years": [...], "items": {项目: [按年份排列的值]}}。
+    同一年份有多份报告时，以后提供的为准。
+    """
+    by_year: dict[int, dict] = {}
+    for entry in entries:
+        year = entry.get("fiscal_year")
+        if year is None:
+            continue
+        by_year.setdefault(year, {}).update(flatten_items(entry.get("data", {})))
+
+    years = sorted(by_year)
+    items: dict[str, list] = {}
+    for year in years:
+        for key in by_year[year]:
+            items.setdefault(key, [None] * len(years))
+    for i, year in enumerate(years):
+        for key, value in by_year[year].items():
+            items[key][i] = value
+
+    units = {entry["fiscal_year"]: entry["data"].get("unit") for entry in entries if entry.get("fiscal_year")}
+    return {"years": years, "units": [units.get(y) for y in years], "items": items}
+
+def render_series_markdown(series: dict) -> str:
+    years = series["years"]
+    if not years:
+        return ""
+    lines = [
+        "## 多年财务数据对比",
+        "",
+        "| 项目 | " + " | ".join(str(y) for y in years) + " |",
+        "|---|" + "---|" * len(years),
+    ]
+    for key, values in series["items"].items():
+        cells = ["" if v in (None, "N/A") else str(v) for v in values]
+        lines.append(f"| {key} | " + " | ".join(cells) + " |")
+    return "\n".join(lines)
@@ -0,0 +1,212 @@
+import logging
+import os
+import re
+from sqlmodel import Session, delete, select
+from src.core.hashing import file_sha256
+from src.models.financial import FinancialLineItem
+from src.services.financial_series import flatten_items
+from src.db.engine import engine
+
+logger = logging.getLogger(__name__)
+
+# 标准科目: key -> (所属报表, 别名)。别名与 financial_analysis/tasks.yaml 中要求提取的字段对应。
+LINE_ITEMS: dict[str, tuple[str, list[str]]] = {
+    "revenue": ("income", ["营业总收入", "营业收入", "total revenue", "revenue"]),
+    "operating_cost": ("income", ["营业成本", "operating costs", "cogs"]),
+    "selling_expenses": ("income", ["销售费用", "selling expenses"]),
+    "admin_expenses": ("income", ["管理费用", "administrative expenses"]),
+    "rd_expenses": ("income", ["研发费用", "r&d expenses"]),
+    "financial_expenses": ("income", ["财务费用", "financial expenses"]),
+    "operating_income": ("income", ["营业利润", "operating income"]),
+    "total_profit": ("income", ["利润总额", "total profit"]),
+    "net_income_parent": ("income", ["归属于母公司所有者的净利润", "归属于母公司股东的净利润", "net income to parent"]),
+    "net_income": ("income", ["净利润", "net income"]),
+    "cfo": ("cash_flow", ["经营活动产生的现金流量净额", "cash flow from operations", "cfo"]),
+    "capex": ("cash_flow", ["购建固定资产、无形资产和其他长期资产支付的现金", "capital expenditures", "capex"]),
+    "depreciation_amortization": ("cash_flow", ["折旧与摊销", "折旧摊销", "depreciation & amortization", "depreciation_amortization"]),
+    "cash": ("balance", ["货币资金", "cash & equivalents", "cash"]),
+    "accounts_receivable": ("balance", ["应收账款", "accounts receivable"]),
+    "inventory": ("balance", ["存货", "inventory"]),
+    "total_current_assets": ("balance", ["流动资产合计", "total current assets"]),
+    "fixed_assets": ("balance", ["固定资产", "fixed assets"]),
+    "construction_in_progress": ("balance", ["在建工程", "construction in progress"]),
+    "short_term_debt": ("balance", ["短期借款", "short-term debt"]),
+    "long_term_debt": ("balance", ["长期借款", "long-term debt"]),
+    "bonds_payable": ("balance", ["应付债券", "bonds payable"]),
+    "total_current_liabilities": ("balance", ["流动负债合计", "total current liabilities"]),
+    "total_noncurrent_liabilities": ("balance", ["非流动负债合计", "total non-current liabilities"]),
+    "total_liabilities": ("balance", ["负债合计", "total liabilities"]),
+    "total_equity": ("balance", ["所有者权益合计", "股东权益合计", "total equity"]),
+}
+
+UNIT_MULTIPLIERS = {
+    "元": 1.0,
+    "千元": 1e3,
+    "万元": 1e4,
+    "百万元": 1e6,
+    "亿元": 1e8,
+}
+
+# 数值自带的单位后缀 -> 对应的 UNIT_MULTIPLIERS 单位，长的优先
+VALUE_SUFFIXES = [
+    ("百万元", "百万元"), ("千元", "千元"), ("万元", "万元"), ("亿元", "亿元"), ("元", "元"),
+    ("百万", "百万元"), ("千", "千元"), ("万", "万元"), ("亿", "亿元"),
+]
+
+def _normalize_label(label: str) -> str:
+    # 去掉括号中的英文/注释、空白和标点，统一小写
+    label = re.sub(r"[（(][^)）]*[)）]", "", str(label))
+    return re.sub(r"[\s_:：]", "", label).lower()
+
+# 别名按长度倒序排列（同名别名以先出现的科目为准）
+_ALIASES = sorted(
+    ((_normalize_label(alias), key) for key, (_, aliases) in LINE_ITEMS.items() for alias in aliases + [key]),
+    key=lambda pair: len(pair[0]),
+    reverse=True,
+)
+
+_ALIAS_KEYS = dict(reversed(_ALIASES))
+# 比率、周转天数、扣非等派生指标不是报表科目，即使名称里含有科目名也不归入标准科目
+DERIVED_LABEL = re.compile(r"增长率|增长|同比|[比利]率|天数|周转|扣非|扣除非经常性损益|每股|占比|比例|growth|ratio|margin|days|adjusted")
+# 报表行的序号 / 加减前缀（"一、营业总收入"、"加：营业外收入"、"其中："），以及不带括号的单位后缀
+LABEL_PREFIX = re.compile(r"^(?:[一二三四五六七八九十]+、|\d+[.、]|加|减|其中)")
+LABEL_UNIT_SUFFIX = re.compile(r"(?:百万元|千元|万元|亿元|元|rmb|cny)$")
+
+def normalize_item_key(label: str) -> str | None:
+    """
+    报表项目名称 -> 标准科目 key，只做精确匹配（去掉括号注释、序号前缀和单位后缀之后），
+    不做包含匹配: "营业收入同比增长率"、"应收账款周转天数" 之类不会被当成科目本身。
+    """
+    normalized = _normalize_label(label)
+    if normalized in _ALIAS_KEYS:
+        return _ALIAS_KEYS[normalized]
+    if DERIVED_LABEL.search(normalized):
+        return None
+    stripped = LABEL_UNIT_SUFFIX.sub("", LABEL_PREFIX.sub("", normalized))
+    return _ALIAS_KEYS.get(stripped)
+
+def parse_unit(unit: str | None) -> tuple[str, float]:
+    unit = (unit or "元").strip()
+    for name in sorted(UNIT_MULTIPLIERS, key=len, reverse=True):
+        if name in unit:
+            return name, UNIT_MULTIPLIERS[name]
+    return "元", 1.0
+
+def parse_value(value) -> tuple[float | None, str | None]:
+    """
+    解析数值，返回 (数值, 数值自带的单位)；没有单位后缀时单位为 None（沿用报表单位）。
+    支持 "1,234.5"、"(123)" 表示负数、"12.3亿" 等写法；"N/A" / null 返回 None。
+    """
+    if value is None or isinstance(value, bool):
+        return None, None
+    if isinstance(value, (int, float)):
+        return float(value), None
+    text = str(value).strip().replace(",", "").replace("，", "")
+    unit = None
+    for suffix, name in VALUE_SUFFIXES:
+        if text.endswith(suffix):
+            unit = name
+            text = text[: -len(suffix)].strip()
+            break
+    negative = text.startswith("(") and text.endswith(")")
+    text = text.strip("()（）")
+    try:
+        number = float(text)
+    except ValueError:
+        return None, None
+    return (-number if negative else number), unit
+
+def save_extraction(entry: dict, overwrite: bool = False) -> int:
+    """
+    将一份报告的提取结果（financial_series.extract_report 的返回值）写入科目表。
+    同一文档已有数据时默认跳过。返回写入的行数。
+    """
+    document_hash = entry["file_hash"]
+    data = entry.get("data") or {}
+    unit, unit_multiplier = parse_unit(data.get("unit"))
+
+    with Session(engine) as db:
+        exists = db.exec(
+            select(FinancialLineItem.id).where(FinancialLineItem.document_hash == document_hash)
+        ).first()
+        if exists is not None and not overwrite:
+            return 0
+        db.exec(delete(FinancialLineItem).where(FinancialLineItem.document_hash == document_hash))
+
+        rows = []
+        for label, raw_value in flatten_items(data).items():
+            value, value_unit = parse_value(raw_value)
+            # 数值自带单位（如 "1,234.5万元"）时以它为准，不再叠加报表单位；记录实际采用的单位
+            applied_unit, multiplier = (value_unit, UNIT_MULTIPLIERS[value_unit]) if value_unit else (unit, unit_multiplier)
+            key = normalize_item_key(label)
+            rows.append(FinancialLineItem(
+                document_hash=document_hash,
+                file_name=entry["file"],
+                fiscal_year=entry.get("fiscal_year"),
+                statement=LINE_ITEMS[key][0] if key else "other",
+                item=key or str(label),
+                label=str(label),
+                value=value,
+                unit=applied_unit,
+                value_yuan=None if value is None else value * multiplier,
+            ))
+        db.add_all(rows)
+        db.commit()
+        logger.info(f"Stored {len(rows)} line items for {entry['file']} ({document_hash[:8]})")
+        return len(rows)
+
+def get_line_items(document_hashes: list[str], items: list[str] | None = None) -> list[FinancialLineItem]:
+    with Session(engine) as db:
+        statement = select(FinancialLineItem).where(FinancialLineItem.document_hash.in_(document_hashes))
+        if items:
+            statement = statement.where(FinancialLineItem.item.in_(items))
+        return list(db.exec(statement.order_by(FinancialLineItem.fiscal_year)).all())
+
+def get_panel(file_paths: list[str], items: list[str] | None = None) -> dict[int, dict[str, float]]:
+    """
+    读取一组报告文件的标准化科目: {年份: {科目: 数值(元)}}。只走数据库索引，不调用 LLM。
+    """
+    hashes = [file_sha256(p) for p in file_paths if os.path.exists(p)]
+    panel: dict[int, dict[str, float]] = {}
+    for row in get_line_items(hashes, items):
+        if row.fiscal_year is None or row.value_yuan is None:
+            continue
+        panel.setdefault(row.fiscal_year, {})[row.item] = row.value_yuan
+    return dict(sorted(panel.items()))
+
+DEFAULT_DCF_ASSUMPTIONS = {
+    "growth_rate": 0.05,
+    "discount_rate": 0.10,
+    "terminal_growth_rate": 0.02,
+    "years": 10,
+}
+
+def build_dcf_inputs(file_paths: list[str]) -> dict | None:
+    """
+    由已提取的科目组装 DCFCalculatorTool 的输入；缺少净利润时返回 None。
+    增长率取历年净利润复合增长率（限制在 0%~12%），只有一年数据时使用默认值。
+    """
+    panel = get_panel(file_paths, ["net_income", "net_income_parent", "depreciation_amortization", "capex"])
+    years = [y for y, items in panel.items() if "net_income" in items or "net_income_parent" in items]
+    if not years:
+        return None
+
+    latest = panel[years[-1]]
+    net_income = latest.get("net_income_parent", latest.get("net_income"))
+    inputs = {
+        "net_income": net_income,
+        "depreciation_amortization": latest.get("depreciation_amortization", 0.0),
+        "capex": abs(latest.get("capex", 0.0)),
+        **DEFAULT_DCF_ASSUMPTIONS,
+    }
+
+    if len(years) > 1:
+        first = panel[years[0]]
+        first_income = first.get("net_income_parent", first.get("net_income"))
+        span = years[-1] - years[0]
+        if first_income and first_income > 0 and net_income > 0 and span > 0:
+            cagr = (net_income / first_income) ** (1 / span) - 1
+            inputs["growth_rate"] = round(min(max(cagr, 0.0), 0.12), 4)
+
+    inputs["fiscal_year"] = years[-1]
+    return inputs
@@ -0,0 +1,139 @@
+import logging
+import os
+from datetime import datetime
+from sqlmodel import Session, select
+from src.core.config import get_settings
+from src.core.hashing import file_sha256
+from src.core.llm_factory import llm_factory
+from src.core.memory import memory_profiler
+from src.core.tracing import tracer
+from src.knowledge.chunker import PageAwareChunker
+from src.knowledge.page_store import drop_pages, iter_pages
+from src.knowledge.storage import MmapKnowledgeStorage, drop_index, get_index
+from src.models.ingestion import FileIngestion
+from src.db.engine import engine
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+def _get_record(db: Session, session_id: str, file_path: str) -> FileIngestion | None:
+    statement = select(FileIngestion).where(
+        FileIngestion.session_id == session_id, FileIngestion.file_path == file_path
+    )
+    return db.exec(statement).first()
+
+def register_file(session_id: str, file_path: str) -> FileIngestion:
+    """
+    登记（或在文件被覆盖时重置）一个文件的入库状态。
+    """
+    file_hash = file_sha256(file_path)
+    with Session(engine) as db:
+        record = _get_record(db, session_id, file_path)
+        if record is None:
+            record = FileIngestion(session_id=session_id, file_path=file_path, file_hash=file_hash)
+        elif record.file_hash != file_hash:
+            # 同名文件被新内容覆盖：先清理旧向量
+            _remove_vectors(session_id, file_path)
+            record.file_hash = file_hash
+            record.status = "PENDING"
+            record.chunk_count = 0
+            record.indexed_at = None
+        db.add(record)
+        db.commit()
+        db.refresh(record)
+        return record
+
+def list_files(session_id: str) -> list[FileIngestion]:
+    with Session(engine) as db:
+        statement = select(FileIngestion).where(FileIngestion.session_id == session_id)
+        return list(db.exec(statement).all())
+
+def _set_status(session_id: str, file_path: str, **fields):
+    with Session(engine) as db:
+        record = _get_record(db, session_id, file_path)
+        if record is None:
+            return
+        for key, value in fields.items():
+            setattr(record, key, value)
+        db.add(record)
+        db.commit()
+
+def ingest_file(session_id: str, file_path: str):
+    """
+    只解析并 embedding 单个文件（后台任务）。
+
+    页面文本写入页面缓存；使用 mmap 向量后端时，chunk 直接写入会话索引，
+    之后的 Crew 运行会跳过已入库的 chunk，直接开始分析。
+    """
+    try:
+        register_file(session_id, file_path)
+        _set_status(session_id, file_path, status="RUNNING", error=None)
+
+        # 解析 -> 表格识别 -> 页面缓存 -> 切分 逐页流水线处理，解析过的页面对象即时释放
+        source = os.path.basename(file_path)
+        with memory_profiler.profile(session_id, "ingest.parse"), \
+                tracer.span("ingest.parse", "ingest", trace_id=session_id, file=source) as span:
+            chunks = list(PageAwareChunker().iter_chunks(iter_pages(file_path), source=source))
+            if span is not None:
+                span.set(chunks=len(chunks))
+
+        if settings.VECTOR_BACKEND == "mmap":
+            with memory_profiler.profile(session_id, "ingest.embed"), \
+                    tracer.span("ingest.embed", "ingest", trace_id=session_id, file=source):
+                storage = MmapKnowledgeStorage(embedder=llm_factory.get_embedder_config(), scope=session_id)
+                storage.save_chunks([c.content for c in chunks], [c.metadata for c in chunks])
+
+        _set_status(
+            session_id, file_path,
+            status="INDEXED", chunk_count=len(chunks), indexed_at=datetime.utcnow(),
+        )
+        logger.info(f"Ingested {file_path} for session {session_id}: {len(chunks)} chunks")
+    except Exception as e:
+        logger.error(f"Error ingesting {file_path}: {e}")
+        _set_status(session_id, file_path, status="FAILED", error=str(e))
+
+def _remove_vectors(session_id: str, file_path: str):
+    if settings.VECTOR_BACKEND == "mmap":
+        removed = get_index(session_id).remove({"source": os.path.basename(file_path)})
+        logger.info(f"Removed {removed} vectors of {file_path} from session {session_id}")
+
+def remove_file(session_id: str, file_path: str):
+    """
+    从会话中移除一个文件: 只删除该文件的向量，以及（无其他会话引用时）它的页面缓存。
+    """
+    _remove_vectors(session_id, file_path)
+    with Session(engine) as db:
+        record = _get_record(db, session_id, file_path)
+        if record is None:
+            return
+        file_hash = record.file_hash
+        db.delete(record)
+        db.commit()
+
+        still_referenced = db.exec(
+            select(FileIngestion).where(FileIngestion.file_hash == file_hash)
+        ).first()
+        if still_referenced is None:
+            drop_pages(file_hash)
+
+def remove_session_files(session_id: str):
+    """
+    删除会话时清理入库数据: 会话索引（释放对共享 chunk 的引用）、入库记录，以及无其他会话引用的页面缓存。
+    """
+    if settings.VECTOR_BACKEND == "mmap":
+        drop_index(session_id)
+    with Session(engine) as db:
+        records = list(db.exec(select(FileIngestion).where(FileIngestion.session_id == session_id)).all())
+        file_hashes = {record.file_hash for record in records}
+        for record in records:
+            db.delete(record)
+        db.commit()
+
+        for file_hash in file_hashes:
+            still_referenced = db.exec(
+                select(FileIngestion).where(FileIngestion.file_hash == file_hash)
+            ).first()
+            if still_referenced is None:
+                drop_pages(file_hash)
+    logger.info(f"Removed ingestion data of session {session_id}: {len(records)} files")
@@ -0,0 +1,236 @@
+import logging
+import threading
+import warnings
+from dataclasses import dataclass
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from src.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# 同业数据文件: parquet / feather（需要 pyarrow）或 csv，每行一家公司（多个年份时取最新一年）
+PEER_FILE_SUFFIXES = (".parquet", ".feather", ".csv")
+ID_COLUMNS = ("code", "name", "industry")
+# 参与相似度计算的指标，键与 financial_ratios.RATIOS 一致，便于直接用会话的比率面板作为查询
+PEER_METRICS = (
+    "revenue", "net_income", "market_cap", "gross_margin", "operating_margin", "net_margin",
+    "roe", "roic", "revenue_growth", "net_income_growth", "debt_to_equity", "fcf_conversion",
+)
+# 规模类指标跨度很大，先取对数再标准化
+SIZE_METRICS = ("revenue", "net_income", "market_cap", "total_assets")
+# 标准化后的取值截断，避免个别极端值主导距离
+Z_CLIP = 5.0
+
+
+def _signed_log(values: np.ndarray) -> np.ndarray:
+    return np.sign(values) * np.log10(1 + np.abs(values))
+
+
+@dataclass
+class PeerMatch:
+    code: str
+    name: str
+    industry: str
+    industry_name: str
+    distance: float
+    # 参与比较的指标个数（缺失值不计入距离）
+    overlap: int
+    metrics: dict[str, float]
+
+
+class PeerStore:
+    """
+    本地同业公司库: 列式存放公司代码、行业代码和关键指标，检索时全部是 NumPy 向量运算。
+
+    指标按列做稳健标准化（中位数 / 四分位距，规模类先取对数），缺失值记为掩码；
+    k 近邻距离只在查询和候选都有值的维度上计算，再按维度数归一，行业代码按前缀过滤。
+    """
+
+    def __init__(self, frame: pd.DataFrame):
+        frame = frame.reset_index(drop=True)
+        # 定长字符串数组，np.char 的比较 / 前缀匹配是向量化的
+        self.codes = frame["code"].astype(str).to_numpy(dtype=str)
+        self.names = frame["name"].astype(str).to_numpy(dtype=str)
+        self.industries = frame["industry"].fillna("").astype(str).to_numpy(dtype=str)
+        self.industry_names = frame["industry_name"].fillna("").astype(str).to_numpy(dtype=str) if "industry_name" in frame else None
+        self._bare_codes = np.char.lstrip(self.codes, "0")
+        self.metrics = [m for m in PEER_METRICS if m in frame]
+        self.raw = frame[self.metrics].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+
+        transformed = self._transform(self.raw)
+        self.present = np.isfinite(transformed)
+        with warnings.catch_warnings():
+            # 整列缺失时得到 NaN，下面按 0 / 1 处理
+            warnings.simplefilter("ignore", RuntimeWarning)
+            center = np.nanmedian(transformed, axis=0) if len(frame) else np.zeros(len(self.metrics))
+            spread = (
+                np.nanpercentile(transformed, 75, axis=0) - np.nanpercentile(transformed, 25, axis=0)
+                if len(frame) else np.ones(len(self.metrics))
+            )
+        self.center = np.nan_to_num(center, nan=0.0)
+        spread = np.nan_to_num(spread, nan=1.0)
+        self.scale = np.where(spread > 0, spread, 1.0)
+        self.matrix = self._normalize(transformed)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def _transform(self, values: np.ndarray) -> np.ndarray:
+        values = np.array(values, dtype=np.float64)
+        for i, metric in enumerate(self.metrics):
+            if metric in SIZE_METRICS:
+                values[..., i] = _signed_log(values[..., i])
+        return values
+
+    def _normalize(self, transformed: np.ndarray) -> np.ndarray:
+        z = np.clip((transformed - self.center) / self.scale, -Z_CLIP, Z_CLIP)
+        # 缺失值置 0，由掩码排除在距离之外
+        return np.where(np.isfinite(z), z, 0.0).astype(np.float32)
+
+    @classmethod
+    def load(cls, directory: str | Path) -> "PeerStore":
+        frames = []
+        for path in sorted(Path(directory).iterdir()):
+            if path.suffix.lower() not in PEER_FILE_SUFFIXES:
+                continue
+            try:
+                if path.suffix.lower() == ".csv":
+                    frame = pd.read_csv(path, dtype={"code": str, "industry": str})
+                elif path.suffix.lower() == ".parquet":
+                    frame = pd.read_parquet(path)
+                else:
+                    frame = pd.read_feather(path)
+            except ImportError as e:
+                logger.warning(f"Skipping peer file {path.name}: {e}")
+                continue
+            missing = [c for c in ID_COLUMNS if c not in frame]
+            if missing:
+                logger.warning(f"Skipping peer file {path.name}: missing columns {missing}")
+                continue
+            frames.append(frame)
+        if not frames:
+            return cls(pd.DataFrame(columns=list(ID_COLUMNS)))
+
+        frame = pd.concat(frames, ignore_index=True)
+        frame["code"] = frame["code"].astype(str).str.strip()
+        if "fiscal_year" in frame:
+            frame = frame.sort_values("fiscal_year", kind="stable")
+        # 同一家公司出现多次（多个年份 / 多个文件）时保留最后一条
+        frame = frame.drop_duplicates("code", keep="last")
+        return cls(frame)
+
+    def find(self, company: str) -> int | None:
+        """按证券代码或公司名称（精确或包含匹配）定位公司，返回行号。"""
+        company = str(company).strip()
+        if not company:
+            return None
+        # 港股 / A 股代码有无前导零的写法都能匹配
+        for candidates in (self.codes == company, self._bare_codes == company.lstrip("0"), self.names == company):
+            hits = np.flatnonzero(candidates)
+            if hits.size:
+                return int(hits[0])
+        hits = np.flatnonzero(np.char.find(self.names, company) >= 0)
+        return int(hits[0]) if hits.size else None
+
+    def industry_mask(self, industry: str | list[str] | None) -> np.ndarray:
+        """行业代码前缀过滤（如申万 / 证监会行业代码 "C15" 匹配 "C151"），多个前缀取并集。"""
+        if not industry:
+            return np.ones(len(self), dtype=bool)
+        prefixes = [industry] if isinstance(industry, str) else list(industry)
+        mask = np.zeros(len(self), dtype=bool)
+        for prefix in prefixes:
+            mask |= np.char.startswith(self.industries, str(prefix).strip())
+        return mask
+
+    def search(
+        self,
+        metrics: dict[str, float] | None = None,
+        k: int = 10,
+        industry: str | list[str] | None = None,
+        company: str | None = None,
+        min_overlap: int = 3,
+    ) -> list[PeerMatch]:
+        """
+        k 近邻同业检索。查询向量来自 company（库中的公司）或 metrics（如会话比率面板的最新一年），
+        两者都给出时以 metrics 覆盖 company 的对应指标。company 所在行业在未指定 industry 时作为默认过滤条件。
+        """
+        if not len(self) or not self.metrics:
+            return []
+        query = np.full(len(self.metrics), np.nan)
+        anchor = self.find(company) if company else None
+        if anchor is not None:
+            query = self.raw[anchor].copy()
+            if industry is None and self.industries[anchor]:
+                industry = self.industries[anchor]
+        for i, metric in enumerate(self.metrics):
+            value = (metrics or {}).get(metric)
+            if value is not None and np.isfinite(value):
+                query[i] = value
+
+        query_present = np.isfinite(self._transform(query[None, :])[0])
+        if not query_present.any():
+            return []
+        q = self._normalize(self._transform(query[None, :]))[0]
+
+        # (公司, 指标) 矩阵一次算完: 只在双方都有值的维度上求均方距离
+        both = self.present & query_present
+        overlap = both.sum(axis=1)
+        squared = np.where(both, (self.matrix - q) ** 2, 0.0).sum(axis=1)
+        distance = np.sqrt(squared / np.maximum(overlap, 1))
+
+        candidates = self.industry_mask(industry) & (overlap >= min(min_overlap, int(query_present.sum())))
+        if anchor is not None:
+            candidates[anchor] = False
+        distance = np.where(candidates, distance, np.inf)
+        k = min(k, int(candidates.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(distance, k - 1)[:k]
+        top = top[np.argsort(distance[top])]
+        return [
+            PeerMatch(
+                code=str(self.codes[i]),
+                name=str(self.names[i]),
+                industry=str(self.industries[i]),
+                industry_name=str(self.industry_names[i]) if self.industry_names is not None else "",
+                distance=float(distance[i]),
+                overlap=int(overlap[i]),
+                metrics={m: float(v) for m, v in zip(self.metrics, self.raw[i]) if np.isfinite(v)},
+            )
+            for i in top
+        ]
+
+
+_store: PeerStore | None = None
+_store_signature: tuple | None = None
+_store_lock = threading.Lock()
+
+
+def _signature(directory: Path) -> tuple:
+    return tuple(
+        (p.name, p.stat().st_mtime_ns, p.stat().st_size)
+        for p in sorted(directory.iterdir()) if p.suffix.lower() in PEER_FILE_SUFFIXES
+    )
+
+
+def get_peer_store() -> PeerStore | None:
+    """
+    PEER_DATA_DIR 中的同业库；未配置或目录中没有数据时返回 None。文件变化后自动重新加载。
+    """
+    if not settings.PEER_DATA_DIR:
+        return None
+    directory = Path(settings.PEER_DATA_DIR)
+    if not directory.is_dir():
+        logger.warning(f"PEER_DATA_DIR does not exist: {directory}")
+        return None
+    global _store, _store_signature
+    signature = _signature(directory)
+    with _store_lock:
+        if _store is None or signature != _store_signature:
+            _store = PeerStore.load(directory)
+            _store_signature = signature
+            logger.info(f"Loaded peer store: {len(_store)} companies, metrics={_store.metrics}")
+        return _store if len(_store) else None
@@ -1,19 +1,22 @@
-from sqlmodel import Session, create_engine, select, SQLModel
+import asyncio
+from sqlalchemy import delete, inspect as sa_inspect, update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import Session, select, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from src.core.config import get_settings
+from src.db.engine import engine, get_async_engine
 from src.models.session import AnalysisSession
+from src.models.stage_run import StageRun
 import json
 
 settings = get_settings()
-engine = create_engine(settings.DATABASE_URL, echo=True)
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
 
 def get_session(session_id: str) -> AnalysisSession | None:
     with Session(engine) as session:
-        statement = select(AnalysisSession).where(AnalysisSession.id == session_id)
-        results = session.exec(statement)
-        return results.first()
+        return session.get(AnalysisSession, session_id)
 
 def create_session(file_path: str, file_name: str) -> AnalysisSession:
     with Session(engine) as session:
@@ -27,10 +30,47 @@ def create_session(file_path: str, file_name: str) -> AnalysisSession:
         session.refresh(analysis_session)
         return analysis_session
 
+def update_session_fields(session_id: str, **fields) -> bool:
+    """
+    只更新指定的列 (单条 UPDATE，不先读取整行)。返回是否找到了该会话。
+    """
+    if not fields:
+        return True
+    with Session(engine) as session:
+        result = session.exec(
+            update(AnalysisSession).where(AnalysisSession.id == session_id).values(**fields)
+        )
+        session.commit()
+        return result.rowcount > 0
+
+def _changed_fields(analysis_session: AnalysisSession) -> dict | None:
+    """从数据库读出后被修改过的列；新建（未入库）的对象返回 None。"""
+    state = sa_inspect(analysis_session)
+    if state.transient or state.pending:
+        return None
+    return {attr.key: attr.value for attr in state.attrs if attr.history.has_changes()}
+
 def update_session(analysis_session: AnalysisSession):
+    """
+    保存对会话对象的修改: 读取过的对象只写回改动过的列；新对象（如导入的会话）整行合并写入。
+    """
+    changed = _changed_fields(analysis_session)
+    if changed is None:
+        with Session(engine) as session:
+            session.merge(analysis_session)
+            session.commit()
+        return
+    if changed and update_session_fields(analysis_session.id, **changed):
+        for key, value in changed.items():
+            set_committed_value(analysis_session, key, value)
+
+def delete_session(session_id: str) -> bool:
+    """删除会话及其阶段运行记录。返回是否找到了该会话。"""
     with Session(engine) as session:
-        session.merge(analysis_session)
+        session.exec(delete(StageRun).where(StageRun.session_id == session_id))
+        result = session.exec(delete(AnalysisSession).where(AnalysisSession.id == session_id))
         session.commit()
+        return result.rowcount > 0
 
 def list_sessions(limit: int = 20) -> list[AnalysisSession]:
     with Session(engine) as session:
@@ -38,5 +78,59 @@ def list_sessions(limit: int = 20) -> list[AnalysisSession]:
         results = session.exec(statement)
         return list(results.all())
 
+# ---- 异步接口 (供 FastAPI 路由使用，不阻塞事件循环) ----
+
+def _async_session() -> AsyncSession | None:
+    async_engine = get_async_engine()
+    if async_engine is None:
+        return None
+    return AsyncSession(async_engine, expire_on_commit=False)
 
+async def aget_session(session_id: str) -> AnalysisSession | None:
+    db = _async_session()
+    if db is None:
+        return await asyncio.to_thread(get_session, session_id)
+    async with db:
+        return await db.get(AnalysisSession, session_id)
+
+async def alist_sessions(limit: int = 20) -> list[AnalysisSession]:
+    db = _async_session()
+    if db is None:
+        return await asyncio.to_thread(list_sessions, limit)
+    async with db:
+        statement = select(AnalysisSession).order_by(AnalysisSession.created_at.desc()).limit(limit)
+        results = await db.exec(statement)
+        return list(results.all())
+
+async def acreate_session(file_path: str, file_name: str) -> AnalysisSession:
+    db = _async_session()
+    if db is None:
+        return await asyncio.to_thread(create_session, file_path, file_name)
+    async with db:
+        analysis_session = AnalysisSession(file_name=file_name, file_paths_json=json.dumps([file_path]))
+        db.add(analysis_session)
+        await db.commit()
+        await db.refresh(analysis_session)
+        return analysis_session
+
+async def aupdate_session_fields(session_id: str, **fields) -> bool:
+    if not fields:
+        return True
+    db = _async_session()
+    if db is None:
+        return await asyncio.to_thread(update_session_fields, session_id, **fields)
+    async with db:
+        result = await db.exec(
+            update(AnalysisSession).where(AnalysisSession.id == session_id).values(**fields)
+        )
+        await db.commit()
+        return result.rowcount > 0
 
+async def aupdate_session(analysis_session: AnalysisSession):
+    changed = _changed_fields(analysis_session)
+    if changed is None:
+        await asyncio.to_thread(update_session, analysis_session)
+        return
+    if changed and await aupdate_session_fields(analysis_session.id, **changed):
+        for key, value in changed.items():
+            set_committed_value(analysis_session, key, value)
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from src.agents.base_agent import crew_registry
+from src.core.cache import JsonFileCache
+from src.core.config import get_settings
+from src.core.hashing import file_sha256
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+AGENTS_ROOT = Path(__file__).resolve().parent.parent / "agents"
+
+# 分析阶段 -> Agent 配置目录
+STAGE_AGENT_DIRS = {
+    "business": AGENTS_ROOT / "business_analysis",
+    "mda": AGENTS_ROOT / "mda_analysis",
+    "financial": AGENTS_ROOT / "financial_analysis",
+    "competitor": AGENTS_ROOT / "competitor_analysis",
+    "valuation": AGENTS_ROOT / "valuation",
+}
+
+# 分析阶段 -> (会话结果字段, 会话状态字段)
+STAGE_FIELDS = {
+    "business": ("business_analysis_result", "business_status"),
+    "mda": ("mda_analysis_result", "mda_status"),
+    "financial": ("financial_analysis_result", "financial_status"),
+    "competitor": ("competitor_analysis_result", "competitor_status"),
+    "valuation": ("valuation_result", "valuation_status"),
+}
+
+stage_cache = JsonFileCache("stages")
+
+def stage_cache_key(stage: str, file_paths: list[str], inputs: dict | None = None) -> str:
+    """
+    阶段结果的缓存 key: 输入文件哈希 + 该阶段 agents.yaml / tasks.yaml 的哈希 + 模型名 + 阶段输入。
+    任一项变化（换了报告、改了提示词、换了模型、护城河评级不同）都会得到新的 key。
+    """
+    payload = {
+        "stage": stage,
+        "files": sorted(file_sha256(p) for p in file_paths if os.path.exists(p)),
+        "config": crew_registry.get(STAGE_AGENT_DIRS[stage]).config_hash,
+        "model": settings.LLM_MODEL,
+        "inputs": inputs or {},
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def get_stage_result(stage: str, file_paths: list[str], inputs: dict | None = None) -> dict | None:
+    entry = stage_cache.get(stage_cache_key(stage, file_paths, inputs))
+    if entry:
+        logger.info(f"Stage cache hit: {stage}")
+    return entry
+
+def store_stage_result(stage: str, file_paths: list[str], result: str,
+                       inputs: dict | None = None, extra: dict | None = None):
+    """
+    保存阶段结果。extra 用于同时缓存需要恢复到会话上的其他字段（如 extracted_financial_data）。
+    """
+    stage_cache.set(stage_cache_key(stage, file_paths, inputs), {
+        "stage": stage,
+        "result": result,
+        "extra": extra or {},
+        "created_at": datetime.utcnow().isoformat(),
+    })
+
+def invalidate_stage_result(stage: str, file_paths: list[str], inputs: dict | None = None) -> bool:
+    return stage_cache.delete(stage_cache_key(stage, file_paths, inputs))
@@ -0,0 +1,347 @@
+import contextvars
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import httpx
+from openai import OpenAIError
+from sqlalchemy import update
+from sqlmodel import Session, select
+from src.core.config import get_settings
+from src.core.memory import memory_profiler
+from src.core.tracing import tracer
+from src.models.session import AnalysisSession
+from src.models.stage_run import StageRun
+from src.db.engine import engine
+from src.services.stage_cache import STAGE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+HOST = socket.gethostname()
+
+class StageCancelled(Exception):
+    """
+    阶段被取消、超时或超出 token 预算。由 Crew 的 step_callback 在下一步抛出，中断运行。
+    不是错误: 路由把阶段状态记为 CANCELLED / TIMEOUT / BUDGET_EXCEEDED，而不是 FAILED。
+    """
+
+    def __init__(self, status: str, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+class StageDeadlineExceeded(OpenAIError):
+    """
+    阶段已取消或到达截止时间后，共享连接池拒绝发出的 HTTP 请求。
+    继承 OpenAIError: openai SDK 对它既不重试也不包装，直接抛给调用方。
+    """
+
+class StageGuard:
+    """
+    一次阶段运行的控制状态: 墙钟时间上限、token 预算和取消标记。
+    """
+
+    def __init__(self, session_id: str, stage: str):
+        self.session_id = session_id
+        self.stage = stage
+        self.timeout = settings.STAGE_TIMEOUTS.get(stage, settings.STAGE_TIMEOUT_SECONDS)
+        self.token_budget = settings.STAGE_TOKEN_BUDGETS.get(stage, settings.STAGE_TOKEN_BUDGET)
+        self.deadline = time.monotonic() + self.timeout if self.timeout > 0 else None
+        self.tokens_used = 0
+        self.run_id: str | None = None
+        self.status: str | None = None
+        self.reason: str | None = None
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self, status: str, reason: str):
+        with self._lock:
+            if self.status is None:
+                self.status, self.reason = status, reason
+
+    def add_tokens(self, tokens: int):
+        with self._lock:
+            self.tokens_used += tokens
+            over_budget = self.token_budget > 0 and self.tokens_used > self.token_budget
+        if over_budget:
+            self.cancel("BUDGET_EXCEEDED", f"超出 token 预算 ({self.tokens_used}/{self.token_budget})")
+
+    def check(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel("TIMEOUT", f"超出运行时间上限 ({self.timeout}s)")
+        if self.status is not None:
+            raise StageCancelled(self.status, self.reason)
+
+_current_guard: contextvars.ContextVar[StageGuard | None] = contextvars.ContextVar("stage_guard", default=None)
+_active_guards: dict[tuple[str, str], StageGuard] = {}
+# crewai Task id -> guard，用于把 LLM 用量事件归属到对应阶段
+_task_guards: dict[str, StageGuard] = {}
+
+def current_guard() -> StageGuard | None:
+    return _current_guard.get()
+
+def _request_deadline(request: httpx.Request):
+    """
+    限制当前阶段内发出的 HTTP 请求: 已取消 / 已超时的阶段不再发请求，其余请求的
+    connect / read / write / pool 超时不超过阶段剩余时间。
+
+    step_callback 和心跳只能在两步之间生效；卡住的 LLM 请求要靠这里的超时中断。
+    注意 read 超时针对单次读取，持续有数据返回的流式响应仍可能略微超出截止时间。
+    """
+    guard = current_guard()
+    if guard is None:
+        return
+    if guard.deadline is not None and time.monotonic() >= guard.deadline:
+        guard.cancel("TIMEOUT", f"超出运行时间上限 ({guard.timeout}s)")
+    if guard.status is not None:
+        raise StageDeadlineExceeded(guard.reason)
+    if guard.deadline is None:
+        return
+    remaining = guard.deadline - time.monotonic()
+    timeout = request.extensions.get("timeout") or dict.fromkeys(("connect", "read", "write", "pool"))
+    request.extensions["timeout"] = {
+        key: remaining if value is None else min(value, remaining) for key, value in timeout.items()
+    }
+
+def stage_deadline_hook(request: httpx.Request):
+    """httpx.Client 的 request 事件钩子（见 llm_factory）。"""
+    _request_deadline(request)
+
+async def astage_deadline_hook(request: httpx.Request):
+    """httpx.AsyncClient 的 request 事件钩子。"""
+    _request_deadline(request)
+
+def _heartbeat_loop(guard: StageGuard):
+    while not guard.finished.wait(settings.STAGE_HEARTBEAT_INTERVAL):
+        try:
+            with Session(engine) as db:
+                db.exec(
+                    update(StageRun)
+                    .where(StageRun.id == guard.run_id)
+                    .values(heartbeat_at=datetime.utcnow(), tokens_used=guard.tokens_used)
+                )
+                db.commit()
+                cancel_requested = db.exec(
+                    select(StageRun.cancel_requested).where(StageRun.id == guard.run_id)
+                ).first()
+            if cancel_requested is None:
+                return
+            if cancel_requested:
+                guard.cancel("CANCELLED", "已取消")
+        except Exception as e:
+            logger.warning(f"Stage heartbeat failed for {guard.session_id}/{guard.stage}: {e}")
+        if guard.deadline is not None and time.monotonic() > guard.deadline:
+            guard.cancel("TIMEOUT", f"超出运行时间上限 ({guard.timeout}s)")
+
+@contextmanager
+def stage_run(session_id: str, stage: str):
+    """
+    包裹一次阶段运行: 记录 StageRun、定期写心跳，并让本线程（及复制了上下文的线程）中的 Crew 受 guard 约束。
+    """
+    guard = StageGuard(session_id, stage)
+    with Session(engine) as db:
+        run = StageRun(session_id=session_id, stage=stage, host=HOST, pid=os.getpid())
+        db.add(run)
+        db.commit()
+        guard.run_id = run.id
+
+    _active_guards[(session_id, stage)] = guard
+    token = _current_guard.set(guard)
+    threading.Thread(target=_heartbeat_loop, args=(guard,), daemon=True).start()
+
+    status, error = "COMPLETED", None
+    try:
+        # MEMORY_PROFILING 开启时按阶段记录 RSS / tracemalloc；TRACING 开启时阶段是会话追踪的根 span
+        with memory_profiler.profile(session_id, stage), tracer.span(stage, "stage", trace_id=session_id, run_id=guard.run_id):
+            yield guard
+    except StageCancelled as e:
+        status, error = e.status, e.reason
+        raise
+    except Exception as e:
+        status, error = "FAILED", str(e)
+        raise
+    finally:
+        guard.finished.set()
+        _current_guard.reset(token)
+        if _active_guards.get((session_id, stage)) is guard:
+            del _active_guards[(session_id, stage)]
+        with Session(engine) as db:
+            db.exec(
+                update(StageRun)
+                .where(StageRun.id == guard.run_id)
+                .values(status=status, error=error, tokens_used=guard.tokens_used, finished_at=datetime.utcnow())
+            )
+            db.commit()
+
+def _reset_session_stage(session_id: str, stage: str, message: str, status: str = "FAILED") -> bool:
+    result_field, status_field = STAGE_FIELDS[stage]
+    # 条件更新: 只有仍处于 RUNNING 时才重置，避免覆盖刚刚完成的结果
+    with Session(engine) as db:
+        result = db.exec(
+            update(AnalysisSession)
+            .where(AnalysisSession.id == session_id, getattr(AnalysisSession, status_field) == "RUNNING")
+            .values({status_field: status, result_field: f"Error: {message}" if status == "FAILED" else message})
+        )
+        db.commit()
+        return result.rowcount > 0
+
+def request_cancel(session_id: str, stage: str) -> bool:
+    """
+    请求取消阶段。运行中的 Crew 在下一步停止（其他 worker 进程通过心跳读取取消标记）；
+    没有存活的运行记录时直接把会话上残留的 RUNNING 状态重置。返回是否找到了运行中的阶段。
+    """
+    guard = _active_guards.get((session_id, stage))
+    if guard is not None:
+        guard.cancel("CANCELLED", "已取消")
+
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.STAGE_STALE_AFTER)
+    with Session(engine) as db:
+        runs = db.exec(
+            select(StageRun).where(
+                StageRun.session_id == session_id,
+                StageRun.stage == stage,
+                StageRun.status == "RUNNING",
+            )
+        ).all()
+        live = False
+        for run in runs:
+            run.cancel_requested = True
+            live = live or run.heartbeat_at >= cutoff
+            db.add(run)
+        db.commit()
+
+    if guard is None and not live:
+        return _reset_session_stage(session_id, stage, "已取消", status="CANCELLED")
+    return True
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def sweep_stale_stages(startup: bool = False) -> int:
+    """
+    把已中断的运行标记为 ABANDONED，并重置会话上没有存活运行的 RUNNING 阶段。
+    判断依据: 心跳超时；启动时另外检查同一主机上的进程是否还在。返回重置的阶段数。
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=settings.STAGE_STALE_AFTER)
+    live: set[tuple[str, str]] = set()
+    with Session(engine) as db:
+        for run in db.exec(select(StageRun).where(StageRun.status == "RUNNING")).all():
+            orphaned = run.heartbeat_at < cutoff
+            if startup and run.host == HOST and run.pid != os.getpid():
+                orphaned = orphaned or not _process_alive(run.pid)
+            if not orphaned:
+                live.add((run.session_id, run.stage))
+                continue
+            run.status = "ABANDONED"
+            run.error = "心跳超时，运行已中断"
+            run.finished_at = now
+            db.add(run)
+        db.commit()
+
+        running = db.exec(
+            select(AnalysisSession).where(
+                (AnalysisSession.business_status == "RUNNING")
+                | (AnalysisSession.mda_status == "RUNNING")
+                | (AnalysisSession.financial_status == "RUNNING")
+                | (AnalysisSession.competitor_status == "RUNNING")
+                | (AnalysisSession.valuation_status == "RUNNING")
+            )
+        ).all()
+        candidates = [
+            (session.id, stage)
+            for session in running
+            for stage, (_, status_field) in STAGE_FIELDS.items()
+            if getattr(session, status_field) == "RUNNING"
+        ]
+
+    reset = 0
+    for session_id, stage in candidates:
+        if (session_id, stage) in live or (session_id, stage) in _active_guards:
+            continue
+        if _reset_session_stage(session_id, stage, "分析中断（进程退出或心跳超时），请重新运行"):
+            logger.warning(f"Reset orphaned RUNNING stage {session_id}/{stage}")
+            reset += 1
+    return reset
+
+def start_stage_sweeper():
+    def loop():
+        while True:
+            time.sleep(settings.STAGE_SWEEP_INTERVAL)
+            try:
+                sweep_stale_stages()
+            except Exception as e:
+                logger.error(f"Stage sweep failed: {e}")
+
+    threading.Thread(target=loop, name="stage-sweeper", daemon=True).start()
+
+def _on_llm_call_completed(source, event):
+    guard = _task_guards.get(getattr(event, "task_id", None) or "")
+    if guard is None or not event.usage:
+        return
+    from crewai.types.usage_metrics import UsageMetrics
+    metrics = UsageMetrics.from_provider_dict(event.usage)
+    if metrics:
+        guard.add_tokens(metrics.total_tokens)
+
+def install_crew_hooks():
+    """
+    让 Crew.kickoff 受当前阶段 guard 约束: 每一步之后检查取消/超时/预算，并按 Task 统计 token 用量。
+    进行中的 LLM 请求由共享连接池的 stage_deadline_hook 按截止时间中断；
+    因此中断而抛出的任何异常都转换为 StageCancelled。
+    """
+    from crewai import Crew
+    from crewai.events.event_bus import crewai_event_bus
+    from crewai.events.types.llm_events import LLMCallCompletedEvent
+
+    if getattr(Crew, "_stage_hooks_installed", False):
+        return
+    original_kickoff = Crew.kickoff
+
+    def guarded_kickoff(self, *args, **kwargs):
+        guard = current_guard()
+        if guard is None:
+            return original_kickoff(self, *args, **kwargs)
+        guard.check()
+
+        previous_callback = self.step_callback
+
+        def step_callback(step):
+            if previous_callback:
+                previous_callback(step)
+            guard.check()
+
+        self.step_callback = step_callback
+        task_ids = [str(task.id) for task in self.tasks]
+        for task_id in task_ids:
+            _task_guards[task_id] = guard
+        try:
+            result = original_kickoff(self, *args, **kwargs)
+        except StageCancelled:
+            raise
+        except Exception as e:
+            if guard.status is not None:
+                raise StageCancelled(guard.status, guard.reason) from e
+            raise
+        finally:
+            for task_id in task_ids:
+                _task_guards.pop(task_id, None)
+        # Crew 吞掉了被中断请求的错误并照常返回时，结果不完整，同样按取消处理
+        if guard.status is not None:
+            raise StageCancelled(guard.status, guard.reason)
+        return result
+
+    Crew.kickoff = guarded_kickoff
+    Crew._stage_hooks_installed = True
+    crewai_event_bus.on(LLMCallCompletedEvent)(_on_llm_call_completed)
@@ -1,34 +1,37 @@
+import asyncio
 import pdfplumber
 import logging
+from src.core.cache import JsonFileCache
+from src.core.config import get_settings
+from src.core.hashing import file_sha256
 from src.core.llm_factory import llm_factory
-from src.services.session_service import get_session, update_session
+from src.services.cover_title import extract_cover_title
+from src.services.session_service import update_session_fields
 
 logger = logging.getLogger(__name__)
 
-def generate_session_title(session_id: str, file_path: str):
-    """
-    Reads the first page of the PDF and asks the LLM to generate a concise title
-    (e.g., "Company Name 2024 Annual Report").
-    Updates the session's company_name field.
-    """
-    try:
-        text_content = ""
-        with pdfplumber.open(file_path) as pdf:
-            if len(pdf.pages) > 0:
-                first_page = pdf.pages[0]
-                text_content = first_page.extract_text()
-                
-        if not text_content:
-            logger.warning(f"Could not extract text from first page of {file_path}")
-            return
+settings = get_settings()
+
+# 每份文档生成的标题及其来源 (heuristic / dictionary / llm)，按文档内容哈希记录
+title_cache = JsonFileCache("titles")
+
+# 正在运行的标题生成任务（持有引用，避免任务在完成前被垃圾回收）
+_title_tasks: set[asyncio.Task] = set()
 
-        # Truncate to avoid context limit issues, usually first page is enough
-        text_content = text_content[:2000]
+def _read_cover_text(file_path: str) -> str:
+    text_content = ""
+    with pdfplumber.open(file_path) as pdf:
+        if len(pdf.pages) > 0:
+            first_page = pdf.pages[0]
+            text_content = first_page.extract_text() or ""
+    # Truncate to avoid context limit issues, usually first page is enough
+    return text_content[:2000]
 
-        prompt = f"""
+def _build_title_prompt(text_content: str) -> str:
+    return f"""
 You are a helpful assistant. Please identify the Company Name and the Report Type/Year from the following text (which is the cover page of a report).
 Combine them into a short, professional title.
-Examples: 
+Examples:
 - "Apple Inc. 2023 Annual Report"
 - "Tesla Q3 2024 Financial Results"
 - "Kweichow Moutai 2025 Semi-Annual Report"
@@ -39,23 +42,79 @@ Do NOT include quotes in your output. Just the title.
 Text:
 {text_content}
 """
-        llm = llm_factory.get_llm()
-        # CrewAI LLM object usually has .call or .invoke or similar. 
-        # Checking llm_factory usage in other files... 
-        # It's usually a LangChain LLM or similar wrapper. 
-        # Let's assume standard invoke or predict.
-        # Actually in agent.py: self.llm = llm_factory.get_llm(); ... Agent(llm=self.llm...)
-        # If it's langchain_openai.ChatOpenAI, it has .invoke() or .predict()
-        
-        response = llm.predict(prompt)
-        title = response.strip().replace('"', '')
-        
-        logger.info(f"Generated title for session {session_id}: {title}")
-        
-        session = get_session(session_id)
-        if session:
-            session.company_name = title
-            update_session(session)
-            
+
+def _heuristic_title(file_path: str, text_content: str) -> tuple[str, dict | None]:
+    """
+    先查标题记录，再尝试封面页规则识别。返回 (文档哈希, 记录)；置信度不足时记录为 None，需要调用 LLM。
+    """
+    file_hash = file_sha256(file_path)
+    cached = title_cache.get(file_hash)
+    if cached:
+        return file_hash, cached
+    cover = extract_cover_title(text_content)
+    if cover.title and cover.confidence >= settings.TITLE_HEURISTIC_MIN_CONFIDENCE:
+        record = {"title": cover.title, "source": cover.method, "confidence": cover.confidence}
+        title_cache.set(file_hash, record)
+        return file_hash, record
+    logger.info(f"Cover heuristics not confident for {file_path} ({cover.confidence:.2f}), falling back to LLM")
+    return file_hash, None
+
+def _llm_record(file_hash: str, content: str) -> dict:
+    record = {"title": content.strip().replace('"', ''), "source": "llm", "confidence": None}
+    title_cache.set(file_hash, record)
+    return record
+
+def _save_title(session_id: str, record: dict):
+    title = record["title"]
+    logger.info(f"Generated title for session {session_id} via {record['source']}: {title}")
+    update_session_fields(session_id, company_name=title)
+
+def generate_session_title(session_id: str, file_path: str):
+    """
+    Reads the first page of the PDF and builds a concise title (e.g., "Company Name 2024 Annual Report").
+    Cover-page rules are tried first; the LLM is only asked when they are not confident.
+    Updates the session's company_name field.
+    """
+    try:
+        text_content = _read_cover_text(file_path)
+        if not text_content:
+            logger.warning(f"Could not extract text from first page of {file_path}")
+            return
+
+        file_hash, record = _heuristic_title(file_path, text_content)
+        if record is None:
+            response = llm_factory.get_llm().invoke(_build_title_prompt(text_content))
+            record = _llm_record(file_hash, response.content)
+        _save_title(session_id, record)
+
+    except Exception as e:
+        logger.error(f"Error generating session title: {e}")
+
+async def agenerate_session_title(session_id: str, file_path: str):
+    """
+    generate_session_title 的异步版本: 需要 LLM 时请求走 ainvoke（共享的异步 HTTP 连接池），
+    等待响应期间不占用线程池；只有读取封面页和写库这两步短操作放到线程中执行。
+    """
+    try:
+        text_content = await asyncio.to_thread(_read_cover_text, file_path)
+        if not text_content:
+            logger.warning(f"Could not extract text from first page of {file_path}")
+            return
+
+        file_hash, record = await asyncio.to_thread(_heuristic_title, file_path, text_content)
+        if record is None:
+            response = await llm_factory.get_llm().ainvoke(_build_title_prompt(text_content))
+            record = await asyncio.to_thread(_llm_record, file_hash, response.content)
+        await asyncio.to_thread(_save_title, session_id, record)
+
     except Exception as e:
         logger.error(f"Error generating session title: {e}")
+
+def schedule_title_generation(session_id: str, file_path: str) -> asyncio.Task:
+    """
+    在当前事件循环中以 asyncio 任务的方式生成标题（须在异步路由中调用）。
+    """
+    task = asyncio.create_task(agenerate_session_title(session_id, file_path))
+    _title_tasks.add(task)
+    task.add_done_callback(_title_tasks.discard)
+    return task
@@ -1,8 +1,40 @@
 from crewai.tools import BaseTool
+import asyncio
+import contextvars
+import json
 import pdfplumber
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import Type
+from src.core.config import get_settings
 from src.core.llm_factory import llm_factory
+from src.knowledge.chunker import render_table
+from src.knowledge.page_store import iter_pages
+
+settings = get_settings()
+
+def _resolve_pdf_path(file_path: str) -> str:
+    # Agent 拿到的通常是 knowledge 目录下的相对路径 (session_id/xxx.pdf)
+    path = Path(file_path)
+    if not path.exists() and (Path("knowledge") / path).exists():
+        path = Path("knowledge") / path
+    return str(path)
+
+def _build_prompt(table_description: str, text_content: str) -> str:
+    return f"""
+        你是一位专业的财务分析师。你的任务是从下面的文本中提取 '{table_description}'。
+
+        规则:
+        1. 仅以有效的 JSON 格式返回数据。
+        2. JSON 应该是表示行的列表或对象列表。
+        3. 不要包含任何 markdown 格式（如 ```json），只返回原始 JSON 字符串。
+        4. 如果表格被截断，请提取可见部分。
+        5. 如果源文本包含多页，它们是同一张表格的续表，请合并为一张表格输出。
+
+        源文本:
+        {text_content}
+        """
 
 class FinancialTableToolInput(BaseModel):
     file_path: str = Field(..., description="PDF 文件的绝对路径")
@@ -17,36 +49,164 @@ class FinancialTableTool(BaseTool):
     )
     args_schema: Type[BaseModel] = FinancialTableToolInput
 
+    @staticmethod
+    def _read_page(file_path: str, page_number: int) -> str:
+        with pdfplumber.open(_resolve_pdf_path(file_path)) as pdf:
+            if page_number < 1 or page_number > len(pdf.pages):
+                raise IndexError(f"页码 {page_number} 超出范围。")
+            page = pdf.pages[page_number - 1]
+            # Extract text preserving layout as much as possible
+            return page.extract_text(layout=True)
+
     def _run(self, file_path: str, page_number: int, table_description: str) -> str:
         # 1. Extract text from the page
         try:
-            with pdfplumber.open(file_path) as pdf:
-                if page_number < 1 or page_number > len(pdf.pages):
-                    return f"错误: 页码 {page_number} 超出范围。"
-                page = pdf.pages[page_number - 1]
-                # Extract text preserving layout as much as possible
-                text_content = page.extract_text(layout=True)
+            text_content = self._read_page(file_path, page_number)
+        except IndexError as e:
+            return f"错误: {e}"
         except Exception as e:
             return f"读取 PDF 错误: {str(e)}"
 
         # 2. Use LLM to parse the table
-        prompt = f"""
-        你是一位专业的财务分析师。你的任务是从下面的文本中提取 '{table_description}'。
-        
-        规则:
-        1. 仅以有效的 JSON 格式返回数据。
-        2. JSON 应该是表示行的列表或对象列表。
-        3. 不要包含任何 markdown 格式（如 ```json），只返回原始 JSON 字符串。
-        4. 如果表格被截断，请提取可见部分。
-        
-        源文本:
-        {text_content}
-        """
+        prompt = _build_prompt(table_description, text_content)
 
         # Get LLM instance
         llm = llm_factory.get_llm()
-        
+
         # Invoke LLM
         response = llm.invoke(prompt)
-        
+
         return response.content
+
+    async def _arun(self, file_path: str, page_number: int, table_description: str) -> str:
+        try:
+            text_content = await asyncio.to_thread(self._read_page, file_path, page_number)
+        except IndexError as e:
+            return f"错误: {e}"
+        except Exception as e:
+            return f"读取 PDF 错误: {str(e)}"
+
+        response = await llm_factory.get_llm().ainvoke(_build_prompt(table_description, text_content))
+        return response.content
+
+class TableRequest(BaseModel):
+    table_description: str = Field(..., description="要提取的表格描述 (例如 '合并利润表')")
+    page_number: int = Field(..., description="表格起始页码 (从 1 开始)")
+    end_page: int | None = Field(None, description="表格跨页时的结束页码 (含)，单页表格不填")
+
+class FinancialTablesBatchToolInput(BaseModel):
+    file_path: str = Field(..., description="PDF 文件的路径")
+    tables: list[TableRequest] = Field(..., description="要提取的表格列表，例如利润表、资产负债表、现金流量表及其续表页")
+
+class FinancialTablesBatchTool(BaseTool):
+    name: str = "Financial Tables Batch Extractor"
+    description: str = (
+        "Extracts several financial tables from a PDF in one call. Each table is given by a start page "
+        "and an optional end page for tables continued over several pages; continuation pages are merged "
+        "into one table. Returns a JSON list with one entry per table."
+    )
+    args_schema: Type[BaseModel] = FinancialTablesBatchToolInput
+
+    @staticmethod
+    def _group_requests(tables: list[TableRequest]) -> list[tuple[str, list[int]]]:
+        """
+        把请求整理为 (表格描述, 页码列表)。同一表格描述且页码相连的单页请求视为续表，合并为一组。
+        """
+        # 按表格首次出现的顺序输出
+        order = {}
+        for request in tables:
+            order.setdefault(request.table_description, len(order))
+        groups: list[tuple[str, list[int]]] = []
+        for request in sorted(tables, key=lambda t: (order[t.table_description], t.page_number)):
+            end_page = max(request.end_page or request.page_number, request.page_number)
+            pages = list(range(request.page_number, end_page + 1))
+            if groups and groups[-1][0] == request.table_description and groups[-1][1][-1] + 1 >= pages[0]:
+                groups[-1][1].extend(p for p in pages if p not in groups[-1][1])
+            else:
+                groups.append((request.table_description, pages))
+        return groups
+
+    def _prepare(self, file_path: str, tables: list) -> list[tuple[str, list[int], str]] | str:
+        """
+        解析请求并准备每个表格组的 prompt。返回 [(表格描述, 页码列表, prompt)]，出错时返回错误信息。
+        """
+        tables = [t if isinstance(t, TableRequest) else TableRequest.model_validate(t) for t in tables]
+        if not tables:
+            return "错误: 未指定要提取的表格。"
+
+        groups = self._group_requests(tables)
+        wanted = {p for _, page_numbers in groups for p in page_numbers}
+
+        # 整份报告只解析一次（与知识库入库共用页面缓存），逐页读取，只保留请求的页面
+        pages = {}
+        page_count = 0
+        try:
+            for page in iter_pages(_resolve_pdf_path(file_path)):
+                page_count = page.page_number
+                if page.page_number in wanted:
+                    pages[page.page_number] = page
+        except Exception as e:
+            return f"读取 PDF 错误: {str(e)}"
+
+        for _, page_numbers in groups:
+            out_of_range = [p for p in page_numbers if p not in pages]
+            if out_of_range:
+                return f"错误: 页码 {out_of_range} 超出范围 (共 {page_count} 页)。"
+
+        def page_text(page_number: int) -> str:
+            page = pages[page_number]
+            parts = [page.text] + [render_table(rows) for rows in page.tables]
+            return f"--- 第 {page_number} 页 ---\n" + "\n\n".join(p for p in parts if p)
+
+        return [
+            (description, page_numbers, _build_prompt(description, "\n\n".join(page_text(p) for p in page_numbers)))
+            for description, page_numbers in groups
+        ]
+
+    @staticmethod
+    def _result(description: str, page_numbers: list[int], content) -> dict:
+        try:
+            data = json.loads(content)
+        except (json.JSONDecodeError, TypeError):
+            data = content
+        return {"table": description, "pages": page_numbers, "data": data}
+
+    def _run(self, file_path: str, tables: list) -> str:
+        prepared = self._prepare(file_path, tables)
+        if isinstance(prepared, str):
+            return prepared
+        llm = llm_factory.get_llm()
+
+        def extract(item: tuple[str, list[int], str]) -> dict:
+            description, page_numbers, prompt = item
+            try:
+                return self._result(description, page_numbers, llm.invoke(prompt).content)
+            except Exception as e:
+                return {"table": description, "pages": page_numbers, "error": str(e)}
+
+        # 各表格的 LLM 调用并发执行
+        max_workers = max(1, min(len(prepared), settings.FINANCIAL_TABLE_MAX_WORKERS))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 复制调用方的上下文，worker 中的 LLM 调用仍记录在当前工具的 span 下
+            futures = [executor.submit(contextvars.copy_context().run, extract, item) for item in prepared]
+            results = [future.result() for future in futures]
+        return json.dumps(results, ensure_ascii=False)
+
+    async def _arun(self, file_path: str, tables: list) -> str:
+        prepared = await asyncio.to_thread(self._prepare, file_path, tables)
+        if isinstance(prepared, str):
+            return prepared
+        llm = llm_factory.get_llm()
+        semaphore = asyncio.Semaphore(max(1, settings.FINANCIAL_TABLE_MAX_WORKERS))
+
+        async def extract(item: tuple[str, list[int], str]) -> dict:
+            description, page_numbers, prompt = item
+            try:
+                async with semaphore:
+                    response = await llm.ainvoke(prompt)
+                return self._result(description, page_numbers, response.content)
+            except Exception as e:
+                return {"table": description, "pages": page_numbers, "error": str(e)}
+
+        results = await asyncio.gather(*(extract(item) for item in prepared))
+        return json.dumps(list(results), ensure_ascii=False)
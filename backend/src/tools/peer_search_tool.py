@@ -0,0 +1,63 @@
+from crewai.tools import BaseTool
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Optional, Type
+from src.services.financial_ratios import RATIOS, format_value
+from src.services.peer_store import get_peer_store
+
+# 同业表格中展示的指标: key -> (名称, 格式)
+PEER_COLUMNS: dict[str, tuple[str, str]] = {
+    "market_cap": ("总市值(亿元)", "yuan"),
+    **{key: RATIOS[key] for key in (
+        "revenue", "net_income", "gross_margin", "net_margin", "roe", "roic", "revenue_growth", "debt_to_equity",
+    )},
+}
+
+class PeerSearchToolInput(BaseModel):
+    company: Optional[str] = Field(None, description="以同业库中的某家公司为基准（证券代码或公司名称）；留空则以目标公司最新一年的财务比率为基准。")
+    industry: Optional[str] = Field(None, description="行业代码前缀过滤，例如 'C15'；留空时使用基准公司所在行业（如有）。")
+    k: int = Field(8, description="返回的可比公司数量。")
+
+class PeerSearchTool(BaseTool):
+    name: str = "Peer Company Search"
+    description: str = (
+        "Finds the most similar peer companies in the local peer database by size, profitability, growth and leverage, "
+        "optionally filtered by industry code prefix. Returns their key metrics as a Markdown table."
+    )
+    args_schema: Type[BaseModel] = PeerSearchToolInput
+    # 目标公司的比率（financial_ratios.latest_metrics），作为默认查询向量
+    default_metrics: dict = Field(default_factory=dict)
+    # 本次任务中返回过的检索结果，供引用校验核对注明“同业数据库”的句子
+    _results: list[str] = PrivateAttr(default_factory=list)
+
+    @property
+    def results(self) -> list[str]:
+        return list(self._results)
+
+    def _run(self, company: Optional[str] = None, industry: Optional[str] = None, k: int = 8) -> str:
+        store = get_peer_store()
+        if store is None:
+            return "同业数据库不可用（未配置 PEER_DATA_DIR 或目录中没有数据）。"
+        if company and store.find(company) is None:
+            return f"同业数据库中未找到公司: {company}"
+        metrics = None if company else self.default_metrics
+        if not company and not metrics:
+            return "缺少基准: 请指定 company，或先完成财务分析以获得目标公司的财务比率。"
+
+        matches = store.search(metrics=metrics, k=max(1, min(int(k), 50)), industry=industry or None, company=company)
+        if not matches:
+            return "没有找到符合条件的可比公司。"
+
+        columns = [key for key in PEER_COLUMNS if key in store.metrics]
+        lines = [
+            "| 代码 | 公司 | 行业 | 相似度距离 | " + " | ".join(PEER_COLUMNS[key][0] for key in columns) + " |",
+            "|---|---|---|---|" + "---|" * len(columns),
+        ]
+        for match in matches:
+            industry_label = f"{match.industry} {match.industry_name}".strip()
+            cells = [format_value(match.metrics.get(key), PEER_COLUMNS[key][1]) for key in columns]
+            lines.append(f"| {match.code} | {match.name} | {industry_label} | {match.distance:.2f} | " + " | ".join(cells) + " |")
+        lines.append("")
+        lines.append("数据来源: 本地同业数据库（非年报原文，引用时请注明“同业数据库”）。距离越小越相似。")
+        result = "\n".join(lines)
+        self._results.append(result)
+        return result